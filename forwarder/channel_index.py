@@ -0,0 +1,191 @@
+from bisect import bisect_left, insort
+from forwarder.parse_config_update import Channel
+from collections.abc import MutableMapping
+from itertools import count
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+import fnmatch
+import re
+
+_WILDCARD_CHARACTERS = re.compile(r"[*?[]")
+
+
+def _add_to_map(
+    channels_by_field: Dict[Optional[str], Set[Channel]],
+    field: Optional[str],
+    channel: Channel,
+):
+    try:
+        channels_by_field[field].add(channel)
+    except KeyError:
+        channels_by_field[field] = {channel}
+
+
+def _remove_from_map(
+    channels_by_field: Dict[Optional[str], Set[Channel]],
+    field: Optional[str],
+    channel: Channel,
+) -> bool:
+    """
+    :return: Whether no channels are left with the field's value
+    """
+    channels = channels_by_field[field]
+    channels.discard(channel)
+    if channels:
+        return False
+    del channels_by_field[field]
+    return True
+
+
+class ChannelIndex:
+    """
+    Finds the channels matching a REMOVE request without testing every channel.
+    Channels are indexed by PV name, topic and schema. A name or topic without
+    wildcards is looked up directly, a name of the form "PREFIX*" is looked up as
+    a range of the sorted names, and other patterns are only matched against each
+    distinct name or topic rather than against each channel.
+    """
+
+    def __init__(self, channels: Iterable[Channel] = ()):
+        # Position of each channel, so that matches are returned in the order they were added
+        self._order: Dict[Channel, int] = {}
+        self._sequence = count()
+        self._by_name: Dict[Optional[str], Set[Channel]] = {}
+        self._by_topic: Dict[Optional[str], Set[Channel]] = {}
+        self._by_schema: Dict[Optional[str], Set[Channel]] = {}
+        self._sorted_names: List[str] = []
+        for channel in channels:
+            self.add(channel)
+
+    def add(self, channel: Channel):
+        if channel in self._order:
+            return
+        self._order[channel] = next(self._sequence)
+        if channel.name not in self._by_name and channel.name is not None:
+            insort(self._sorted_names, channel.name)
+        _add_to_map(self._by_name, channel.name, channel)
+        _add_to_map(self._by_topic, channel.output_topic, channel)
+        _add_to_map(self._by_schema, channel.schema, channel)
+
+    def remove(self, channels: Iterable[Channel]):
+        """
+        Channels which are not in the index are ignored
+        """
+        for channel in channels:
+            if self._order.pop(channel, None) is None:
+                continue
+            if (
+                _remove_from_map(self._by_name, channel.name, channel)
+                and channel.name is not None
+            ):
+                del self._sorted_names[bisect_left(self._sorted_names, channel.name)]
+            _remove_from_map(self._by_topic, channel.output_topic, channel)
+            _remove_from_map(self._by_schema, channel.schema, channel)
+
+    def clear(self):
+        self._order.clear()
+        self._by_name.clear()
+        self._by_topic.clear()
+        self._by_schema.clear()
+        self._sorted_names.clear()
+
+    def with_name(self, pv_name: Optional[str]) -> Set[Channel]:
+        """
+        Channels for the PV name, with any protocol, topic and schema
+        """
+        return set(self._by_name.get(pv_name, ()))
+
+    def matching(self, remove_channel: Channel) -> List[Channel]:
+        """
+        Channels matching the name and topic patterns and the schema of a REMOVE request,
+        fields which are not given in the request match every channel
+        """
+        candidate_sets = [
+            candidates
+            for candidates in (
+                self._matching_names(remove_channel.name),
+                self._matching_field(self._by_topic, remove_channel.output_topic),
+                self._by_schema.get(remove_channel.schema, set())
+                if remove_channel.schema
+                else None,
+            )
+            if candidates is not None
+        ]
+        if not candidate_sets:
+            matches: Set[Channel] = set(self._order.keys())
+        else:
+            candidate_sets.sort(key=len)
+            matches = candidate_sets[0].intersection(*candidate_sets[1:])
+        return sorted(matches, key=self._order.__getitem__)
+
+    def _matching_names(self, pattern: Optional[str]) -> Optional[Set[Channel]]:
+        if pattern and pattern.endswith("*"):
+            prefix = pattern[:-1]
+            if not _WILDCARD_CHARACTERS.search(prefix):
+                names = self._sorted_names
+                matches: Set[Channel] = set()
+                position = bisect_left(names, prefix)
+                while position < len(names) and names[position].startswith(prefix):
+                    matches.update(self._by_name[names[position]])
+                    position += 1
+                return matches
+        return self._matching_field(self._by_name, pattern)
+
+    @staticmethod
+    def _matching_field(
+        channels_by_field: Dict[Optional[str], Set[Channel]], pattern: Optional[str]
+    ) -> Optional[Set[Channel]]:
+        """
+        :return: Channels whose field matches the pattern, or None if there is no pattern
+        """
+        if not pattern:
+            return None
+        if not _WILDCARD_CHARACTERS.search(pattern):
+            return channels_by_field.get(pattern, set())
+        match = re.compile(fnmatch.translate(pattern)).match
+        matches: Set[Channel] = set()
+        for field, channels in channels_by_field.items():
+            if field is not None and match(field):
+                matches.update(channels)
+        return matches
+
+
+class IndexedUpdateHandlers(MutableMapping):
+    """
+    Update handlers by channel, which keeps a ChannelIndex of its channels up to date,
+    so that the index does not have to be built for each REMOVE request.
+    Every change goes through __setitem__ and __delitem__, so the index stays in step
+    with the mapping whichever MutableMapping method is used to change it.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[Channel, Any] = {}
+        self.channel_index = ChannelIndex()
+
+    def __getitem__(self, channel: Channel) -> Any:
+        return self._handlers[channel]
+
+    def __setitem__(self, channel: Channel, handler: Any):
+        self._handlers[channel] = handler
+        self.channel_index.add(channel)
+
+    def __delitem__(self, channel: Channel):
+        del self._handlers[channel]
+        self.channel_index.remove((channel,))
+
+    def __iter__(self) -> Iterator[Channel]:
+        return iter(self._handlers)
+
+    def __len__(self) -> int:
+        return len(self._handlers)
+
+    def __contains__(self, channel: object) -> bool:
+        return channel in self._handlers
+
+    def __ior__(self, other: Any) -> "IndexedUpdateHandlers":
+        self.update(other)
+        return self
+
+    def clear(self):
+        # Faster than the MutableMapping method, which removes channels one at a time
+        self._handlers.clear()
+        self.channel_index.clear()
@@ -1,5 +1,19 @@
+import math
+import os
 import time
-from typing import Dict
+import uuid
+from threading import Lock
+from typing import (
+    Callable,
+    Collection,
+    FrozenSet,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 from unittest import mock
 from confluent_kafka import TopicPartition
 from streaming_data_types.forwarder_config_update_rf5k import (
@@ -10,58 +24,349 @@ from streaming_data_types.forwarder_config_update_rf5k import (
 from streaming_data_types.fbschemas.forwarder_config_update_rf5k.UpdateType import (
     UpdateType,
 )
-from forwarder.parse_config_update import EpicsProtocol
+from forwarder.application_logger import get_logger
+from forwarder.repeat_timer import ScheduledTask, get_scheduler
+from forwarder.parse_config_update import (
+    Channel,
+    CommandType,
+    ConfigUpdate,
+    EpicsProtocol,
+    parse_config_update,
+)
+
+# Each configuration is stored as a snapshot split into parts of at most
+# _STREAMS_PER_PART streams, so that a large configuration does not exceed
+# the maximum message size. Every part carries these headers.
+_STREAMS_PER_PART = 2000
+_SNAPSHOT_ID_HEADER = "snapshot_id"
+_PART_HEADER = "part"
+_PARTS_HEADER = "parts"
+
+
+def _snapshot_part(message) -> Optional[Tuple[bytes, int, int]]:
+    """
+    :return: The snapshot id, part number and number of parts of a stored message,
+     or None if it is not part of a snapshot
+    """
+    headers = dict(message.headers() or [])
+    try:
+        return (
+            headers[_SNAPSHOT_ID_HEADER],
+            int(headers[_PART_HEADER]),
+            int(headers[_PARTS_HEADER]),
+        )
+    except (KeyError, ValueError):
+        return None
+
+
+def _combine_parts(parts: List[ConfigUpdate]) -> ConfigUpdate:
+    if len(parts) == 1:
+        return parts[0]
+    channels: List[Channel] = []
+    for part in parts:
+        if part.command_type != CommandType.ADD or part.channels is None:
+            return ConfigUpdate(CommandType.MALFORMED, None)
+        channels.extend(part.channels)
+    return ConfigUpdate(CommandType.ADD, tuple(channels))
+
+
+def _streams(channels: Sequence[Channel]) -> List[StreamInfo]:
+    streams = []
+    for channel in channels:
+        if channel.protocol == EpicsProtocol.CA:
+            stream = StreamInfo(
+                channel.name,
+                channel.schema,
+                channel.output_topic,
+                Protocol.Protocol.CA,
+            )
+        else:
+            stream = StreamInfo(
+                channel.name,
+                channel.schema,
+                channel.output_topic,
+                Protocol.Protocol.PVA,
+            )
+        streams.append(stream)
+    return streams
 
 
 class ConfigurationStore:
-    def __init__(self, producer, consumer, topic):
+    def __init__(
+        self,
+        producer,
+        consumer,
+        topic,
+        save_interval_s: float = 0.0,
+        streams_per_part: int = _STREAMS_PER_PART,
+        local_file: Optional[str] = None,
+    ):
+        """
+        :param save_interval_s: Minimum time between saves of the configuration,
+         changes within this time of the last save are saved together at the end of it
+        :param streams_per_part: Maximum number of streams in each message of a stored configuration
+        :param local_file: Optionally a file to also store the configuration in,
+         so that it can be retrieved at start-up without waiting for the broker
+        """
         self._producer = producer
         self._consumer = consumer
         self._topic = topic
+        self._streams_per_part = streams_per_part
+        self._local_file = local_file
+        self._save_interval_s = save_interval_s
+        self._save_lock = Lock()
+        self._saved_channels: Optional[FrozenSet[Channel]] = None
+        self._pending_channels: Optional[Sequence[Channel]] = None
+        self._last_save_time = -math.inf
+        self._save_task: Optional[ScheduledTask] = None
+        self._saving_paused = False
 
-    def save_configuration(self, update_handlers: Dict):
-        streams = []
-        for channel, update_handler in update_handlers.items():
-            if channel.protocol == EpicsProtocol.CA:
-                stream = StreamInfo(
-                    channel.name,
-                    channel.schema,
-                    channel.output_topic,
-                    Protocol.Protocol.CA,
-                )
-            else:
-                stream = StreamInfo(
-                    channel.name,
-                    channel.schema,
-                    channel.output_topic,
-                    Protocol.Protocol.PVA,
+    def save_configuration(self, update_handlers: Mapping):
+        """
+        Store the channels being forwarded, unless they are the same as when last stored.
+        Within the save interval of the last save, the channels are stored when it ends.
+        """
+        channels = tuple(update_handlers.keys())
+        with self._save_lock:
+            self._pending_channels = channels
+            if self._saving_paused or self._save_task is not None:
+                # The scheduled save will store these channels
+                return
+            time_to_next_save = (
+                self._last_save_time + self._save_interval_s - time.monotonic()
+            )
+            if time_to_next_save > 0:
+                self._save_task = get_scheduler().call_later(
+                    time_to_next_save, self._save_pending
                 )
+                return
+        self._save_pending()
+
+    def pause_saving(self):
+        """
+        Keep the channels passed to save_configuration without storing them until
+        resume_saving is called, for example while restoring the stored configuration
+        """
+        with self._save_lock:
+            self._saving_paused = True
+
+    def resume_saving(self):
+        """
+        Store the channels last passed to save_configuration while saving was paused
+        """
+        with self._save_lock:
+            self._saving_paused = False
+        self._save_pending()
 
-            streams.append(stream)
+    def flush(self):
+        """
+        Store any changes to the channels which are waiting for the save interval to end
+        """
+        with self._save_lock:
+            if self._save_task is not None:
+                self._save_task.cancel()
+                self._save_task = None
+        self._save_pending()
+
+    def _save_pending(self):
+        with self._save_lock:
+            if self._saving_paused:
+                return
+            self._save_task = None
+            channels = self._pending_channels
+            self._pending_channels = None
+            if channels is None or frozenset(channels) == self._saved_channels:
+                return
+            self._saved_channels = frozenset(channels)
+            self._last_save_time = time.monotonic()
+            # Stored while holding the lock so that saves are never reordered
+            streams = _streams(channels)
+            self._produce_configuration(streams)
+            if self._local_file is not None:
+                self._write_local_file(streams)
+
+    def _produce_configuration(self, streams: List[StreamInfo]):
         if streams:
-            message = serialise_rf5k(UpdateType.ADD, streams)
+            messages = [
+                serialise_rf5k(
+                    UpdateType.ADD, streams[start : start + self._streams_per_part]
+                )
+                for start in range(0, len(streams), self._streams_per_part)
+            ]
         else:
             # No streams so store a "blank" config
-            message = serialise_rf5k(UpdateType.REMOVEALL, streams)
-        self._producer.produce(self._topic, bytes(message), int(time.time() * 1000))
+            messages = [serialise_rf5k(UpdateType.REMOVEALL, streams)]
+        snapshot_id = uuid.uuid4().hex.encode("utf-8")
+        timestamp_ms = int(time.time() * 1000)
+        for part, message in enumerate(messages):
+            self._producer.produce(
+                self._topic,
+                bytes(message),
+                timestamp_ms,
+                headers=[
+                    (_SNAPSHOT_ID_HEADER, snapshot_id),
+                    (_PART_HEADER, str(part).encode("utf-8")),
+                    (_PARTS_HEADER, str(len(messages)).encode("utf-8")),
+                ],
+            )
 
-    def retrieve_configuration(self):
-        # Retrieve last message
-        topic = TopicPartition(self._topic, 0)
-        _, high_offset = self._consumer.get_watermark_offsets(topic)
-        topic.offset = high_offset - 1
-        self._consumer.assign([topic])
+    def _write_local_file(self, streams: List[StreamInfo]):
+        message = (
+            serialise_rf5k(UpdateType.ADD, streams)
+            if streams
+            else serialise_rf5k(UpdateType.REMOVEALL, streams)
+        )
+        # Replace the file in one step, so that it is never found half written
+        temporary_file = f"{self._local_file}.tmp"
+        try:
+            with open(temporary_file, "wb") as local_file:
+                local_file.write(message)
+                local_file.flush()
+                os.fsync(local_file.fileno())
+            os.replace(temporary_file, self._local_file)  # type: ignore
+        except OSError as error:
+            get_logger().error(f"Could not store configuration in local file: {error}")
 
-        msg = self._consumer.consume(timeout=2)
+    def retrieve_local_configuration(self) -> Optional[ConfigUpdate]:
+        """
+        Get the configuration last stored in the local file,
+        or None if there is no local file or it cannot be read
+        """
+        if self._local_file is None:
+            return None
+        try:
+            with open(self._local_file, "rb") as local_file:
+                return parse_config_update(local_file.read())
+        except FileNotFoundError:
+            return None
+        except OSError as error:
+            get_logger().error(f"Could not read configuration from local file: {error}")
+            return None
 
-        if msg:
-            return msg[~0].value()
-        else:
-            raise RuntimeError("Could not retrieve stored configuration")
+    def retrieve_configuration(self) -> ConfigUpdate:
+        """
+        Get the latest complete stored configuration,
+        a snapshot whose saving was interrupted is skipped
+        """
+        topic = TopicPartition(self._topic, 0)
+        low_offset, high_offset = self._consumer.get_watermark_offsets(topic)
+        end_offset = high_offset - 1
+        while end_offset >= low_offset:
+            last_messages = self._consume_from(end_offset, 1)
+            if not last_messages:
+                break
+            snapshot = _snapshot_part(last_messages[0])
+            if snapshot is None:
+                # Stored as a single message, before snapshots were split into parts
+                return parse_config_update(last_messages[0].value())
+            snapshot_id, part, parts = snapshot
+            if part != parts - 1:
+                # The rest of this snapshot was not stored, try the one before it
+                end_offset -= part + 1
+                continue
+            messages = (
+                self._consume_from(end_offset - parts + 1, parts)
+                if parts > 1
+                else last_messages
+            )
+            if [_snapshot_part(message) for message in messages] == [
+                (snapshot_id, part, parts) for part in range(parts)
+            ]:
+                return _combine_parts(
+                    [parse_config_update(message.value()) for message in messages]
+                )
+            end_offset -= 1
+        raise RuntimeError("Could not retrieve stored configuration")
+
+    def _consume_from(self, offset: int, number_of_messages: int) -> List:
+        self._consumer.assign([TopicPartition(self._topic, 0, offset)])
+        messages: List = []
+        while len(messages) < number_of_messages:
+            consumed = self._consumer.consume(
+                num_messages=number_of_messages - len(messages), timeout=2
+            )
+            if not consumed:
+                break
+            messages.extend(consumed)
+        return messages
 
     def stop(self):
+        # Cancels any scheduled save, storing its changes now
+        self.flush()
         self._producer.close()
         self._consumer.close()
 
 
 NullConfigurationStore = mock.create_autospec(ConfigurationStore)
+
+
+def reconcile_configuration(
+    stored_configuration: ConfigUpdate,
+    forwarded_channels: Collection[Channel],
+    apply_configuration_change: Callable[[ConfigUpdate], None],
+):
+    """
+    Apply the changes which make the channels being forwarded the same as in a
+    stored configuration: remove the channels which are not in it, then add the
+    ones which are missing
+    :param forwarded_channels: The channels already requested to be forwarded
+    """
+    if stored_configuration.command_type == CommandType.REMOVE_ALL:
+        if forwarded_channels:
+            apply_configuration_change(stored_configuration)
+        return
+    if (
+        stored_configuration.command_type != CommandType.ADD
+        or stored_configuration.channels is None
+    ):
+        return
+    stored_channels = set(stored_configuration.channels)
+    extra_channels = tuple(
+        channel for channel in forwarded_channels if channel not in stored_channels
+    )
+    if extra_channels:
+        # Removed exactly, a REMOVE request would also remove channels with the same
+        # name, topic and schema for the other protocol
+        apply_configuration_change(
+            ConfigUpdate(CommandType.REMOVE_EXACT, extra_channels)
+        )
+    missing_channels = tuple(
+        channel
+        for channel in stored_configuration.channels
+        if channel not in forwarded_channels
+    )
+    if missing_channels:
+        apply_configuration_change(ConfigUpdate(CommandType.ADD, missing_channels))
+
+
+def restore_configuration(
+    configuration_store: ConfigurationStore,
+    apply_configuration_change: Callable[[ConfigUpdate], None],
+):
+    """
+    Start forwarding the channels in the local file, if there is one, without waiting
+    for the broker, then forward exactly the channels in the configuration stored in Kafka.
+    Saving is paused until then, so that the local file's channels are not stored in Kafka
+    as a newer configuration before the one there has been retrieved.
+    The channels are reconciled against the local configuration rather than the update
+    handlers, which are filled in asynchronously when forwarding from worker processes.
+    :raises RuntimeError: If the configuration stored in Kafka cannot be retrieved
+    """
+    configuration_store.pause_saving()
+    try:
+        forwarded_channels: Set[Channel] = set()
+        local_configuration = configuration_store.retrieve_local_configuration()
+        if local_configuration is not None:
+            apply_configuration_change(local_configuration)
+            if (
+                local_configuration.command_type == CommandType.ADD
+                and local_configuration.channels is not None
+            ):
+                forwarded_channels.update(local_configuration.channels)
+        reconcile_configuration(
+            configuration_store.retrieve_configuration(),
+            forwarded_channels,
+            apply_configuration_change,
+        )
+    finally:
+        configuration_store.resume_saving()
@@ -1,4 +1,5 @@
 import numpy as np
+from typing import Any, Callable, Dict
 from caproto import ChannelType
 from streaming_data_types.fbschemas.logdata_f142.AlarmStatus import AlarmStatus
 from streaming_data_types.fbschemas.logdata_f142.AlarmSeverity import AlarmSeverity
@@ -90,3 +91,46 @@ pva_alarm_message_to_f142_alarm_status = {
     "READ_ACCESS_ALARM": AlarmStatus.READ_ACCESS,
     "WRITE_ACCESS_ALARM": AlarmStatus.WRITE_ACCESS,
 }
+
+
+def _dtype_converter(
+    input_dtype: np.dtype, output_type
+) -> Callable[[np.ndarray], np.ndarray]:
+    output_dtype = np.dtype(output_type)
+    if input_dtype == output_dtype:
+        return _unchanged
+    if input_dtype.kind != "U" and input_dtype.newbyteorder(
+        "="
+    ) == output_dtype.newbyteorder("="):
+        # Only the byte order differs, for example caproto gives big-endian arrays
+        # Swapped into a new array, the input may be shared with other subscribers
+        return lambda data: data.byteswap().view(output_dtype)
+    return lambda data: data.astype(output_type)
+
+
+def _unchanged(data: np.ndarray) -> np.ndarray:
+    return data
+
+
+class ValueConverter:
+    """
+    Converts PV values to the numpy type they are serialised with, without copying
+    them when they are already of that type.
+    The conversion for each type of input is worked out once, as EPICS clients can give
+    values of different dtypes from the same channel.
+    Input arrays are never modified.
+    """
+
+    def __init__(self, output_type):
+        self._output_type = output_type
+        self._converters: Dict[np.dtype, Callable[[np.ndarray], np.ndarray]] = {}
+
+    def __call__(self, value: Any) -> np.ndarray:
+        data = np.squeeze(np.asarray(value))
+        try:
+            converter = self._converters[data.dtype]
+        except KeyError:
+            converter = self._converters[data.dtype] = _dtype_converter(
+                data.dtype, self._output_type
+            )
+        return converter(data)
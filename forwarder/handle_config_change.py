@@ -1,6 +1,11 @@
-from forwarder.update_handlers.create_update_handler import create_update_handler
-from forwarder.parse_config_update import CommandType, Channel, ConfigUpdate
-from typing import Optional, Dict
+from forwarder.update_handlers.create_update_handler import create_update_handlers
+from forwarder.parse_config_update import (
+    CommandType,
+    Channel,
+    ConfigUpdate,
+    EpicsProtocol,
+)
+from typing import Optional, Dict, MutableMapping, Tuple, List, Sequence, Set
 from logging import Logger
 from forwarder.status_reporter import StatusReporter
 from forwarder.configuration_store import ConfigurationStore, NullConfigurationStore
@@ -8,91 +13,154 @@ from caproto.threading.client import Context as CaContext
 from p4p.client.thread import Context as PvaContext
 from forwarder.kafka.kafka_producer import KafkaProducer
 from forwarder.update_handlers.create_update_handler import UpdateHandler
-import fnmatch
+from forwarder.update_handlers.publish_pipeline import PublishPipeline
+from forwarder.update_handlers.update_filter import ChannelFilters
+from forwarder.channel_index import ChannelIndex, IndexedUpdateHandlers
 
+# Channels with the same protocol and PV name share an update handler, so
+# that there is only one subscription to each PV however many topics and
+# schemas it is forwarded with
+PVKey = Tuple[EpicsProtocol, Optional[str]]
 
-def _subscribe_to_pv(
-    new_channel: Channel,
-    update_handlers: Dict[Channel, UpdateHandler],
+
+def _handlers_by_pv(
+    update_handlers: MutableMapping[Channel, UpdateHandler]
+) -> Dict[PVKey, UpdateHandler]:
+    return {
+        (channel.protocol, channel.name): handler
+        for channel, handler in update_handlers.items()
+    }
+
+
+def _subscribe_to_pvs(
+    new_channels: Sequence[Channel],
+    update_handlers: MutableMapping[Channel, UpdateHandler],
+    handlers_by_pv: Dict[PVKey, UpdateHandler],
     producer: KafkaProducer,
     ca_ctx: CaContext,
     pva_ctx: PvaContext,
     logger: Logger,
     fake_pv_period: int,
     pv_update_period: Optional[int],
+    pipeline: Optional[PublishPipeline],
+    channel_filters: Optional[ChannelFilters],
 ):
-    if new_channel in update_handlers.keys():
-        logger.warning(
-            "Forwarder asked to subscribe to PV it is already has an identical configuration for"
-        )
-        return
+    channels_to_add: List[Channel] = []
+    # Kept as well as the list, so that checking for duplicates is not quadratic
+    channels_seen: Set[Channel] = set()
+    # The first channel for each PV which is not subscribed to yet
+    channels_to_subscribe: Dict[PVKey, Channel] = {}
+    for new_channel in new_channels:
+        if new_channel in update_handlers or new_channel in channels_seen:
+            logger.warning(
+                "Forwarder asked to subscribe to PV it is already has an identical configuration for"
+            )
+            continue
+        channels_to_add.append(new_channel)
+        channels_seen.add(new_channel)
+        pv_key = (new_channel.protocol, new_channel.name)
+        if pv_key not in handlers_by_pv and pv_key not in channels_to_subscribe:
+            channels_to_subscribe[pv_key] = new_channel
 
-    try:
-        update_handlers[new_channel] = create_update_handler(
-            producer,
-            ca_ctx,
-            pva_ctx,
-            new_channel,
-            fake_pv_period,
-            periodic_update_ms=pv_update_period,
-        )
-    except RuntimeError as error:
-        logger.error(str(error))
-    logger.info(
-        f"Subscribed to PV name='{new_channel.name}', schema='{new_channel.schema}', topic='{new_channel.output_topic}'"
+    # Subscribing to each PV separately is slow for large configurations,
+    # so all the new PVs are subscribed to together
+    new_handlers, errors = create_update_handlers(
+        producer,
+        ca_ctx,
+        pva_ctx,
+        list(channels_to_subscribe.values()),
+        fake_pv_period,
+        periodic_update_ms=pv_update_period,
+        pipeline=pipeline,
+        channel_filters=channel_filters,
     )
+    for error in errors:
+        logger.error(str(error))
+    for channel, handler in new_handlers.items():
+        handlers_by_pv[(channel.protocol, channel.name)] = handler
+
+    for new_channel in channels_to_add:
+        pv_key = (new_channel.protocol, new_channel.name)
+        if pv_key not in handlers_by_pv:
+            # Creating the handler failed
+            continue
+        handler = handlers_by_pv[pv_key]
+        if new_channel not in new_handlers:
+            handler.add_sink(new_channel.output_topic, new_channel.schema)  # type: ignore
+        update_handlers[new_channel] = handler
+        logger.info(
+            f"Subscribed to PV name='{new_channel.name}', schema='{new_channel.schema}', topic='{new_channel.output_topic}'"
+        )
 
 
 def _unsubscribe_from_pv(
     remove_channel: Channel,
-    update_handlers: Dict[Channel, UpdateHandler],
+    update_handlers: MutableMapping[Channel, UpdateHandler],
+    channel_index: ChannelIndex,
     logger: Logger,
 ):
-    def _match_channel_field(
-        field_in_remove_request: Optional[str], field_in_existing_channel: Optional[str]
-    ) -> bool:
-        return (
-            True
-            if not field_in_remove_request
-            or field_in_existing_channel == field_in_remove_request
-            else False
-        )
+    channels_to_remove = channel_index.matching(remove_channel)
+    channel_index.remove(channels_to_remove)
+    _remove_channels(channels_to_remove, update_handlers, channel_index)
 
-    def _wildcard_match_channel_field(
-        field_in_remove_request: Optional[str], field_in_existing_channel: Optional[str]
-    ) -> bool:
-        return (
-            True
-            if not field_in_remove_request
-            or fnmatch.fnmatch(field_in_existing_channel, field_in_remove_request)  # type: ignore
-            else False
-        )
+    logger.info(
+        f"Unsubscribed from PVs matching name='{remove_channel.name}', schema='{remove_channel.schema}', topic='{remove_channel.output_topic}'"
+    )
 
-    channels_to_remove = []
-    for channel in update_handlers.keys():
-        matching_fields = (
-            _wildcard_match_channel_field(remove_channel.name, channel.name),
-            _match_channel_field(remove_channel.schema, channel.schema),
-            _wildcard_match_channel_field(
-                remove_channel.output_topic, channel.output_topic
-            ),
-        )
-        if all(matching_fields):
-            channels_to_remove.append(channel)
 
-    for channel in channels_to_remove:
-        update_handlers[channel].stop()
-        del update_handlers[channel]
+def _unsubscribe_from_channels(
+    remove_channels: Sequence[Channel],
+    update_handlers: MutableMapping[Channel, UpdateHandler],
+    logger: Logger,
+):
+    channels_to_remove = [
+        channel for channel in set(remove_channels) if channel in update_handlers
+    ]
+    channel_index = _channel_index(update_handlers)
+    channel_index.remove(channels_to_remove)
+    _remove_channels(channels_to_remove, update_handlers, channel_index)
 
-    logger.info(
-        f"Unsubscribed from PVs matching name='{remove_channel.name}', schema='{remove_channel.schema}', topic='{remove_channel.output_topic}'"
+    logger.info(f"Unsubscribed from {len(channels_to_remove)} channels")
+
+
+def _channel_index(
+    update_handlers: MutableMapping[Channel, UpdateHandler]
+) -> ChannelIndex:
+    return (
+        update_handlers.channel_index
+        if isinstance(update_handlers, IndexedUpdateHandlers)
+        else ChannelIndex(update_handlers.keys())
     )
 
 
+def _remove_channels(
+    channels_to_remove: List[Channel],
+    update_handlers: MutableMapping[Channel, UpdateHandler],
+    channel_index: ChannelIndex,
+):
+    removed = [
+        (channel, update_handlers.pop(channel)) for channel in channels_to_remove
+    ]
+    for channel, handler in removed:
+        # Channels sharing a handler are for the same PV name
+        if any(
+            update_handlers.get(other_channel) is handler
+            for other_channel in channel_index.with_name(channel.name)
+        ):
+            # Another channel shares the subscription to this PV,
+            # so only stop forwarding to this channel's topic and schema
+            handler.remove_sink(channel.output_topic, channel.schema)  # type: ignore
+        else:
+            handler.stop()
+
+
 def _unsubscribe_from_all(
-    update_handlers: Dict[Channel, UpdateHandler], logger: Logger
+    update_handlers: MutableMapping[Channel, UpdateHandler], logger: Logger
 ):
-    for _, update_handler in update_handlers.items():
+    # Stop each handler once, even if it is shared by several channels
+    for update_handler in {
+        id(handler): handler for handler in update_handlers.values()
+    }.values():
         update_handler.stop()
     update_handlers.clear()
     logger.info("Unsubscribed from all PVs")
@@ -102,13 +170,15 @@ def handle_configuration_change(
     configuration_change: ConfigUpdate,
     fake_pv_period: int,
     pv_update_period: Optional[int],
-    update_handlers: Dict[Channel, UpdateHandler],
+    update_handlers: MutableMapping[Channel, UpdateHandler],
     producer: KafkaProducer,
     ca_ctx: CaContext,
     pva_ctx: PvaContext,
     logger: Logger,
     status_reporter: StatusReporter,
     configuration_store: ConfigurationStore = NullConfigurationStore,
+    pipeline: Optional[PublishPipeline] = None,
+    channel_filters: Optional[ChannelFilters] = None,
 ):
     """
     Add or remove update handlers according to the requested change in configuration
@@ -119,19 +189,29 @@ def handle_configuration_change(
         return
     else:
         if configuration_change.channels is not None:
-            for channel in configuration_change.channels:
-                if configuration_change.command_type == CommandType.ADD:
-                    _subscribe_to_pv(
-                        channel,
-                        update_handlers,
-                        producer,
-                        ca_ctx,
-                        pva_ctx,
-                        logger,
-                        fake_pv_period,
-                        pv_update_period,
+            if configuration_change.command_type == CommandType.ADD:
+                _subscribe_to_pvs(
+                    configuration_change.channels,
+                    update_handlers,
+                    _handlers_by_pv(update_handlers),
+                    producer,
+                    ca_ctx,
+                    pva_ctx,
+                    logger,
+                    fake_pv_period,
+                    pv_update_period,
+                    pipeline,
+                    channel_filters,
+                )
+            elif configuration_change.command_type == CommandType.REMOVE:
+                channel_index = _channel_index(update_handlers)
+                for channel in configuration_change.channels:
+                    _unsubscribe_from_pv(
+                        channel, update_handlers, channel_index, logger
                     )
-                elif configuration_change.command_type == CommandType.REMOVE:
-                    _unsubscribe_from_pv(channel, update_handlers, logger)
+            elif configuration_change.command_type == CommandType.REMOVE_EXACT:
+                _unsubscribe_from_channels(
+                    configuration_change.channels, update_handlers, logger
+                )
     status_reporter.report_status()
     configuration_store.save_configuration(update_handlers)
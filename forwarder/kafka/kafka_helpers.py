@@ -1,20 +1,83 @@
 from confluent_kafka import Consumer
-from .kafka_producer import KafkaProducer
+from .kafka_producer import KafkaProducer, BackpressurePolicy
+from .spool import MessageSpool
 from streaming_data_types.logdata_f142 import serialise_f142
 from streaming_data_types.timestamps_tdct import serialise_tdct
 from streaming_data_types.fbschemas.logdata_f142.AlarmStatus import AlarmStatus
 from streaming_data_types.fbschemas.logdata_f142.AlarmSeverity import AlarmSeverity
+from streaming_data_types.fbschemas.logdata_f142.LogData import LogData
+from streaming_data_types.fbschemas.logdata_f142.Value import Value
+import os
+import struct
 import uuid
 import numpy as np
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Dict, Any
 
 
-def create_producer(broker_address: str) -> KafkaProducer:
+# librdkafka settings to trade latency for broker throughput,
+# the forwarder mostly publishes many small messages
+producer_profiles: Dict[str, Dict[str, str]] = {
+    "throughput": {
+        "linger.ms": "50",
+        "batch.num.messages": "100000",
+        "batch.size": "4000000",
+        "compression.type": "lz4",
+        "acks": "1",
+    },
+    "latency": {"linger.ms": "0", "compression.type": "none", "acks": "1"},
+}
+
+
+def create_producer(
+    broker_address: str,
+    profile: Optional[str] = None,
+    config_overrides: Optional[Dict[str, str]] = None,
+    backpressure_policy: BackpressurePolicy = BackpressurePolicy.BLOCK,
+    spool: Optional[MessageSpool] = None,
+    statistics_interval_ms: Optional[int] = None,
+) -> KafkaProducer:
+    """
+    :param broker_address: Kafka broker to publish to
+    :param profile: Optionally the name of one of the producer_profiles to apply
+    :param config_overrides: librdkafka settings, these take precedence over the profile
+    :param backpressure_policy: What to do with messages when the local queue is full, waiting for space
+     by default so that status and storage messages are not dropped
+    :param spool: Optionally where to keep messages which cannot be published yet,
+     instead of applying the backpressure policy
+    :param statistics_interval_ms: Optionally how often to collect librdkafka statistics
+    """
     producer_config = {
         "bootstrap.servers": broker_address,
         "message.max.bytes": "20000000",
     }
-    return KafkaProducer(producer_config)
+    if statistics_interval_ms:
+        producer_config["statistics.interval.ms"] = str(statistics_interval_ms)
+    if profile is not None:
+        try:
+            producer_config.update(producer_profiles[profile])
+        except KeyError:
+            raise ValueError(
+                f"{profile} is not a recognised producer profile, use one of {list(producer_profiles.keys())}"
+            )
+    if config_overrides:
+        producer_config.update(config_overrides)
+    return KafkaProducer(producer_config, backpressure_policy, spool=spool)
+
+
+def create_spool(
+    directory: Optional[str],
+    max_mb: int,
+    replay_rate: float,
+    subdirectory: Optional[str] = None,
+) -> Optional[MessageSpool]:
+    """
+    :return: A spool in directory, or None if no directory is given
+    """
+    if directory is None:
+        return None
+    if subdirectory is not None:
+        directory = os.path.join(directory, subdirectory)
+    return MessageSpool(directory, max_mb * 1024 * 1024, replay_rate=replay_rate)
 
 
 def create_consumer(broker_address: str) -> Consumer:
@@ -42,19 +105,15 @@ def _nanoseconds_to_milliseconds(time_ns: int) -> int:
     return time_ns // 1_000_000
 
 
-def publish_f142_message(
-    producer: KafkaProducer,
-    topic: str,
+def serialise_f142_message(
     data: np.array,
     source_name: str,
     timestamp_ns: int,
     alarm_status: Optional[AlarmStatus] = None,
     alarm_severity: Optional[AlarmSeverity] = None,
-):
+) -> bytes:
     """
-    Publish an f142 message to a given topic.
-    :param producer: Kafka producer to publish update with
-    :param topic: Name of topic to publish to
+    Serialise a PV update as an f142 message.
     :param data: Value of the PV update
     :param source_name: Name of the PV
     :param timestamp_ns: Timestamp for value (nanoseconds after unix epoch)
@@ -62,48 +121,228 @@ def publish_f142_message(
     :param alarm_severity:
     """
     if alarm_status is None:
-        f142_message = serialise_f142(
+        return serialise_f142(
             value=data, source_name=source_name, timestamp_unix_ns=timestamp_ns,
         )
-    else:
-        f142_message = serialise_f142(
-            value=data,
-            source_name=source_name,
-            timestamp_unix_ns=timestamp_ns,
-            alarm_status=alarm_status,
-            alarm_severity=alarm_severity,
-        )
-    producer.produce(
-        topic,
-        f142_message,
-        key=source_name,
-        timestamp_ms=_nanoseconds_to_milliseconds(timestamp_ns),
+    return serialise_f142(
+        value=data,
+        source_name=source_name,
+        timestamp_unix_ns=timestamp_ns,
+        alarm_status=alarm_status,
+        alarm_severity=alarm_severity,
     )
 
 
-def publish_tdct_message(
+def serialise_tdct_message(
+    data: np.array, source_name: str, timestamp_ns: int, *unused,
+) -> bytes:
+    """
+    Serialise a PV update as a tdct message.
+    Currently the tdct does not contain alarms, but if it turns out to be the long term solution
+    for getting chopper timestamps into Kafka they we will likely add alarms to the schema
+
+    :param data: Value of the PV update, a scalar is sent as a single timestamp
+    :param source_name: Name of the PV
+    :param timestamp_ns: Timestamp for value (nanoseconds after unix epoch)
+    :param unused: Allow other args to be passed to match signature of other serialise_*_message functions
+    """
+    return serialise_tdct(name=source_name, timestamps=np.atleast_1d(data))
+
+
+# Defaults of the LogData status and severity fields, FlatBuffers omits
+# fields from the buffer when they have their default value
+_F142_DEFAULT_ALARM_STATUS = AlarmStatus.NO_CHANGE
+_F142_DEFAULT_ALARM_SEVERITY = AlarmSeverity.NO_CHANGE
+
+# vtable offsets of fields in the LogData table, and of the value field in the value tables
+_LOGDATA_TIMESTAMP_FIELD = 10
+_LOGDATA_STATUS_FIELD = 12
+_LOGDATA_SEVERITY_FIELD = 14
+_VALUE_FIELD = 4
+
+_f142_scalar_value_format = {
+    Value.Byte: "<b",
+    Value.UByte: "<B",
+    Value.Short: "<h",
+    Value.UShort: "<H",
+    Value.Int: "<i",
+    Value.UInt: "<I",
+    Value.Long: "<q",
+    Value.ULong: "<Q",
+    Value.Float: "<f",
+    Value.Double: "<d",
+}
+
+_f142_array_element_dtype: Dict[int, np.dtype] = {
+    Value.ArrayByte: np.dtype("<i1"),
+    Value.ArrayUByte: np.dtype("<u1"),
+    Value.ArrayShort: np.dtype("<i2"),
+    Value.ArrayUShort: np.dtype("<u2"),
+    Value.ArrayInt: np.dtype("<i4"),
+    Value.ArrayUInt: np.dtype("<u4"),
+    Value.ArrayLong: np.dtype("<i8"),
+    Value.ArrayULong: np.dtype("<u8"),
+    Value.ArrayFloat: np.dtype("<f4"),
+    Value.ArrayDouble: np.dtype("<f8"),
+}
+
+# Templates are kept for each array length, so PVs whose length keeps
+# changing would otherwise accumulate them
+_MAX_F142_TEMPLATES = 32
+
+
+def _field_position(table, field_offset: int) -> Optional[int]:
+    offset = table.Offset(field_offset)
+    return table.Pos + offset if offset else None
+
+
+class _F142Template:
+    """
+    An f142 buffer produced by serialise_f142, with the positions of the fields
+    which can be overwritten to encode a different update.
+    For an array value, the array's elements in the buffer can be overwritten
+    through a numpy array which shares the buffer's memory.
+    """
+
+    def __init__(self, buffer: bytes):
+        self.buffer = bytearray(buffer)
+        log_data = LogData.GetRootAsLogData(self.buffer, 0)
+        value_table = log_data.Value()
+        self.value_format = ""
+        self.value_position = None
+        self.array = None
+        value_type = log_data.ValueType()
+        if value_type in _f142_array_element_dtype:
+            vector_offset = value_table.Offset(_VALUE_FIELD)
+            self.array = np.frombuffer(
+                self.buffer,
+                dtype=_f142_array_element_dtype[value_type],
+                count=value_table.VectorLen(vector_offset),
+                offset=value_table.Vector(vector_offset),
+            )
+        else:
+            self.value_format = _f142_scalar_value_format[value_type]
+            self.value_position = _field_position(value_table, _VALUE_FIELD)
+        self.timestamp_position = _field_position(
+            log_data._tab, _LOGDATA_TIMESTAMP_FIELD
+        )
+        self.status_position = _field_position(log_data._tab, _LOGDATA_STATUS_FIELD)
+        self.severity_position = _field_position(log_data._tab, _LOGDATA_SEVERITY_FIELD)
+
+    def patch(
+        self, data: np.ndarray, timestamp_ns: int, alarm_status, alarm_severity
+    ) -> bytes:
+        if self.array is not None:
+            np.copyto(self.array, data)
+        elif self.value_position is not None:
+            struct.pack_into(
+                self.value_format, self.buffer, self.value_position, data.item()
+            )
+        if self.timestamp_position is not None:
+            struct.pack_into("<Q", self.buffer, self.timestamp_position, timestamp_ns)
+        if self.status_position is not None:
+            struct.pack_into("<H", self.buffer, self.status_position, alarm_status)
+        if self.severity_position is not None:
+            struct.pack_into("<H", self.buffer, self.severity_position, alarm_severity)
+        # confluent_kafka only accepts immutable bytes as a payload, not a view of the buffer
+        return bytes(self.buffer)
+
+
+class F142Serialiser:
+    """
+    Serialises updates from a single PV as f142 messages.
+
+    For a numeric value the buffer built by serialise_f142 is the same for
+    every update apart from the bytes of the value, timestamp and alarm fields, as
+    long as the value has the same type and length and the same fields are present.
+    So the first buffer for each value type, length and set of present fields is kept
+    as a template, and later updates are encoded by overwriting those fields in it.
+    This matters most for large arrays, which serialise_f142 adds to the buffer one
+    element at a time.
+    Other values are serialised with serialise_f142 every time.
+    """
+
+    def __init__(self, source_name: str):
+        self._source_name = source_name
+        self._templates: Dict[Tuple, _F142Template] = {}
+
+    def serialise(
+        self,
+        data: Any,
+        timestamp_ns: int,
+        alarm_status: Optional[AlarmStatus] = None,
+        alarm_severity: Optional[AlarmSeverity] = None,
+    ) -> bytes:
+        if (
+            not isinstance(data, np.ndarray)
+            or data.ndim > 1
+            or data.dtype.kind not in "iuf"
+        ):
+            return serialise_f142_message(
+                data, self._source_name, timestamp_ns, alarm_status, alarm_severity
+            )
+
+        status_present = (
+            alarm_status is not None and alarm_status != _F142_DEFAULT_ALARM_STATUS
+        )
+        # serialise_f142 ignores the severity if no status is given
+        severity_present = (
+            alarm_status is not None
+            and alarm_severity is not None
+            and alarm_severity != _F142_DEFAULT_ALARM_SEVERITY
+        )
+        template_key = (
+            data.dtype,
+            # A scalar value field is omitted from the buffer when it is zero
+            data.shape if data.ndim else data.item() != 0,
+            timestamp_ns != 0,
+            status_present,
+            severity_present,
+        )
+        try:
+            template = self._templates[template_key]
+        except KeyError:
+            if len(self._templates) >= _MAX_F142_TEMPLATES:
+                self._templates.clear()
+            template = _F142Template(
+                serialise_f142_message(
+                    data, self._source_name, timestamp_ns, alarm_status, alarm_severity
+                )
+            )
+            self._templates[template_key] = template
+        return template.patch(data, timestamp_ns, alarm_status, alarm_severity)
+
+
+class TdctSerialiser:
+    """
+    Serialises updates from a single PV as tdct messages.
+    """
+
+    def __init__(self, source_name: str):
+        self._source_name = source_name
+
+    def serialise(self, data: Any, timestamp_ns: int, *unused) -> bytes:
+        return serialise_tdct_message(data, self._source_name, timestamp_ns)
+
+
+def publish_message(
     producer: KafkaProducer,
     topic: str,
-    data: np.array,
+    payload: bytes,
     source_name: str,
     timestamp_ns: int,
-    *unused,
 ):
     """
-    Publish an tdct message to a given topic.
-    Currently the tdct does not contain alarms, but if it turns out to be the long term solution
-    for getting chopper timestamps into Kafka they we will likely add alarms to the schema
-
+    Publish a serialised PV update to a given topic.
     :param producer: Kafka producer to publish update with
     :param topic: Name of topic to publish to
-    :param data: Value of the PV update
-    :param source_name: Name of the PV
+    :param payload: Serialised PV update
+    :param source_name: Name of the PV, used as the message key
     :param timestamp_ns: Timestamp for value (nanoseconds after unix epoch)
-    :param unused: Allow other args to be passed to match signature of other publish_*_message functions
     """
     producer.produce(
         topic,
-        serialise_tdct(name=source_name, timestamps=data),
+        payload,
         key=source_name,
         timestamp_ms=_nanoseconds_to_milliseconds(timestamp_ns),
     )
@@ -1,35 +1,371 @@
 import confluent_kafka
-from threading import Thread
+from collections import OrderedDict, deque
+from enum import Enum
+from threading import Thread, Lock
 from forwarder.application_logger import setup_logger
-from typing import Optional
+from forwarder.kafka.spool import MessageSpool, SpooledMessage
+from forwarder.kafka.librdkafka_statistics import summarise_statistics
+from forwarder.metrics import Histogram
+from typing import Deque, Dict, List, Optional, Tuple, Union
+import json
+import time
+
+
+class BackpressurePolicy(Enum):
+    """
+    What to do with a message when the producer's local queue is full
+    """
+
+    # Wait up to the block timeout for space in the queue, then drop the message
+    BLOCK = "block"
+    # Hold messages for each topic and key, dropping the oldest beyond a limit
+    DROP_OLDEST = "drop-oldest"
+    # Hold only the latest message for each topic and key
+    KEEP_LATEST = "keep-latest"
+
+
+# Failed deliveries which are worth trying again later, when there is a spool
+_SPOOLED_ERRORS = {
+    confluent_kafka.KafkaError._MSG_TIMED_OUT,
+    confluent_kafka.KafkaError._PURGE_QUEUE,
+    confluent_kafka.KafkaError._PURGE_INFLIGHT,
+    confluent_kafka.KafkaError._TRANSPORT,
+    confluent_kafka.KafkaError._ALL_BROKERS_DOWN,
+}
+# While deliveries are failing, only try one spooled message this often
+_SPOOL_PROBE_INTERVAL_S = 1.0
+
+OverflowKey = Tuple[str, Optional[str]]
+Headers = List[Tuple[str, Union[str, bytes, None]]]
+OverflowMessage = Tuple[bytes, int, Optional[Headers]]
 
 
 class KafkaProducer:
-    def __init__(self, configs: dict):
+    def __init__(
+        self,
+        configs: dict,
+        backpressure_policy: BackpressurePolicy = BackpressurePolicy.BLOCK,
+        block_timeout_s: float = 1.0,
+        max_held_per_key: int = 1000,
+        spool: Optional[MessageSpool] = None,
+        max_held: int = 100_000,
+    ):
+        """
+        Messages held because the local queue is full are limited to max_held_per_key
+        for each topic and key, and to max_held in total, beyond which the oldest are dropped.
+        If a spool is given then messages which do not fit in the local queue,
+        or fail to be delivered as the broker is unavailable, are spooled and
+        published again later, instead of applying the backpressure policy.
+        If statistics.interval.ms is set in the configs then the statistics
+        librdkafka emits are summarised, see librdkafka_statistics()
+        """
+        self._librdkafka_statistics: Optional[dict] = None
+        if int(configs.get("statistics.interval.ms", 0)):
+            configs = dict(configs, stats_cb=self._on_statistics)
         self._producer = confluent_kafka.Producer(configs)
         self._cancelled = False
+        self._delivered_count = 0
+        self._failed_counts: Dict[str, int] = {}
+        self._failed_counts_by_key: Dict[bytes, int] = {}
+        self.delivery_latency = Histogram()
+        self._delivery_latency_by_key: Dict[bytes, Histogram] = {}
+        self._backpressure_policy = backpressure_policy
+        self._block_timeout_s = block_timeout_s
+        self._max_held_per_key = max_held_per_key
+        self._max_held = max_held
+        self._held_count = 0
+        # Messages which did not fit in the local queue, by topic and key,
+        # retried from the poll thread in the order they were first held
+        self._overflow: Dict[OverflowKey, Deque[OverflowMessage]] = OrderedDict()
+        self._overflow_lock = Lock()
+        self._backpressure_counts = {
+            "held": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "blocked": 0,
+        }
+        self._spool = spool
+        self._deliveries_failing = False
+        self._next_spool_probe_time = 0.0
         self._poll_thread = Thread(target=self._poll_loop)
         self._poll_thread.start()
         self.logger = setup_logger()
 
     def _poll_loop(self):
+        # Delivery callbacks are only called from here,
+        # so the delivery counters are only modified by this thread
         while not self._cancelled:
-            self._producer.poll(0.5)
+            if self._spool:
+                self._replay_spool()
+                self._producer.poll(0.05)
+            elif self._overflow:
+                self._produce_overflow()
+                self._producer.poll(0.05)
+            else:
+                self._producer.poll(0.5)
+
+    def _replay_spool(self):
+        if not self._deliveries_failing:
+            self._spool.replay(self._produce_spooled)  # type: ignore
+        elif time.monotonic() >= self._next_spool_probe_time:
+            self._next_spool_probe_time = time.monotonic() + _SPOOL_PROBE_INTERVAL_S
+            self._spool.replay(self._produce_spooled, max_messages=1)  # type: ignore
+
+    def _produce_spooled(self, message: SpooledMessage):
+        topic, key, payload, timestamp_ms = message
+        self._produce(topic, payload, timestamp_ms, key)
+
+    def _on_delivery(self, err, msg):
+        if err and self._spool is not None and err.code() in _SPOOLED_ERRORS:
+            self._deliveries_failing = True
+            key = msg.key()
+            self._spool.append(
+                msg.topic(),
+                None if key is None else key.decode("utf-8"),
+                msg.value(),
+                msg.timestamp()[1],
+            )
+        if err:
+            key = msg.key()
+            self._failed_counts_by_key[key] = self._failed_counts_by_key.get(key, 0) + 1
+            error_name = err.name()
+            if error_name not in self._failed_counts:
+                self.logger.error(f"Message failed delivery: {err}")
+                self._failed_counts[error_name] = 0
+            self._failed_counts[error_name] += 1
+        else:
+            self._deliveries_failing = False
+            self._delivered_count += 1
+            latency = msg.latency()
+            if latency is not None:
+                self.delivery_latency.observe(latency)
+                key = msg.key()
+                try:
+                    self._delivery_latency_by_key[key].observe(latency)
+                except KeyError:
+                    self._delivery_latency_by_key[key] = Histogram()
+                    self._delivery_latency_by_key[key].observe(latency)
+
+    def _on_statistics(self, statistics_json: str):
+        try:
+            self._librdkafka_statistics = summarise_statistics(
+                json.loads(statistics_json)
+            )
+        except (ValueError, KeyError, AttributeError) as error:
+            self.logger.error(f"Could not parse producer statistics: {error}")
+
+    def librdkafka_statistics(self) -> Optional[dict]:
+        """
+        Summary of the latest statistics from librdkafka: queue depth, broker
+        round trip times and batch sizes. None if statistics are not enabled
+        or none have been emitted yet.
+        """
+        return self._librdkafka_statistics
+
+    def delivery_statistics(self) -> dict:
+        """
+        Number of messages delivered, and of failed deliveries by error.
+        Only the first failure with each error is logged.
+        """
+        return {
+            "delivered": self._delivered_count,
+            "failed": dict(self._failed_counts),
+        }
+
+    def queue_length(self) -> int:
+        """
+        Number of messages and requests waiting in the local queue
+        """
+        return len(self._producer)
+
+    def delivery_latency_for(self, key: str) -> Optional[Histogram]:
+        """
+        Time from producing to delivery of messages with the given key,
+        None if none have been delivered
+        """
+        return self._delivery_latency_by_key.get(key.encode("utf-8"))
+
+    def failed_deliveries(self, key: str) -> int:
+        """
+        Number of messages with the given key which failed to be delivered
+        """
+        return self._failed_counts_by_key.get(key.encode("utf-8"), 0)
+
+    def backpressure_statistics(self) -> dict:
+        """
+        Number of messages held back, dropped or replaced by a later message
+        for the same topic and key, and of produce calls which had to wait,
+        because the local queue was full
+        """
+        with self._overflow_lock:
+            return dict(self._backpressure_counts, pending=self._held_count)
 
     def close(self):
         self._cancelled = True
         self._poll_thread.join()
         max_wait_to_publish_producer_queue = 2  # seconds
         self._producer.flush(max_wait_to_publish_producer_queue)
+        if self._spool is not None:
+            # Anything not yet delivered is spooled, to publish on the next run
+            self._producer.purge()
+            self._producer.poll(0)
+            self._spool.close()
+            return
+        if self._overflow:
+            self._produce_overflow()
+            self._producer.flush(max_wait_to_publish_producer_queue)
+        pending = self.backpressure_statistics()["pending"]
+        if pending:
+            self.logger.error(f"{pending} messages were not published")
 
     def produce(
-        self, topic: str, payload: bytes, timestamp_ms: int, key: Optional[str] = None,
+        self,
+        topic: str,
+        payload: bytes,
+        timestamp_ms: int,
+        key: Optional[str] = None,
+        headers: Optional[Headers] = None,
     ):
-        def ack(err, _):
-            if err:
-                self.logger.error(f"Message failed delivery: {err}")
+        """
+        Headers are not kept for messages which are spooled
+        """
+        if self._spool is not None:
+            self._produce_or_spool(topic, payload, timestamp_ms, key, headers)
+            return
+        # Without any held messages the lock is not needed, there are none to wait behind.
+        # A message held by another thread at the same time is not overtaken by one
+        # produced after it, as the two calls are not ordered with respect to each other.
+        if not self._overflow:
+            try:
+                self._produce(topic, payload, timestamp_ms, key, headers)
+                return
+            except BufferError:
+                pass
+        overflow_key = (topic, key)
+        # Checked and held under the lock, so that a message cannot overtake
+        # one held for the same topic and key by another thread
+        with self._overflow_lock:
+            # Messages for a topic and key already being held must wait behind them
+            if overflow_key not in self._overflow:
+                try:
+                    self._produce(topic, payload, timestamp_ms, key, headers)
+                    return
+                except BufferError:
+                    pass
+            if self._backpressure_policy != BackpressurePolicy.BLOCK:
+                self._hold(overflow_key, payload, timestamp_ms, headers)
+                return
+        self._produce_when_space(topic, payload, timestamp_ms, key, headers)
+
+    def _produce_or_spool(
+        self,
+        topic: str,
+        payload: bytes,
+        timestamp_ms: int,
+        key: Optional[str],
+        headers: Optional[Headers],
+    ):
+        # Messages must wait behind those already spooled, to be published in order
+        if not self._spool:
+            try:
+                self._produce(topic, payload, timestamp_ms, key, headers)
+                return
+            except BufferError:
+                pass
+        self._spool.append(topic, key, payload, timestamp_ms)  # type: ignore
 
+    def _produce(
+        self,
+        topic: str,
+        payload: bytes,
+        timestamp_ms: int,
+        key: Optional[str],
+        headers: Optional[Headers] = None,
+    ):
         self._producer.produce(
-            topic, payload, key=key, on_delivery=ack, timestamp=timestamp_ms
+            topic,
+            payload,
+            key=key,
+            on_delivery=self._on_delivery,
+            timestamp=timestamp_ms,
+            headers=headers,
         )
-        self._producer.poll(0)
+
+    def _produce_when_space(
+        self,
+        topic: str,
+        payload: bytes,
+        timestamp_ms: int,
+        key: Optional[str],
+        headers: Optional[Headers],
+    ):
+        # Sleep rather than poll, so that delivery callbacks stay on the poll thread
+        with self._overflow_lock:
+            self._backpressure_counts["blocked"] += 1
+        deadline = time.monotonic() + self._block_timeout_s
+        while time.monotonic() < deadline:
+            time.sleep(0.01)
+            try:
+                self._produce(topic, payload, timestamp_ms, key, headers)
+                return
+            except BufferError:
+                pass
+        with self._overflow_lock:
+            self._backpressure_counts["dropped"] += 1
+
+    def _hold(
+        self,
+        overflow_key: OverflowKey,
+        payload: bytes,
+        timestamp_ms: int,
+        headers: Optional[Headers],
+    ):
+        """
+        Must be called with _overflow_lock held
+        """
+        messages = self._overflow.get(overflow_key)
+        if messages is None:
+            messages = self._overflow[overflow_key] = deque()
+        if self._backpressure_policy == BackpressurePolicy.KEEP_LATEST:
+            if messages:
+                self._held_count -= len(messages)
+                messages.clear()
+                self._backpressure_counts["coalesced"] += 1
+        elif len(messages) >= self._max_held_per_key:
+            messages.popleft()
+            self._held_count -= 1
+            self._backpressure_counts["dropped"] += 1
+        if self._held_count >= self._max_held:
+            self._drop_oldest_held()
+        messages.append((payload, timestamp_ms, headers))
+        self._held_count += 1
+        self._backpressure_counts["held"] += 1
+
+    def _drop_oldest_held(self):
+        """
+        Drop the oldest message held for the topic and key which was held first,
+        must be called with _overflow_lock held
+        """
+        for messages in self._overflow.values():
+            if messages:
+                messages.popleft()
+                self._held_count -= 1
+                self._backpressure_counts["dropped"] += 1
+                # Left in place if emptied, it may be the deque a message is being held in,
+                # the poll thread removes it
+                return
+
+    def _produce_overflow(self):
+        with self._overflow_lock:
+            for overflow_key in list(self._overflow.keys()):
+                topic, key = overflow_key
+                messages = self._overflow[overflow_key]
+                while messages:
+                    payload, timestamp_ms, headers = messages[0]
+                    try:
+                        self._produce(topic, payload, timestamp_ms, key, headers)
+                    except BufferError:
+                        return
+                    messages.popleft()
+                    self._held_count -= 1
+                del self._overflow[overflow_key]
@@ -0,0 +1,45 @@
+from typing import Any, Dict
+
+
+def _microseconds_to_milliseconds(time_us: float) -> float:
+    return round(time_us / 1000, 3)
+
+
+def summarise_statistics(statistics: Dict[str, Any]) -> dict:
+    """
+    Pick the fields relevant to the forwarder's throughput and latency out of the
+    statistics librdkafka emits, see STATISTICS.md in the librdkafka repository.
+    Bootstrap brokers, only used to fetch the cluster metadata, are left out.
+    :param statistics: The parsed statistics JSON
+    """
+    brokers = {}
+    for broker in statistics.get("brokers", {}).values():
+        if broker.get("nodeid", -1) < 0:
+            continue
+        rtt = broker.get("rtt", {})
+        brokers[broker["name"]] = {
+            "state": broker.get("state", ""),
+            "rtt_avg_ms": _microseconds_to_milliseconds(rtt.get("avg", 0)),
+            "rtt_p99_ms": _microseconds_to_milliseconds(rtt.get("p99", 0)),
+            "outbuf_messages": broker.get("outbuf_msg_cnt", 0),
+            "waiting_requests": broker.get("waitresp_cnt", 0),
+            "transmit_errors": broker.get("txerrs", 0),
+        }
+    topics = {}
+    for topic_name, topic in statistics.get("topics", {}).items():
+        batch_size = topic.get("batchsize", {})
+        batch_count = topic.get("batchcnt", {})
+        topics[topic_name] = {
+            "batch_size_avg_bytes": batch_size.get("avg", 0),
+            "batch_size_p99_bytes": batch_size.get("p99", 0),
+            "batch_messages_avg": batch_count.get("avg", 0),
+            "batch_messages_p99": batch_count.get("p99", 0),
+        }
+    return {
+        "queue_messages": statistics.get("msg_cnt", 0),
+        "queue_bytes": statistics.get("msg_size", 0),
+        "transmitted_messages": statistics.get("txmsgs", 0),
+        "transmitted_bytes": statistics.get("txmsg_bytes", 0),
+        "brokers": brokers,
+        "topics": topics,
+    }
@@ -0,0 +1,287 @@
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from threading import Lock
+from typing import Callable, Deque, Optional, Tuple
+from forwarder.application_logger import get_logger
+
+# Each segment file starts with a marker and the position of the next record
+# to replay, which is updated as records are replayed so that after a restart
+# replaying carries on from where it stopped
+_SEGMENT_HEADER = struct.Struct("<4sQ")
+_SEGMENT_MARKER = b"FWSP"
+_READ_POSITION = struct.Struct("<Q")
+_READ_POSITION_OFFSET = 4
+# Checksum, payload length, topic length, key length and timestamp of each record,
+# followed by the topic, key and payload. The checksum is a CRC-32 of the rest of the record.
+# Segment files are zero filled, so a zero topic length marks the end of the records,
+# and a record which is cut short or fails its checksum, such as one being written
+# when the process stopped, marks the end of the records which can be replayed.
+_CHECKSUM = struct.Struct("<I")
+_RECORD_FIELDS = struct.Struct("<IHHq")
+_RECORD_HEADER = struct.Struct("<IIHHq")
+_NO_KEY = 0xFFFF
+_SEGMENT_SUFFIX = ".spool"
+
+SpooledMessage = Tuple[str, Optional[str], bytes, int]
+
+
+class _Segment:
+    """
+    A fixed size file of records, memory mapped, written to from the end of
+    the last record and read from the start.
+    Raises ValueError if an existing file is not a valid segment.
+    """
+
+    def __init__(self, path: str, size: int, create: bool):
+        self.path = path
+        with open(path, "a+b") as segment_file:
+            if create:
+                segment_file.truncate(size)
+            elif os.fstat(segment_file.fileno()).st_size < _SEGMENT_HEADER.size:
+                raise ValueError(f"{path} is too short to be a spool segment")
+            self._map = mmap.mmap(segment_file.fileno(), 0)
+        self.size = len(self._map)
+        self.write_position = _SEGMENT_HEADER.size
+        if create:
+            _SEGMENT_HEADER.pack_into(
+                self._map, 0, _SEGMENT_MARKER, _SEGMENT_HEADER.size
+            )
+            self._read_position = _SEGMENT_HEADER.size
+            return
+        marker, read_position = _SEGMENT_HEADER.unpack_from(self._map, 0)
+        if marker != _SEGMENT_MARKER:
+            self._map.close()
+            raise ValueError(f"{path} is not a spool segment")
+        record = self._record_at(self.write_position)
+        while record is not None:
+            self.write_position = record[1]
+            record = self._record_at(self.write_position)
+        self._read_position = min(
+            max(read_position, _SEGMENT_HEADER.size), self.write_position
+        )
+
+    @property
+    def read_position(self) -> int:
+        return self._read_position
+
+    @read_position.setter
+    def read_position(self, position: int):
+        self._read_position = position
+        _READ_POSITION.pack_into(self._map, _READ_POSITION_OFFSET, position)
+
+    def _record_at(self, position: int) -> Optional[Tuple[SpooledMessage, int]]:
+        """
+        :return: The record starting at position, and where the next record starts
+        """
+        if position + _RECORD_HEADER.size > self.size:
+            return None
+        (
+            checksum,
+            payload_length,
+            topic_length,
+            key_length,
+            timestamp_ms,
+        ) = _RECORD_HEADER.unpack_from(self._map, position)
+        if topic_length == 0:
+            return None
+        end = (
+            position
+            + _RECORD_HEADER.size
+            + topic_length
+            + (0 if key_length == _NO_KEY else key_length)
+            + payload_length
+        )
+        if (
+            end > self.size
+            or zlib.crc32(self._map[position + _CHECKSUM.size : end]) != checksum
+        ):
+            return None
+        position += _RECORD_HEADER.size
+        topic = self._map[position : position + topic_length].decode("utf-8")
+        position += topic_length
+        key = None
+        if key_length != _NO_KEY:
+            key = self._map[position : position + key_length].decode("utf-8")
+            position += key_length
+        payload = self._map[position:end]
+        return (topic, key, payload, timestamp_ms), end
+
+    def append(self, record: bytes) -> bool:
+        if self.write_position + len(record) > self.size:
+            return False
+        self._map[self.write_position : self.write_position + len(record)] = record
+        self.write_position += len(record)
+        return True
+
+    def peek(self) -> Optional[Tuple[SpooledMessage, int]]:
+        if self.read_position >= self.write_position:
+            return None
+        return self._record_at(self.read_position)
+
+    @property
+    def used_bytes(self) -> int:
+        return self.write_position - self.read_position
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+
+    def delete(self):
+        self._map.close()
+        os.remove(self.path)
+
+
+class MessageSpool:
+    """
+    Append-only spool of messages on disk, in memory mapped segment files, for
+    messages which could not be given to the Kafka producer. Messages are replayed
+    in the order they were spooled, at no more than replay_rate messages per second.
+    When more than max_bytes are spooled the oldest segment is dropped.
+    Segments left by a previous run are replayed from the first message which had
+    not been replayed, files in the directory which are not valid segments are deleted.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 1024 * 1024 * 1024,
+        segment_bytes: int = 64 * 1024 * 1024,
+        replay_rate: float = 10000,
+    ):
+        self._logger = get_logger()
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._segment_bytes = min(segment_bytes, max_bytes)
+        self._replay_interval_s = 1 / replay_rate
+        self._next_replay_time = 0.0
+        self._lock = Lock()
+        self._next_segment_number = 0
+        self._segments: Deque[_Segment] = deque()
+        self.spooled_count = 0
+        self.replayed_count = 0
+        self.dropped_count = 0
+
+        os.makedirs(directory, exist_ok=True)
+        existing_segments = sorted(
+            file_name
+            for file_name in os.listdir(directory)
+            if file_name.endswith(_SEGMENT_SUFFIX)
+        )
+        for file_name in existing_segments:
+            path = os.path.join(directory, file_name)
+            try:
+                self._next_segment_number = int(file_name[: -len(_SEGMENT_SUFFIX)]) + 1
+                self._segments.append(_Segment(path, 0, create=False))
+            except ValueError as error:
+                # For example a segment file created just before a crash
+                self._logger.error(f"Deleting invalid spool segment: {error}")
+                os.remove(path)
+        if self._segments:
+            self._logger.info(
+                f"Replaying {len(self._segments)} spool segments from {directory}"
+            )
+
+    def spooled_bytes(self) -> int:
+        """
+        Size of the messages waiting to be replayed
+        """
+        with self._lock:
+            return sum(segment.used_bytes for segment in self._segments)
+
+    def append(self, topic: str, key: Optional[str], payload: bytes, timestamp_ms: int):
+        encoded_topic = topic.encode("utf-8")
+        encoded_key = b"" if key is None else key.encode("utf-8")
+        checksummed = (
+            _RECORD_FIELDS.pack(
+                len(payload),
+                len(encoded_topic),
+                _NO_KEY if key is None else len(encoded_key),
+                timestamp_ms,
+            )
+            + encoded_topic
+            + encoded_key
+            + payload
+        )
+        record = _CHECKSUM.pack(zlib.crc32(checksummed)) + checksummed
+        with self._lock:
+            if len(record) > self._segment_bytes - _SEGMENT_HEADER.size:
+                self.dropped_count += 1
+                return
+            if not self._segments or not self._segments[-1].append(record):
+                self._new_segment()
+                self._segments[-1].append(record)
+            self.spooled_count += 1
+
+    def _new_segment(self):
+        while self._segments and (
+            (len(self._segments) + 1) * self._segment_bytes > self._max_bytes
+        ):
+            oldest_segment = self._segments.popleft()
+            dropped = self._count_records(oldest_segment)
+            oldest_segment.delete()
+            self.dropped_count += dropped
+            self._logger.error(
+                f"Spool is full, dropped {dropped} messages from {oldest_segment.path}"
+            )
+        path = os.path.join(
+            self._directory, f"{self._next_segment_number:010d}{_SEGMENT_SUFFIX}"
+        )
+        self._next_segment_number += 1
+        self._segments.append(_Segment(path, self._segment_bytes, create=True))
+
+    @staticmethod
+    def _count_records(segment: _Segment) -> int:
+        count = 0
+        record = segment.peek()
+        while record is not None:
+            count += 1
+            segment.read_position = record[1]
+            record = segment.peek()
+        return count
+
+    def replay(
+        self,
+        produce: Callable[[SpooledMessage], None],
+        max_messages: Optional[int] = None,
+    ):
+        """
+        Pass spooled messages to produce, in order, as fast as the replay rate allows.
+        Stops at the first message produce raises BufferError for, it is replayed again next time.
+        :param max_messages: Optionally replay no more than this many messages
+        """
+        replayed = 0
+        with self._lock:
+            while self._segments and replayed != max_messages:
+                now = time.monotonic()
+                if now < self._next_replay_time:
+                    return
+                segment = self._segments[0]
+                record = segment.peek()
+                if record is None:
+                    # Fully replayed, appends go to a new segment
+                    self._segments.popleft().delete()
+                    continue
+                message, next_position = record
+                try:
+                    produce(message)
+                except BufferError:
+                    return
+                segment.read_position = next_position
+                self.replayed_count += 1
+                replayed += 1
+                self._next_replay_time = (
+                    max(self._next_replay_time, now - 1) + self._replay_interval_s
+                )
+
+    def __bool__(self) -> bool:
+        return bool(self._segments)
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+            self._segments.clear()
@@ -0,0 +1,581 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+import math
+import threading
+from forwarder.application_logger import get_logger
+from forwarder.repeat_timer import scheduler_statistics
+
+# Histogram buckets cover values from 2**(_MIN_EXPONENT) seconds, about a microsecond,
+# to 2**_MAX_EXPONENT seconds, each power of two divided into _SUB_BUCKETS equal buckets
+_MIN_EXPONENT = -20
+_MAX_EXPONENT = 8
+_SUB_BUCKETS = 8
+_NUMBER_OF_BUCKETS = (_MAX_EXPONENT - _MIN_EXPONENT) * _SUB_BUCKETS + 2
+
+
+def _bucket_index(value: float) -> int:
+    # Buckets include their upper bound, as Prometheus buckets do
+    if value <= 0:
+        return 0
+    mantissa, exponent = math.frexp(value)
+    if exponent <= _MIN_EXPONENT:
+        return 0
+    index = (exponent - _MIN_EXPONENT - 1) * _SUB_BUCKETS + math.ceil(
+        (mantissa - 0.5) * 2 * _SUB_BUCKETS
+    )
+    return min(index, _NUMBER_OF_BUCKETS - 1)
+
+
+def _bucket_upper_bound(index: int) -> float:
+    if index == 0:
+        return 2.0 ** _MIN_EXPONENT
+    if index == _NUMBER_OF_BUCKETS - 1:
+        return math.inf
+    exponent, sub_bucket = divmod(index - 1, _SUB_BUCKETS)
+    return 2.0 ** (exponent + _MIN_EXPONENT) * (1 + (sub_bucket + 1) / _SUB_BUCKETS)
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    label_pairs = ",".join(
+        f'{name}="{_escape_label_value(value)}"' for name, value in labels.items()
+    )
+    return f"{{{label_pairs}}}"
+
+
+class Histogram:
+    """
+    Counts of observed durations, in seconds, in HDR-style log-linear buckets.
+    Each power of two is split into equal buckets, so values are recorded with
+    a relative error of at most 1/8 from microseconds to minutes, in a fixed
+    amount of memory and without allocating when a value is observed.
+    Observations from different threads are not synchronised,
+    so under contention a few may be missed.
+    """
+
+    def __init__(self):
+        self._counts = [0] * _NUMBER_OF_BUCKETS
+        self._sum = 0.0
+        self._max = 0.0
+
+    def observe(self, value: float):
+        self._counts[_bucket_index(value)] += 1
+        self._sum += value
+        if value > self._max:
+            self._max = value
+
+    def merge(self, other: "Histogram"):
+        """
+        Add the values observed by another histogram
+        """
+        for index, count in enumerate(list(other._counts)):
+            self._counts[index] += count
+        self._sum += other._sum
+        self._max = max(self._max, other._max)
+
+    def copy(self) -> "Histogram":
+        histogram = Histogram()
+        histogram.merge(self)
+        return histogram
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def percentile(self, percent: float) -> float:
+        """
+        The upper bound of the bucket containing the given percentile of observed values,
+        or 0 if there are none
+        """
+        counts = list(self._counts)
+        target = sum(counts) * percent / 100
+        cumulative_count = 0
+        for index, count in enumerate(counts):
+            cumulative_count += count
+            if count and cumulative_count >= target:
+                return min(_bucket_upper_bound(index), self._max)
+        return 0.0
+
+    def summary(self) -> dict:
+        """
+        Number of values observed and percentiles, in milliseconds
+        """
+        return {
+            "count": self.count,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p90_ms": round(self.percentile(90) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self._max * 1000, 3),
+        }
+
+    def prometheus_lines(self, name: str, labels: Dict[str, str]) -> List[str]:
+        # Only powers of two are used as Prometheus bucket bounds, they
+        # fall on bucket boundaries so the cumulative counts are exact
+        lines = []
+        counts = list(self._counts)
+        cumulative_count = counts[0]
+        for exponent in range(_MIN_EXPONENT, _MAX_EXPONENT + 1):
+            lines.append(
+                f"{name}_bucket{_labels(dict(labels, le=repr(2.0 ** exponent)))} {cumulative_count}"
+            )
+            first_bucket = 1 + (exponent - _MIN_EXPONENT) * _SUB_BUCKETS
+            # After the last power of two this adds the count of values above every bucket
+            cumulative_count += sum(counts[first_bucket : first_bucket + _SUB_BUCKETS])
+        lines.append(
+            f"{name}_bucket{_labels(dict(labels, le='+Inf'))} {cumulative_count}"
+        )
+        lines.append(f"{name}_sum{_labels(labels)} {self._sum}")
+        lines.append(f"{name}_count{_labels(labels)} {cumulative_count}")
+        return lines
+
+
+# Time taken to serialise and publish each PV update
+publish_duration = Histogram()
+# Time from the EPICS timestamp of each PV update to it arriving in the forwarder
+epics_to_callback_latency = Histogram()
+# Time from each PV update arriving to it being passed to the producer
+callback_to_produce_latency = Histogram()
+
+
+def latency_summary(producer: Any = None) -> dict:
+    """
+    Latencies of all PV updates, for the status message
+    :param producer: Optionally the KafkaProducer publishing PV updates, to include delivery latency
+    """
+    summary = {
+        "epics_to_callback": epics_to_callback_latency.summary(),
+        "callback_to_produce": callback_to_produce_latency.summary(),
+    }
+    if producer is not None:
+        summary["produce_to_delivery"] = producer.delivery_latency.summary()
+    return summary
+
+
+class MetricsWriter:
+    """
+    Writes metrics in the Prometheus text exposition format,
+    keeping the samples of each metric together after its description
+    """
+
+    def __init__(self):
+        self._families: Dict[str, List[str]] = {}
+
+    def _family(self, name: str, metric_type: str, description: str) -> List[str]:
+        try:
+            return self._families[name]
+        except KeyError:
+            family = [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+            self._families[name] = family
+            return family
+
+    def add(
+        self,
+        name: str,
+        metric_type: str,
+        description: str,
+        value: float,
+        labels: Dict[str, str] = {},
+    ):
+        self._family(name, metric_type, description).append(
+            f"{name}{_labels(labels)} {value}"
+        )
+
+    def add_histogram(
+        self,
+        name: str,
+        description: str,
+        histogram: Histogram,
+        labels: Dict[str, str] = {},
+    ):
+        self._family(name, "histogram", description).extend(
+            histogram.prometheus_lines(name, labels)
+        )
+
+    def text(self) -> str:
+        return (
+            "\n".join(line for family in self._families.values() for line in family)
+            + "\n"
+        )
+
+
+# Per-channel statistics exposed as metrics, with their type and description
+_channel_metrics: Tuple[Tuple[str, str, str, str], ...] = (
+    (
+        "updates_received",
+        "forwarder_channel_updates_received_total",
+        "counter",
+        "PV updates received",
+    ),
+    (
+        "messages_published",
+        "forwarder_channel_messages_published_total",
+        "counter",
+        "Messages published",
+    ),
+    (
+        "bytes_published",
+        "forwarder_channel_bytes_published_total",
+        "counter",
+        "Bytes of messages published",
+    ),
+    (
+        "delivery_failures",
+        "forwarder_channel_delivery_failures_total",
+        "counter",
+        "Messages which failed to be delivered",
+    ),
+    (
+        "update_rate_hz",
+        "forwarder_channel_update_rate_hz",
+        "gauge",
+        "Rate of PV updates received",
+    ),
+)
+
+
+# librdkafka statistics exposed as metrics, with their type and description,
+# for each broker and each topic, and how to scale them to base units
+_librdkafka_broker_metrics: Tuple[Tuple[str, str, str, str, float], ...] = (
+    (
+        "rtt_avg_ms",
+        "forwarder_librdkafka_broker_rtt_avg_seconds",
+        "gauge",
+        "Average round trip time of requests to the broker",
+        0.001,
+    ),
+    (
+        "rtt_p99_ms",
+        "forwarder_librdkafka_broker_rtt_p99_seconds",
+        "gauge",
+        "99th percentile round trip time of requests to the broker",
+        0.001,
+    ),
+    (
+        "outbuf_messages",
+        "forwarder_librdkafka_broker_outbuf_messages",
+        "gauge",
+        "Messages waiting to be sent to the broker",
+        1,
+    ),
+    (
+        "waiting_requests",
+        "forwarder_librdkafka_broker_waiting_requests",
+        "gauge",
+        "Requests sent to the broker waiting for a response",
+        1,
+    ),
+    (
+        "transmit_errors",
+        "forwarder_librdkafka_broker_transmit_errors_total",
+        "counter",
+        "Errors sending requests to the broker",
+        1,
+    ),
+)
+_librdkafka_topic_metrics: Tuple[Tuple[str, str, str, str, float], ...] = (
+    (
+        "batch_size_avg_bytes",
+        "forwarder_librdkafka_topic_batch_size_avg_bytes",
+        "gauge",
+        "Average size of batches of messages sent to the topic",
+        1,
+    ),
+    (
+        "batch_messages_avg",
+        "forwarder_librdkafka_topic_batch_messages_avg",
+        "gauge",
+        "Average number of messages in batches sent to the topic",
+        1,
+    ),
+)
+
+
+def _add_librdkafka_metrics(
+    writer: MetricsWriter, statistics: dict, labels: Dict[str, str]
+):
+    writer.add(
+        "forwarder_librdkafka_queue_messages",
+        "gauge",
+        "Messages in librdkafka's queues, waiting to be sent or delivered",
+        statistics["queue_messages"],
+        labels,
+    )
+    writer.add(
+        "forwarder_librdkafka_queue_bytes",
+        "gauge",
+        "Bytes of messages in librdkafka's queues",
+        statistics["queue_bytes"],
+        labels,
+    )
+    for (
+        statistic,
+        name,
+        metric_type,
+        description,
+        scale,
+    ) in _librdkafka_broker_metrics:
+        for broker_name, broker in statistics["brokers"].items():
+            writer.add(
+                name,
+                metric_type,
+                description,
+                broker[statistic] * scale,
+                dict(labels, broker=broker_name),
+            )
+    for (
+        statistic,
+        name,
+        metric_type,
+        description,
+        scale,
+    ) in _librdkafka_topic_metrics:
+        for topic_name, topic in statistics["topics"].items():
+            writer.add(
+                name,
+                metric_type,
+                description,
+                topic[statistic] * scale,
+                dict(labels, topic=topic_name),
+            )
+
+
+def _add_channel_metrics(
+    writer: MetricsWriter, channel_statistics: Iterable[Tuple[Dict[str, str], dict]]
+):
+    """
+    :param channel_statistics: Labels identifying each PV, with the statistics of its update handler
+    """
+    channel_statistics = list(channel_statistics)
+    for statistic, name, metric_type, description in _channel_metrics:
+        for labels, statistics in channel_statistics:
+            writer.add(name, metric_type, description, statistics[statistic], labels)
+
+
+def _channel_labels(channel: Any) -> Dict[str, str]:
+    # A PV can be forwarded over both CA and PVA, each with its own update handler
+    return {"channel": channel.name, "protocol": channel.protocol.value}
+
+
+def process_statistics(producer: Any = None, pipeline: Any = None) -> dict:
+    """
+    Statistics of the PV updates forwarded by this process, as plain data
+    which a worker process can send to the supervisor process
+    :param producer: Optionally the KafkaProducer publishing PV updates
+    :param pipeline: Optionally the PublishPipeline the updates go through
+    """
+    statistics: Dict[str, Any] = {
+        "histograms": {
+            "publish_duration": publish_duration.copy(),
+            "epics_to_callback": epics_to_callback_latency.copy(),
+            "callback_to_produce": callback_to_produce_latency.copy(),
+        },
+        "periodic_updates": scheduler_statistics(),
+    }
+    if producer is not None:
+        statistics["producer"] = {
+            "delivery": producer.delivery_statistics(),
+            "queue_length": producer.queue_length(),
+            "backpressure": producer.backpressure_statistics(),
+            "delivery_latency": producer.delivery_latency.copy(),
+            "librdkafka": producer.librdkafka_statistics(),
+        }
+    if pipeline is not None:
+        statistics["publish_pipeline"] = pipeline.statistics()
+    return statistics
+
+
+def merged_latency_summary(statistics: Iterable[dict]) -> dict:
+    """
+    Latencies of all PV updates forwarded by several processes, for the status message
+    :param statistics: The process_statistics of each process
+    """
+    epics_to_callback = Histogram()
+    callback_to_produce = Histogram()
+    produce_to_delivery = Histogram()
+    for process in statistics:
+        epics_to_callback.merge(process["histograms"]["epics_to_callback"])
+        callback_to_produce.merge(process["histograms"]["callback_to_produce"])
+        if "producer" in process:
+            produce_to_delivery.merge(process["producer"]["delivery_latency"])
+    return {
+        "epics_to_callback": epics_to_callback.summary(),
+        "callback_to_produce": callback_to_produce.summary(),
+        "produce_to_delivery": produce_to_delivery.summary(),
+    }
+
+
+def _add_process_metrics(
+    writer: MetricsWriter, statistics: dict, labels: Dict[str, str]
+):
+    producer_statistics = statistics.get("producer")
+    if producer_statistics is not None:
+        delivery_statistics = producer_statistics["delivery"]
+        writer.add(
+            "forwarder_producer_messages_delivered_total",
+            "counter",
+            "Messages delivered to the broker",
+            delivery_statistics["delivered"],
+            labels,
+        )
+        for error_name, count in delivery_statistics["failed"].items():
+            writer.add(
+                "forwarder_producer_delivery_failures_total",
+                "counter",
+                "Messages which failed to be delivered, by error",
+                count,
+                dict(labels, error=error_name),
+            )
+        writer.add(
+            "forwarder_producer_queue_length",
+            "gauge",
+            "Messages and requests waiting in the producer's local queue",
+            producer_statistics["queue_length"],
+            labels,
+        )
+        backpressure_statistics = dict(producer_statistics["backpressure"])
+        writer.add(
+            "forwarder_producer_backpressure_pending",
+            "gauge",
+            "Messages held back until there is space in the producer's queue",
+            backpressure_statistics.pop("pending"),
+            labels,
+        )
+        for outcome, count in backpressure_statistics.items():
+            writer.add(
+                "forwarder_producer_backpressure_total",
+                "counter",
+                "Messages affected by the producer's queue being full, by outcome",
+                count,
+                dict(labels, outcome=outcome),
+            )
+        writer.add_histogram(
+            "forwarder_producer_delivery_latency_seconds",
+            "Time from producing a message to its delivery being acknowledged",
+            producer_statistics["delivery_latency"],
+            labels,
+        )
+        if producer_statistics["librdkafka"] is not None:
+            _add_librdkafka_metrics(writer, producer_statistics["librdkafka"], labels)
+
+    pipeline_statistics = statistics.get("publish_pipeline")
+    if pipeline_statistics is not None:
+        writer.add(
+            "forwarder_publish_pipeline_queued",
+            "gauge",
+            "PV updates waiting in the publish pipeline",
+            pipeline_statistics["queued"],
+            labels,
+        )
+        writer.add(
+            "forwarder_publish_pipeline_dropped_total",
+            "counter",
+            "PV updates dropped because the publish pipeline was full",
+            pipeline_statistics["dropped"],
+            labels,
+        )
+
+    histograms = statistics["histograms"]
+    writer.add_histogram(
+        "forwarder_publish_duration_seconds",
+        "Time taken to serialise and publish a PV update",
+        histograms["publish_duration"],
+        labels,
+    )
+    writer.add_histogram(
+        "forwarder_epics_to_callback_latency_seconds",
+        "Time from the EPICS timestamp of a PV update to it arriving in the forwarder",
+        histograms["epics_to_callback"],
+        labels,
+    )
+    writer.add_histogram(
+        "forwarder_callback_to_produce_latency_seconds",
+        "Time from a PV update arriving to it being passed to the producer",
+        histograms["callback_to_produce"],
+        labels,
+    )
+
+
+def collect_metrics(
+    update_handlers: Mapping[Any, Any],
+    producer: Any,
+    pipeline: Any = None,
+    worker_statistics: Optional[Dict[int, dict]] = None,
+) -> str:
+    """
+    Process, producer and per-PV metrics
+    :param update_handlers: Update handlers by channel, handlers shared by several channels are counted once
+    :param producer: The KafkaProducer publishing PV updates
+    :param pipeline: Optionally the PublishPipeline the updates go through
+    :param worker_statistics: The process_statistics last reported by each worker process, when PVs are
+     forwarded from worker processes, these are reported instead of this process's, labelled by worker
+    """
+    writer = MetricsWriter()
+    handlers = {
+        id(handler): (_channel_labels(channel), handler)
+        for channel, handler in list(update_handlers.items())
+        if hasattr(handler, "statistics")
+    }
+    writer.add(
+        "forwarder_channels", "gauge", "Configured streams", len(update_handlers)
+    )
+    writer.add("forwarder_update_handlers", "gauge", "PVs subscribed to", len(handlers))
+    writer.add("forwarder_threads", "gauge", "Threads", threading.active_count())
+
+    if worker_statistics is None:
+        _add_process_metrics(writer, process_statistics(producer, pipeline), {})
+    else:
+        for worker_index, statistics in sorted(list(worker_statistics.items())):
+            _add_process_metrics(writer, statistics, {"worker": str(worker_index)})
+
+    _add_channel_metrics(
+        writer,
+        ((labels, handler.statistics()) for labels, handler in handlers.values()),
+    )
+    return writer.text()
+
+
+class MetricsServer:
+    """
+    Serves metrics over HTTP for Prometheus to scrape, from a background thread
+    """
+
+    def __init__(self, port: int, collect: Callable[[], str]):
+        logger = get_logger()
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    body = collect().encode("utf-8")
+                except Exception as error:
+                    logger.error(f"Failed to collect metrics: {error}")
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("", port), MetricsRequestHandler)
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -3,6 +3,10 @@ import configargparse
 from os import getpid
 from socket import gethostname
 import configparser
+import argparse
+from typing import Tuple
+from forwarder.kafka.kafka_helpers import producer_profiles
+from forwarder.kafka.kafka_producer import BackpressurePolicy
 
 
 class VersionArgParser(configargparse.ArgumentParser):
@@ -19,6 +23,13 @@ class VersionArgParser(configargparse.ArgumentParser):
         raise RuntimeError("Did not ask for --version")
 
 
+def _parse_key_value(text: str) -> Tuple[str, str]:
+    key, separator, value = text.partition("=")
+    if not separator or not key.strip():
+        raise argparse.ArgumentTypeError(f"{text} is not of the form key=value")
+    return key.strip(), value.strip()
+
+
 def get_version() -> str:
     """
     Gets the current version from the setup.cfg file
@@ -86,6 +97,24 @@ def parse_args():
         type=str,
         env_var="STORAGE_TOPIC",
     )
+    parser.add_argument(
+        "--storage-save-interval-ms",
+        required=False,
+        help="Minimum time between saves of the forwarding details to the storage topic, "
+        "changes made sooner are saved together at the end of it (units=milliseconds)",
+        type=int,
+        default=1000,
+        env_var="STORAGE_SAVE_INTERVAL_MS",
+    )
+    parser.add_argument(
+        "--local-storage-file",
+        required=False,
+        help="File to also store the forwarding details in, used with the storage topic. "
+        "On startup the PVs in it are forwarded straight away, then the details from "
+        "the storage topic are applied when they are retrieved",
+        type=str,
+        env_var="LOCAL_STORAGE_FILE",
+    )
     parser.add_argument(
         "-s",
         "--skip-retrieval",
@@ -133,6 +162,124 @@ def parse_args():
         type=int,
         default=1000,
     )
+    parser.add_argument(
+        "--publish-pipeline",
+        action="store_true",
+        help="Serialise and publish PV updates on a separate thread, in batches, instead of in the EPICS monitor callbacks",
+        env_var="PUBLISH_PIPELINE",
+    )
+    parser.add_argument(
+        "--coalesce-backlog",
+        required=False,
+        help="Once this many PV updates are waiting to be published, replace a PV's waiting update with "
+        "its newest update unless the alarm state changed, implies --publish-pipeline",
+        env_var="COALESCE_BACKLOG",
+        type=int,
+    )
+    parser.add_argument(
+        "--publish-pipeline-capacity",
+        required=False,
+        help="Maximum number of PV updates waiting in the publish pipeline, "
+        "further updates are dropped until it catches up",
+        env_var="PUBLISH_PIPELINE_CAPACITY",
+        type=int,
+        default=100_000,
+    )
+    parser.add_argument(
+        "--channel-filters-file",
+        required=False,
+        help="JSON file of deadband and maximum rate settings for PVs, by PV name pattern",
+        type=str,
+        env_var="CHANNEL_FILTERS_FILE",
+    )
+    parser.add_argument(
+        "--workers",
+        required=False,
+        help="Number of processes to forward PVs from, PVs are shared between them by name",
+        env_var="WORKERS",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--shard-count",
+        required=False,
+        help="Number of Forwarder instances sharing the config topic, each forwards only the PVs in its shard",
+        env_var="SHARD_COUNT",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--shard-index",
+        required=False,
+        help="Which shard of PVs this instance forwards, from 0 to shard-count - 1",
+        env_var="SHARD_INDEX",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--producer-profile",
+        required=False,
+        help="Kafka producer settings to favour throughput or latency",
+        choices=producer_profiles.keys(),
+        env_var="PRODUCER_PROFILE",
+    )
+    parser.add_argument(
+        "--producer-config",
+        required=False,
+        help="<key=value> librdkafka setting for the Kafka producers, overrides the producer profile, can be repeated",
+        action="append",
+        type=_parse_key_value,
+        default=[],
+    )
+    parser.add_argument(
+        "--producer-statistics-interval-ms",
+        required=False,
+        help="How often to collect statistics from the Kafka producer publishing PV updates, "
+        "for the status message and metrics (units=milliseconds, default is not to collect them)",
+        type=int,
+        env_var="PRODUCER_STATISTICS_INTERVAL_MS",
+    )
+    parser.add_argument(
+        "--backpressure-policy",
+        required=False,
+        help="What to do with PV updates when the Kafka producer's queue is full: wait for space, "
+        "hold them and drop the oldest for a PV beyond a limit, or hold only the latest for each PV",
+        choices=[policy.value for policy in BackpressurePolicy],
+        default=BackpressurePolicy.DROP_OLDEST.value,
+        env_var="BACKPRESSURE_POLICY",
+    )
+    parser.add_argument(
+        "--spool-directory",
+        required=False,
+        help="Directory to keep PV updates in while they cannot be published to the output broker, "
+        "they are published when it is available again, including after a restart",
+        type=str,
+        env_var="SPOOL_DIRECTORY",
+    )
+    parser.add_argument(
+        "--spool-max-mb",
+        required=False,
+        help="Maximum disk space for the spool, the oldest updates are dropped beyond this (units=megabytes)",
+        type=int,
+        default=1024,
+        env_var="SPOOL_MAX_MB",
+    )
+    parser.add_argument(
+        "--spool-replay-rate",
+        required=False,
+        help="Maximum rate to publish spooled PV updates at (units=messages per second)",
+        type=float,
+        default=10000,
+        env_var="SPOOL_REPLAY_RATE",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        required=False,
+        help="Serve Prometheus metrics over HTTP on this port, "
+        "with workers each worker serves its own metrics on the following ports",
+        type=int,
+        env_var="METRICS_PORT",
+    )
     log_choice_to_enum = {
         "Trace": logging.DEBUG,
         "Debug": logging.DEBUG,
@@ -150,5 +297,9 @@ def parse_args():
         env_var="VERBOSITY",
     )
     optargs = parser.parse_args()
+    if optargs.shard_count < 1 or not 0 <= optargs.shard_index < optargs.shard_count:
+        parser.error("shard-index must be from 0 to shard-count - 1")
     optargs.verbosity = log_choice_to_enum[optargs.verbosity]
+    optargs.producer_config = dict(optargs.producer_config)
+    optargs.backpressure_policy = BackpressurePolicy(optargs.backpressure_policy)
     return optargs
@@ -12,7 +12,7 @@ from streaming_data_types.fbschemas.forwarder_config_update_rf5k.UpdateType impo
 from streaming_data_types.fbschemas.forwarder_config_update_rf5k.Protocol import (
     Protocol,
 )
-from forwarder.update_handlers.schema_publishers import schema_publishers
+from forwarder.update_handlers.schema_publishers import schema_serialisers
 from flatbuffers.packer import struct as flatbuffer_struct
 
 logger = get_logger()
@@ -21,6 +21,9 @@ logger = get_logger()
 class CommandType(Enum):
     ADD = "add"
     REMOVE = "stop_channel"
+    # Only created within the Forwarder: removes exactly the given channels, including
+    # their protocol, where REMOVE matches name and topic patterns with any protocol
+    REMOVE_EXACT = "stop_exact_channel"
     REMOVE_ALL = "stop_all"
     MALFORMED = "malformed_config_update"
 
@@ -113,7 +116,7 @@ def _parse_streams(
             )
             continue
 
-        if stream.schema and stream.schema not in schema_publishers.keys():
+        if stream.schema and stream.schema not in schema_serialisers.keys():
             logger.warning(
                 f'Unsupported schema type "{stream.schema}" specified for'
                 f"stream in configuration update message."
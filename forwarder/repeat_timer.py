@@ -1,4 +1,10 @@
-from threading import Timer
+from threading import Timer, Thread, Condition, Lock
+from heapq import heappush, heappop
+from itertools import count
+from math import ceil
+from time import monotonic
+from typing import Callable, List, Tuple, Optional, Dict
+from forwarder.application_logger import get_logger
 
 
 def milliseconds_to_seconds(time_ms: int) -> float:
@@ -9,3 +15,198 @@ class RepeatTimer(Timer):
     def run(self):
         while not self.finished.wait(self.interval):
             self.function(*self.args, **self.kwargs)
+
+
+# Successive multiples of this, modulo 1, are evenly spread between 0 and 1
+# however many of them are taken
+_GOLDEN_RATIO_CONJUGATE = 0.6180339887498949
+
+
+def _next_deadline(last_deadline: float, interval: float, now: float) -> float:
+    """
+    The next deadline is a whole number of intervals after the last one,
+    periods which have already been missed are skipped rather than called in a burst
+    """
+    next_deadline = last_deadline + interval
+    if next_deadline < now:
+        next_deadline += ceil((now - next_deadline) / interval) * interval
+    return next_deadline
+
+
+class ScheduledTask:
+    """
+    Handle for a function registered with a PeriodicScheduler,
+    has the same cancel() method as RepeatTimer
+    """
+
+    def __init__(self, interval: float, function: Callable, repeat: bool = True):
+        self.interval = interval
+        self.function = function
+        self.repeat = repeat
+        self.cancelled = False
+        self.deadline = 0.0
+        self.last_called: Optional[float] = None
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class PeriodicScheduler:
+    """
+    Calls each registered function periodically, all from a single thread.
+    Used instead of a RepeatTimer per update handler, so that the number of
+    threads does not grow with the number of forwarded PVs.
+    Registered functions are expected to return quickly, as a slow function
+    delays the others.
+
+    Calls are scheduled against absolute deadlines, so the period does not drift
+    by the time taken by the function, and the first call of each task is offset
+    by a fraction of its interval so that tasks registered together are spread
+    across the period instead of all being called at the same time.
+    """
+
+    def __init__(self, clock: Callable[[], float] = monotonic):
+        """
+        :param clock: Time in seconds that deadlines are measured in, can be replaced in tests
+        """
+        self._logger = get_logger()
+        self._clock = clock
+        # Heap of (deadline, sequence number, task), the sequence number
+        # breaks ties between deadlines so that tasks are never compared
+        self._tasks: List[Tuple[float, int, ScheduledTask]] = []
+        self._sequence = count()
+        self._condition = Condition()
+        self._phase_sequence = count(1)
+        self._calls = 0
+        self._total_period_error = 0.0
+        self._max_period_error = 0.0
+        self._cancelled = False
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def schedule(self, interval: float, function: Callable) -> ScheduledTask:
+        """
+        Call function every interval seconds until the returned task is cancelled
+        """
+        task = ScheduledTask(interval, function)
+        with self._condition:
+            phase = (next(self._phase_sequence) * _GOLDEN_RATIO_CONJUGATE) % 1.0
+        self._push(self._clock() + phase * interval, task)
+        return task
+
+    def call_later(self, delay: float, function: Callable) -> ScheduledTask:
+        """
+        Call function once, delay seconds from now, unless the returned task is cancelled first
+        """
+        task = ScheduledTask(delay, function, repeat=False)
+        self._push(self._clock() + delay, task)
+        return task
+
+    def _push(self, deadline: float, task: ScheduledTask):
+        task.deadline = deadline
+        with self._condition:
+            heappush(self._tasks, (deadline, next(self._sequence), task))
+            # Only need to wake the thread if this is now the earliest deadline
+            if self._tasks[0][2] is task:
+                self._condition.notify()
+
+    def _next_due_task(self) -> Optional[ScheduledTask]:
+        with self._condition:
+            while not self._cancelled:
+                if not self._tasks:
+                    self._condition.wait()
+                    continue
+                deadline, _, task = self._tasks[0]
+                if task.cancelled:
+                    heappop(self._tasks)
+                    continue
+                time_to_deadline = deadline - self._clock()
+                if time_to_deadline > 0:
+                    self._condition.wait(time_to_deadline)
+                    continue
+                heappop(self._tasks)
+                return task
+        return None
+
+    def _run(self):
+        while True:
+            task = self._next_due_task()
+            if task is None:
+                return
+            if task.repeat:
+                self._record_period(task, self._clock())
+            try:
+                task.function()
+            except Exception as error:
+                self._logger.error(f"Exception in periodically scheduled call: {error}")
+            if task.repeat and not task.cancelled:
+                self._push(
+                    _next_deadline(task.deadline, task.interval, self._clock()), task
+                )
+
+    def _record_period(self, task: ScheduledTask, call_time: float):
+        if task.last_called is not None:
+            period_error = abs((call_time - task.last_called) - task.interval)
+            with self._condition:
+                self._calls += 1
+                self._total_period_error += period_error
+                self._max_period_error = max(self._max_period_error, period_error)
+        task.last_called = call_time
+
+    def statistics(self) -> Dict[str, float]:
+        """
+        Difference between the actual and target period of the scheduled calls
+        """
+        with self._condition:
+            calls = self._calls
+            mean_error = self._total_period_error / calls if calls else 0.0
+            max_error = self._max_period_error
+        return {
+            "periodic_calls": calls,
+            "mean_period_error_ms": mean_error * 1000,
+            "max_period_error_ms": max_error * 1000,
+        }
+
+    def stop(self):
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify()
+        self._thread.join()
+
+
+_scheduler: Optional[PeriodicScheduler] = None
+_scheduler_lock = Lock()
+
+
+def scheduler_statistics() -> Dict[str, float]:
+    """
+    Statistics of the shared scheduler, empty if no update handler has created it yet
+    """
+    with _scheduler_lock:
+        if _scheduler is None:
+            return {}
+        return _scheduler.statistics()
+
+
+def get_scheduler() -> PeriodicScheduler:
+    """
+    Get the scheduler shared by all update handlers, it is created on first use
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PeriodicScheduler()
+        return _scheduler
+
+
+def stop_scheduler():
+    """
+    Stop the shared scheduler, if it has been created,
+    the next call to get_scheduler creates a new one
+    """
+    global _scheduler
+    with _scheduler_lock:
+        scheduler = _scheduler
+        _scheduler = None
+    if scheduler is not None:
+        scheduler.stop()
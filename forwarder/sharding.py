@@ -0,0 +1,49 @@
+from forwarder.parse_config_update import CommandType, ConfigUpdate
+import hashlib
+
+
+# Forwarder instances and the worker processes within an instance are sharded
+# with different seeds, otherwise when the number of instances and workers share
+# a factor the PVs of an instance would all be assigned to some of its workers
+INSTANCE_SHARD_SEED = 0
+WORKER_SHARD_SEED = 1
+
+
+def shard_for_pv(
+    pv_name: str, shard_count: int, seed: int = INSTANCE_SHARD_SEED
+) -> int:
+    """
+    Which of shard_count shards a PV belongs to.
+    Uses a digest of the name rather than hash(), as hash() of a string
+    differs between processes so would not be stable across workers or restarts.
+    A checksum such as CRC32 is not suitable as it is linear, the shards from
+    different seeds would be correlated.
+    """
+    digest = hashlib.blake2b(
+        pv_name.encode("utf-8"), digest_size=8, salt=seed.to_bytes(16, "little")
+    ).digest()
+    return int.from_bytes(digest, "little") % shard_count
+
+
+def config_update_for_shard(
+    config_update: ConfigUpdate,
+    shard_index: int,
+    shard_count: int,
+    seed: int = INSTANCE_SHARD_SEED,
+) -> ConfigUpdate:
+    """
+    The part of a configuration update which applies to the given shard.
+    Only channels belonging to the shard are added, removals apply to all shards
+    as they may contain wildcards which match channels in any shard.
+    """
+    if config_update.command_type != CommandType.ADD or not config_update.channels:
+        return config_update
+    return ConfigUpdate(
+        CommandType.ADD,
+        tuple(
+            channel
+            for channel in config_update.channels
+            if channel.name is not None
+            and shard_for_pv(channel.name, shard_count, seed) == shard_index
+        ),
+    )
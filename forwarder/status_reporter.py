@@ -1,6 +1,12 @@
-from forwarder.repeat_timer import RepeatTimer, milliseconds_to_seconds
+from forwarder.repeat_timer import (
+    RepeatTimer,
+    milliseconds_to_seconds,
+    scheduler_statistics,
+)
 from forwarder.kafka.kafka_producer import KafkaProducer
-from typing import Dict
+from forwarder.metrics import latency_summary, merged_latency_summary
+from forwarder.update_handlers.publish_pipeline import PublishPipeline
+from typing import Any, Dict, Mapping, Optional
 from streaming_data_types.status_x5f2 import serialise_x5f2
 import json
 import time
@@ -14,14 +20,24 @@ from forwarder.parse_config_update import Channel
 class StatusReporter:
     def __init__(
         self,
-        update_handlers: Dict[Channel, UpdateHandler],
+        update_handlers: Mapping[Channel, UpdateHandler],
         producer: KafkaProducer,
         topic: str,
         service_id: str,
         version: str,
         logger: Logger,
         interval_ms: int = 4000,
+        output_producer: Optional[KafkaProducer] = None,
+        pipeline: Optional[PublishPipeline] = None,
+        worker_statistics: Optional[Dict[int, dict]] = None,
     ):
+        """
+        :param output_producer: Optionally the producer publishing PV updates, to report its delivery latency
+         and librdkafka statistics
+        :param pipeline: Optionally the publish pipeline, to report how many updates it has queued and dropped
+        :param worker_statistics: When PVs are forwarded from worker processes, the process_statistics each
+         worker last reported, to report instead of this process's latency, producer and pipeline
+        """
         self._repeating_timer = RepeatTimer(
             milliseconds_to_seconds(interval_ms), self.report_status
         )
@@ -32,19 +48,38 @@ class StatusReporter:
         self._interval_ms = interval_ms
         self._version = version
         self._logger = logger
+        self._output_producer = output_producer
+        self._pipeline = pipeline
+        self._worker_statistics = worker_statistics
 
     def start(self):
         self._repeating_timer.start()
 
     def report_status(self):
-        status_json = json.dumps(
-            {
-                "streams": [
-                    {"channel_name": channel.name}
-                    for channel in self._update_handlers.keys()
-                ]
-            }
-        )
+        status = {
+            "streams": [
+                self._stream_status(channel, handler)
+                for channel, handler in list(self._update_handlers.items())
+            ],
+            "periodic_updates": scheduler_statistics(),
+            "latency": latency_summary(self._output_producer),
+        }
+        if self._output_producer is not None:
+            producer_statistics = self._output_producer.librdkafka_statistics()
+            if producer_statistics is not None:
+                status["producer"] = producer_statistics
+        if self._pipeline is not None:
+            status["publish_pipeline"] = self._pipeline.statistics()
+        if self._worker_statistics is not None:
+            worker_statistics = sorted(list(self._worker_statistics.items()))
+            status["latency"] = merged_latency_summary(
+                statistics for _, statistics in worker_statistics
+            )
+            status["workers"] = [
+                self._worker_status(worker_index, statistics)
+                for worker_index, statistics in worker_statistics
+            ]
+        status_json = json.dumps(status)
         status_message = serialise_x5f2(
             "Forwarder",
             self._version,
@@ -59,6 +94,32 @@ class StatusReporter:
         )
         self._logger.debug(status_json)
 
+    @staticmethod
+    def _stream_status(channel: Channel, handler: UpdateHandler) -> dict:
+        stream_status: Dict[str, Any] = {"channel_name": channel.name}
+        # Streams forwarded by worker processes have no handler in this process
+        if hasattr(handler, "statistics"):
+            # Streams for the same PV share a handler, so have the same statistics
+            stream_status["statistics"] = handler.statistics()
+        return stream_status
+
+    @staticmethod
+    def _worker_status(worker_index: int, statistics: dict) -> dict:
+        worker_status = {
+            "worker": worker_index,
+            "periodic_updates": statistics["periodic_updates"],
+            "latency": merged_latency_summary((statistics,)),
+        }
+        producer_statistics = statistics.get("producer")
+        if producer_statistics is not None:
+            worker_status["delivery"] = producer_statistics["delivery"]
+            worker_status["backpressure"] = producer_statistics["backpressure"]
+            if producer_statistics["librdkafka"] is not None:
+                worker_status["producer"] = producer_statistics["librdkafka"]
+        if "publish_pipeline" in statistics:
+            worker_status["publish_pipeline"] = statistics["publish_pipeline"]
+        return worker_status
+
     def stop(self):
         self._producer.close()
         if self._repeating_timer is not None:
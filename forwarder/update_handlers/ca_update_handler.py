@@ -1,17 +1,23 @@
 from forwarder.application_logger import get_logger
 from forwarder.kafka.kafka_producer import KafkaProducer
 from caproto import ReadNotifyResponse, ChannelType
-import numpy as np
 from threading import Lock
-from forwarder.repeat_timer import RepeatTimer, milliseconds_to_seconds
+from forwarder.repeat_timer import (
+    get_scheduler,
+    milliseconds_to_seconds,
+    ScheduledTask,
+)
 from forwarder.epics_to_serialisable_types import (
     numpy_type_from_caproto_type,
+    ValueConverter,
     epics_alarm_severity_to_f142,
     ca_alarm_status_to_f142,
 )
-from caproto.threading.client import Context as CAContext
+from caproto.threading.client import Context as CAContext, PV
 from typing import Optional, Tuple, Any
-from forwarder.update_handlers.schema_publishers import schema_publishers
+from forwarder.update_handlers.schema_publishers import ChannelSinks
+from forwarder.update_handlers.publish_pipeline import PublishPipeline
+from forwarder.update_handlers.update_filter import UpdateFilter
 
 
 def _seconds_to_nanoseconds(time_seconds: float) -> int:
@@ -23,6 +29,7 @@ class CAUpdateHandler:
     Monitors via EPICS v3 Channel Access (CA),
     serialises updates in FlatBuffers and passes them onto an Kafka Producer.
     CA support from caproto library.
+    A single handler forwards the PV to each of its (output topic, schema) sinks.
     """
 
     def __init__(
@@ -33,64 +40,73 @@ class CAUpdateHandler:
         output_topic: str,
         schema: str,
         periodic_update_ms: Optional[int] = None,
+        pipeline: Optional[PublishPipeline] = None,
+        update_filter: Optional[UpdateFilter] = None,
+        pv: Optional[PV] = None,
     ):
+        """
+        :param pv: Optionally the PV already got from the context, so that many PVs can be searched for at once
+        """
         self._logger = get_logger()
-        self._producer = producer
-        self._output_topic = output_topic
-        (self._pv,) = context.get_pvs(pv_name)
+        self._sinks = ChannelSinks(producer, pv_name, pipeline)
+        self._sinks.add(output_topic, schema)
+        self._update_filter = update_filter
+        if pv is None:
+            (pv,) = context.get_pvs(pv_name)
+        self._pv = pv
         # Subscribe with "data_type='time'" to get timestamp and alarm fields
         sub = self._pv.subscribe(data_type="time")
         sub.add_callback(self._monitor_callback)
 
         self._cached_update: Optional[Tuple[ReadNotifyResponse, int]] = None
         self._output_type = None
+        self._convert_value: Optional[ValueConverter] = None
         self._repeating_timer = None
         self._cache_lock = Lock()
-
-        try:
-            self._message_publisher = schema_publishers[schema]
-        except KeyError:
-            raise ValueError(
-                f"{schema} is not a recognised supported schema, use one of {list(schema_publishers.keys())}"
-            )
+        # The last update held back by the filter's max rate, and the task to publish it
+        self._held_update: Optional[Tuple[ReadNotifyResponse, int, Any, int]] = None
+        self._held_update_task: Optional[ScheduledTask] = None
 
         if periodic_update_ms is not None:
-            self._repeating_timer = RepeatTimer(
+            self._repeating_timer = get_scheduler().schedule(
                 milliseconds_to_seconds(periodic_update_ms), self.publish_cached_update
             )
-            self._repeating_timer.start()
 
     def _monitor_callback(self, sub, response: ReadNotifyResponse):
+        timestamp = _seconds_to_nanoseconds(response.metadata.timestamp)
+        received_ns = self._sinks.update_received(timestamp)
         if self._output_type is None:
             if not self._try_to_determine_type(response):
                 return
 
         with self._cache_lock:
-            timestamp = _seconds_to_nanoseconds(response.metadata.timestamp)
+            value = self._get_value(response)
             # If this is the first update or the alarm status has changed, then
             # include alarm status in message
-            if (
+            alarm_changed = (
                 self._cached_update is None
                 or response.metadata.status != self._cached_update[0].metadata.status
+            )
+            if (
+                self._update_filter is not None
+                and not self._update_filter.should_forward(value, alarm_changed)
             ):
-                self._message_publisher(
-                    self._producer,
-                    self._output_topic,
-                    self._get_value(response),
-                    self._pv.name,
+                self._hold_update(
+                    self._update_filter, response, timestamp, value, received_ns
+                )
+                return
+            self._held_update = None
+            if alarm_changed:
+                self._sinks.publish(
+                    value,
                     timestamp,
                     ca_alarm_status_to_f142[response.metadata.status],
                     epics_alarm_severity_to_f142[response.metadata.severity],
+                    received_ns=received_ns,
                 )
             else:
                 # Otherwise FlatBuffers will use the default alarm status of "NO_CHANGE"
-                self._message_publisher(
-                    self._producer,
-                    self._output_topic,
-                    self._get_value(response),
-                    self._pv.name,
-                    timestamp,
-                )
+                self._sinks.publish(value, timestamp, received_ns=received_ns)
             self._cached_update = (response, timestamp)
 
     def _try_to_determine_type(self, response: ReadNotifyResponse) -> bool:
@@ -109,6 +125,7 @@ class CAUpdateHandler:
                 return False
             else:
                 self._output_type = numpy_type_from_caproto_type[response.data_type]
+                self._convert_value = ValueConverter(self._output_type)
         except KeyError:
             self._logger.error(
                 f"Don't know what numpy dtype to use for channel type {ChannelType(response.data_type)}"
@@ -117,28 +134,82 @@ class CAUpdateHandler:
         return True
 
     def _get_value(self, response: ReadNotifyResponse) -> Any:
-        return np.squeeze(response.data).astype(self._output_type)
+        return self._convert_value(response.data)  # type: ignore
+
+    def _hold_update(
+        self,
+        update_filter: UpdateFilter,
+        response: ReadNotifyResponse,
+        timestamp: int,
+        value: Any,
+        received_ns: int,
+    ):
+        delay = update_filter.seconds_until_rate_allows()
+        if delay <= 0:
+            # Filtered by the deadband, rather than held back by the max rate
+            return
+        self._held_update = (response, timestamp, value, received_ns)
+        if self._held_update_task is None:
+            self._held_update_task = get_scheduler().call_later(
+                delay, self._publish_held_update
+            )
+
+    def _publish_held_update(self):
+        with self._cache_lock:
+            self._held_update_task = None
+            if self._held_update is None or self._update_filter is None:
+                return
+            delay = self._update_filter.seconds_until_rate_allows()
+            if delay > 0:
+                # An update forwarded since this was scheduled restarted the interval
+                self._held_update_task = get_scheduler().call_later(
+                    delay, self._publish_held_update
+                )
+                return
+            response, timestamp, value, received_ns = self._held_update
+            self._held_update = None
+            if self._update_filter.should_forward_held(value):
+                self._sinks.publish(value, timestamp, received_ns=received_ns)
+                self._cached_update = (response, timestamp)
 
     def publish_cached_update(self):
         with self._cache_lock:
             if self._cached_update is not None:
                 # Always include current alarm status in periodic update messages
-                self._message_publisher(
-                    self._producer,
-                    self._output_topic,
-                    self._get_value(self._cached_update[0]),
-                    self._pv.name,
-                    self._cached_update[1],
+                self._sinks.republish_latest(
                     ca_alarm_status_to_f142[self._cached_update[0].metadata.status],
                     epics_alarm_severity_to_f142[
                         self._cached_update[0].metadata.severity
                     ],
                 )
 
+    def statistics(self) -> dict:
+        """
+        Counters for the PV's updates, for the status message
+        """
+        statistics = self._sinks.statistics_dict()
+        if self._update_filter is not None:
+            statistics["filtered"] = self._update_filter.filtered_count
+        return statistics
+
+    def add_sink(self, output_topic: str, schema: str):
+        """
+        Also forward updates to output_topic, serialised with schema
+        """
+        self._sinks.add(output_topic, schema)
+
+    def remove_sink(self, output_topic: str, schema: str):
+        """
+        Stop forwarding updates to output_topic with schema, the PV remains subscribed to
+        """
+        self._sinks.remove(output_topic, schema)
+
     def stop(self):
         """
         Stop periodic updates and unsubscribe from PV
         """
         if self._repeating_timer is not None:
             self._repeating_timer.cancel()
+        if self._held_update_task is not None:
+            self._held_update_task.cancel()
         self._pv.unsubscribe_all()
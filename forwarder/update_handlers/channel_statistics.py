@@ -0,0 +1,76 @@
+import time
+from typing import Optional
+from forwarder.metrics import Histogram
+
+# The update rate is measured over at least this long, so that reading
+# the statistics for each of a PV's streams gives the same rate
+_MIN_RATE_INTERVAL_S = 1.0
+
+
+class ChannelStatistics:
+    """
+    Counters for the updates from a single PV.
+    Each counter is only modified by one thread at a time, the EPICS callback
+    thread or the publishing thread, so they do not need a lock.
+    """
+
+    __slots__ = (
+        "updates_received",
+        "messages_published",
+        "bytes_published",
+        "last_update_time",
+        "_rate_start_time",
+        "_rate_start_count",
+        "_update_rate_hz",
+        "epics_to_callback_latency",
+        "callback_to_produce_latency",
+    )
+
+    def __init__(self):
+        self.updates_received = 0
+        self.messages_published = 0
+        self.bytes_published = 0
+        self.last_update_time: Optional[float] = None
+        self._rate_start_time = time.monotonic()
+        self._rate_start_count = 0
+        self._update_rate_hz = 0.0
+        self.epics_to_callback_latency = Histogram()
+        self.callback_to_produce_latency = Histogram()
+
+    def update_received(self):
+        self.updates_received += 1
+        self.last_update_time = time.time()
+
+    def message_published(self, payload_size: int):
+        self.messages_published += 1
+        self.bytes_published += payload_size
+
+    def update_rate_hz(self) -> float:
+        """
+        Rate of updates received since the rate was last measured
+        """
+        now = time.monotonic()
+        interval = now - self._rate_start_time
+        if interval >= _MIN_RATE_INTERVAL_S:
+            updates_received = self.updates_received
+            self._update_rate_hz = (
+                updates_received - self._rate_start_count
+            ) / interval
+            self._rate_start_time = now
+            self._rate_start_count = updates_received
+        return self._update_rate_hz
+
+    def latency_summary(self) -> dict:
+        return {
+            "epics_to_callback": self.epics_to_callback_latency.summary(),
+            "callback_to_produce": self.callback_to_produce_latency.summary(),
+        }
+
+    def as_dict(self) -> dict:
+        return {
+            "updates_received": self.updates_received,
+            "messages_published": self.messages_published,
+            "bytes_published": self.bytes_published,
+            "last_update_time": self.last_update_time,
+            "update_rate_hz": round(self.update_rate_hz(), 3),
+        }
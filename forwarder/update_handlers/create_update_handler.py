@@ -1,25 +1,23 @@
 from forwarder.parse_config_update import EpicsProtocol
 from forwarder.parse_config_update import Channel as ConfigChannel
 from forwarder.kafka.kafka_producer import KafkaProducer
-from typing import Optional, Union
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 from caproto.threading.client import Context as CAContext
 from p4p.client.thread import Context as PVAContext
 from forwarder.update_handlers.ca_update_handler import CAUpdateHandler
 from forwarder.update_handlers.pva_update_handler import PVAUpdateHandler
 from forwarder.update_handlers.fake_update_handler import FakeUpdateHandler
+from forwarder.update_handlers.publish_pipeline import PublishPipeline
+from forwarder.update_handlers.update_filter import ChannelFilters, UpdateFilter
 
 
 UpdateHandler = Union[CAUpdateHandler, PVAUpdateHandler, FakeUpdateHandler]
 
 
-def create_update_handler(
-    producer: KafkaProducer,
-    ca_context: CAContext,
-    pva_context: PVAContext,
-    channel: ConfigChannel,
-    fake_pv_period_ms: int,
-    periodic_update_ms: Optional[int] = None,
-) -> UpdateHandler:
+def _required_fields(channel: ConfigChannel) -> Tuple[str, str, str]:
+    """
+    :return: The PV name, output topic and schema of the channel
+    """
     if not channel.name:
         raise RuntimeError("PV name not specified when adding handler for channel")
     if not channel.output_topic:
@@ -30,30 +28,131 @@ def create_update_handler(
         raise RuntimeError(
             f"Schema not specified when adding handler for channel {channel.name}"
         )
+    return channel.name, channel.output_topic, channel.schema
+
+
+def _update_filter(
+    channel_filters: Optional[ChannelFilters], pv_name: str
+) -> Optional[UpdateFilter]:
+    return channel_filters.filter_for(pv_name) if channel_filters is not None else None
+
+
+def _handler_error(pv_name: str, error: Exception) -> RuntimeError:
+    return RuntimeError(f"Could not create update handler for {pv_name}: {error}")
+
+
+def create_update_handler(
+    producer: KafkaProducer,
+    ca_context: CAContext,
+    pva_context: PVAContext,
+    channel: ConfigChannel,
+    fake_pv_period_ms: int,
+    periodic_update_ms: Optional[int] = None,
+    pipeline: Optional[PublishPipeline] = None,
+    channel_filters: Optional[ChannelFilters] = None,
+) -> UpdateHandler:
+    pv_name, output_topic, schema = _required_fields(channel)
+    update_filter = _update_filter(channel_filters, pv_name)
     if channel.protocol == EpicsProtocol.PVA:
         return PVAUpdateHandler(
             producer,
             pva_context,
-            channel.name,
-            channel.output_topic,
-            channel.schema,
+            pv_name,
+            output_topic,
+            schema,
             periodic_update_ms,
+            pipeline,
+            update_filter,
         )
     elif channel.protocol == EpicsProtocol.CA:
         return CAUpdateHandler(
             producer,
             ca_context,
-            channel.name,
-            channel.output_topic,
-            channel.schema,
+            pv_name,
+            output_topic,
+            schema,
             periodic_update_ms,
+            pipeline,
+            update_filter,
         )
     elif channel.protocol == EpicsProtocol.FAKE:
         return FakeUpdateHandler(
-            producer,
-            channel.name,
-            channel.output_topic,
-            channel.schema,
-            fake_pv_period_ms,
+            producer, pv_name, output_topic, schema, fake_pv_period_ms, pipeline,
         )
     raise RuntimeError("Unexpected EpicsProtocol in create_update_handler")
+
+
+def create_update_handlers(
+    producer: KafkaProducer,
+    ca_context: CAContext,
+    pva_context: PVAContext,
+    channels: Sequence[ConfigChannel],
+    fake_pv_period_ms: int,
+    periodic_update_ms: Optional[int] = None,
+    pipeline: Optional[PublishPipeline] = None,
+    channel_filters: Optional[ChannelFilters] = None,
+) -> Tuple[Dict[ConfigChannel, UpdateHandler], List[RuntimeError]]:
+    """
+    Create handlers for many channels, each for a different PV, at once.
+    The CA PVs are all searched for together. A handler which fails to be created
+    is skipped, so that the handlers created for the other channels are still returned.
+    :return: The handler for each channel one could be created for, and the errors for the others
+    """
+    handlers: Dict[ConfigChannel, UpdateHandler] = {}
+    errors: List[RuntimeError] = []
+    ca_channels: List[Tuple[ConfigChannel, Tuple[str, str, str]]] = []
+    pva_channels: List[Tuple[ConfigChannel, Tuple[str, str, str]]] = []
+    for channel in channels:
+        try:
+            if channel.protocol == EpicsProtocol.CA:
+                ca_channels.append((channel, _required_fields(channel)))
+            elif channel.protocol == EpicsProtocol.PVA:
+                pva_channels.append((channel, _required_fields(channel)))
+            else:
+                handlers[channel] = create_update_handler(
+                    producer,
+                    ca_context,
+                    pva_context,
+                    channel,
+                    fake_pv_period_ms,
+                    periodic_update_ms,
+                    pipeline,
+                    channel_filters,
+                )
+        except RuntimeError as error:
+            errors.append(error)
+
+    if ca_channels:
+        pvs = ca_context.get_pvs(*(pv_name for _, (pv_name, _, _) in ca_channels))
+        for (channel, (pv_name, output_topic, schema)), pv in zip(ca_channels, pvs):
+            try:
+                handlers[channel] = CAUpdateHandler(
+                    producer,
+                    ca_context,
+                    pv_name,
+                    output_topic,
+                    schema,
+                    periodic_update_ms,
+                    pipeline,
+                    _update_filter(channel_filters, pv_name),
+                    pv,
+                )
+            except Exception as error:
+                errors.append(_handler_error(pv_name, error))
+
+    # Creating a PVA monitor does not wait for the PV to connect, so these are created in turn
+    for channel, (pv_name, output_topic, schema) in pva_channels:
+        try:
+            handlers[channel] = PVAUpdateHandler(
+                producer,
+                pva_context,
+                pv_name,
+                output_topic,
+                schema,
+                periodic_update_ms,
+                pipeline,
+                _update_filter(channel_filters, pv_name),
+            )
+        except Exception as error:
+            errors.append(_handler_error(pv_name, error))
+    return handlers, errors
@@ -1,8 +1,10 @@
 from forwarder.kafka.kafka_producer import KafkaProducer
 import numpy as np
-from forwarder.repeat_timer import RepeatTimer, milliseconds_to_seconds
+from forwarder.repeat_timer import get_scheduler, milliseconds_to_seconds
 import time
-from forwarder.update_handlers.schema_publishers import schema_publishers
+from forwarder.update_handlers.schema_publishers import ChannelSinks
+from forwarder.update_handlers.publish_pipeline import PublishPipeline
+from typing import Optional
 from random import randint
 
 
@@ -19,34 +21,39 @@ class FakeUpdateHandler:
         output_topic: str,
         schema: str,
         fake_pv_period_ms: int,
+        pipeline: Optional[PublishPipeline] = None,
     ):
-        self._producer = producer
-        self._output_topic = output_topic
-        self._pv_name = pv_name
-        self._schema = schema
-
-        try:
-            self._message_publisher = schema_publishers[schema]
-        except KeyError:
-            raise ValueError(
-                f"{schema} is not a recognised supported schema, use one of {list(schema_publishers.keys())}"
-            )
-
-        self._repeating_timer = RepeatTimer(
+        self._sinks = ChannelSinks(producer, pv_name, pipeline)
+        self._sinks.add(output_topic, schema)
+
+        self._repeating_timer = get_scheduler().schedule(
             milliseconds_to_seconds(fake_pv_period_ms), self._timer_callback
         )
-        self._repeating_timer.start()
 
     def _timer_callback(self):
-        if self._schema == "tdct":
-            # tdct needs a 1D array as data to send
-            data = np.array([randint(0, 100)]).astype(np.int32)
-        else:
-            # Otherwise 0D (scalar) is fine
-            data = np.array(randint(0, 100)).astype(np.int32)
-        self._message_publisher(
-            self._producer, self._output_topic, data, self._pv_name, time.time_ns()
-        )
+        # 0D (scalar) is fine for f142, tdct sends it as a 1D array of a single value
+        timestamp = time.time_ns()
+        received_ns = self._sinks.update_received(timestamp)
+        data = np.array(randint(0, 100)).astype(np.int32)
+        self._sinks.publish(data, timestamp, received_ns=received_ns)
+
+    def statistics(self) -> dict:
+        """
+        Counters for the PV's updates, for the status message
+        """
+        return self._sinks.statistics_dict()
+
+    def add_sink(self, output_topic: str, schema: str):
+        """
+        Also forward updates to output_topic, serialised with schema
+        """
+        self._sinks.add(output_topic, schema)
+
+    def remove_sink(self, output_topic: str, schema: str):
+        """
+        Stop forwarding updates to output_topic with schema
+        """
+        self._sinks.remove(output_topic, schema)
 
     def stop(self):
         """
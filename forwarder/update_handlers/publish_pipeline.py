@@ -0,0 +1,96 @@
+from collections import deque
+from threading import Thread, Event, Lock
+from typing import Callable, Deque, Dict, Optional, Tuple
+from forwarder.application_logger import get_logger
+
+
+class PublishPipeline:
+    """
+    Moves serialising and producing PV updates off the EPICS client threads.
+    Monitor callbacks enqueue the update, and a single worker thread takes
+    updates off the queue in batches to serialise and publish them.
+    As there is only one worker, updates are published in the order they were enqueued.
+    If coalesce_backlog is given then once that many calls are waiting the pipeline
+    is saturated, and callers may replace a waiting update with a newer one.
+    At most max_queued calls wait in the queue, further calls are dropped
+    until the worker catches up, so that a slow broker cannot exhaust memory.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 1000,
+        coalesce_backlog: Optional[int] = None,
+        max_queued: int = 100_000,
+    ):
+        self._logger = get_logger()
+        self._max_batch_size = max_batch_size
+        self._coalesce_backlog = coalesce_backlog
+        self._max_queued = max_queued
+        self.dropped_count = 0
+        self._dropped_lock = Lock()
+        # deque append and popleft are atomic, so no lock is needed
+        # between the callback threads and the worker
+        self._queue: Deque[Tuple[Callable, Tuple]] = deque()
+        self._work_available = Event()
+        self._cancelled = False
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def enqueue(self, function: Callable, *args) -> bool:
+        """
+        Call function with args on the worker thread
+        :return: False if the call was dropped because the queue is full
+        """
+        if len(self._queue) >= self._max_queued:
+            with self._dropped_lock:
+                self.dropped_count += 1
+            return False
+        self._queue.append((function, args))
+        if not self._work_available.is_set():
+            self._work_available.set()
+        return True
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def saturated(self) -> bool:
+        """
+        Whether enough calls are waiting that waiting updates should be coalesced
+        """
+        return (
+            self._coalesce_backlog is not None
+            and len(self._queue) >= self._coalesce_backlog
+        )
+
+    def statistics(self) -> Dict[str, int]:
+        """
+        Calls waiting in the queue, and dropped because it was full
+        """
+        return {"queued": len(self._queue), "dropped": self.dropped_count}
+
+    def _run(self):
+        while not self._cancelled:
+            self._work_available.wait(0.5)
+            self._work_available.clear()
+            self._drain()
+        self._drain()
+
+    def _drain(self):
+        while self._queue:
+            batch = [
+                self._queue.popleft()
+                for _ in range(min(self._max_batch_size, len(self._queue)))
+            ]
+            for function, args in batch:
+                try:
+                    function(*args)
+                except Exception as error:
+                    self._logger.error(f"Failed to publish PV update: {error}")
+
+    def stop(self):
+        """
+        Publish anything remaining in the queue and stop the worker
+        """
+        self._cancelled = True
+        self._work_available.set()
+        self._thread.join()
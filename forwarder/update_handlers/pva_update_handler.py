@@ -2,12 +2,19 @@ from p4p.client.thread import Context as PVAContext
 from p4p import Value
 from forwarder.kafka.kafka_producer import KafkaProducer
 from forwarder.application_logger import get_logger
-from typing import Optional, Tuple
+from typing import Any, Optional, Tuple
 from threading import Lock, Event
-from forwarder.update_handlers.schema_publishers import schema_publishers
-from forwarder.repeat_timer import RepeatTimer, milliseconds_to_seconds
+from forwarder.update_handlers.schema_publishers import ChannelSinks
+from forwarder.update_handlers.publish_pipeline import PublishPipeline
+from forwarder.update_handlers.update_filter import UpdateFilter
+from forwarder.repeat_timer import (
+    get_scheduler,
+    milliseconds_to_seconds,
+    ScheduledTask,
+)
 from forwarder.epics_to_serialisable_types import (
     numpy_type_from_p4p_type,
+    ValueConverter,
     epics_alarm_severity_to_f142,
     pva_alarm_message_to_f142_alarm_status,
 )
@@ -28,6 +35,7 @@ class PVAUpdateHandler:
     Monitors via EPICS v4 Process Variable Access (PVA),
     serialises updates in FlatBuffers and passes them onto an Kafka Producer.
     PVA support from p4p library.
+    A single handler forwards the PV to each of its (output topic, schema) sinks.
     """
 
     def __init__(
@@ -38,10 +46,13 @@ class PVAUpdateHandler:
         output_topic: str,
         schema: str,
         periodic_update_ms: Optional[int] = None,
+        pipeline: Optional[PublishPipeline] = None,
+        update_filter: Optional[UpdateFilter] = None,
     ):
         self._logger = get_logger()
-        self._producer = producer
-        self._output_topic = output_topic
+        self._sinks = ChannelSinks(producer, pv_name, pipeline)
+        self._sinks.add(output_topic, schema)
+        self._update_filter = update_filter
 
         request = context.makeRequest("field(value,timeStamp,alarm)")
         self._sub = context.monitor(pv_name, self._monitor_callback, request=request)
@@ -52,55 +63,50 @@ class PVAUpdateHandler:
         self._stop_timer_flag = Event()
         self._repeating_timer = None
         self._cache_lock = Lock()
-
-        try:
-            self._message_publisher = schema_publishers[schema]
-        except KeyError:
-            raise ValueError(
-                f"{schema} is not a recognised supported schema, use one of {list(schema_publishers.keys())}"
-            )
+        # The last update held back by the filter's max rate, and the task to publish it
+        self._held_update: Optional[Tuple[Value, int, Any, int]] = None
+        self._held_update_task: Optional[ScheduledTask] = None
 
         if periodic_update_ms is not None:
-            self._repeating_timer = RepeatTimer(
+            self._repeating_timer = get_scheduler().schedule(
                 milliseconds_to_seconds(periodic_update_ms), self.publish_cached_update
             )
-            self._repeating_timer.start()
 
     def _monitor_callback(self, response: Value):
         timestamp = (
             response.timeStamp.secondsPastEpoch * 1_000_000_000
         ) + response.timeStamp.nanoseconds
+        received_ns = self._sinks.update_received(timestamp)
         if self._output_type is None:
             self._try_to_determine_type(response)
 
         with self._cache_lock:
+            value = self._convert_value(self._get_value(response))
             # If this is the first update or the alarm status has changed, then
             # include alarm status in message
-            if (
+            alarm_changed = (
                 self._cached_update is None
                 or response.alarm.message != self._cached_update[0].alarm.message
+            )
+            if (
+                self._update_filter is not None
+                and not self._update_filter.should_forward(value, alarm_changed)
             ):
-                self._message_publisher(
-                    self._producer,
-                    self._output_topic,
-                    np.squeeze(np.array(self._get_value(response))).astype(
-                        self._output_type
-                    ),
-                    self._pv_name,
+                self._hold_update(
+                    self._update_filter, response, timestamp, value, received_ns
+                )
+                return
+            self._held_update = None
+            if alarm_changed:
+                self._sinks.publish(
+                    value,
                     timestamp,
                     _get_alarm_status(response),
                     epics_alarm_severity_to_f142[response.alarm.severity],
+                    received_ns=received_ns,
                 )
             else:
-                self._message_publisher(
-                    self._producer,
-                    self._output_topic,
-                    np.squeeze(np.array(self._get_value(response))).astype(
-                        self._output_type
-                    ),
-                    self._pv_name,
-                    timestamp,
-                )
+                self._sinks.publish(value, timestamp, received_ns=received_ns)
             self._cached_update = (response, timestamp)
 
     def _try_to_determine_type(self, response):
@@ -122,31 +128,84 @@ class PVAUpdateHandler:
                 self._get_value = lambda resp: resp.value.choices[resp.value.index]
             else:
                 self._get_value = lambda resp: resp.value
+            self._convert_value = ValueConverter(self._output_type)
         except KeyError:
             self._logger.error(
                 f"Don't know what numpy dtype to use for channel type {type(response)}"
             )
 
+    def _hold_update(
+        self,
+        update_filter: UpdateFilter,
+        response: Value,
+        timestamp: int,
+        value: Any,
+        received_ns: int,
+    ):
+        delay = update_filter.seconds_until_rate_allows()
+        if delay <= 0:
+            # Filtered by the deadband, rather than held back by the max rate
+            return
+        self._held_update = (response, timestamp, value, received_ns)
+        if self._held_update_task is None:
+            self._held_update_task = get_scheduler().call_later(
+                delay, self._publish_held_update
+            )
+
+    def _publish_held_update(self):
+        with self._cache_lock:
+            self._held_update_task = None
+            if self._held_update is None or self._update_filter is None:
+                return
+            delay = self._update_filter.seconds_until_rate_allows()
+            if delay > 0:
+                # An update forwarded since this was scheduled restarted the interval
+                self._held_update_task = get_scheduler().call_later(
+                    delay, self._publish_held_update
+                )
+                return
+            response, timestamp, value, received_ns = self._held_update
+            self._held_update = None
+            if self._update_filter.should_forward_held(value):
+                self._sinks.publish(value, timestamp, received_ns=received_ns)
+                self._cached_update = (response, timestamp)
+
     def publish_cached_update(self):
         with self._cache_lock:
             if self._cached_update is not None:
                 # Always include current alarm status in periodic update messages
-                self._message_publisher(
-                    self._producer,
-                    self._output_topic,
-                    np.squeeze(
-                        np.array(self._get_value(self._cached_update[0]))
-                    ).astype(self._output_type),
-                    self._pv_name,
-                    self._cached_update[1],
+                self._sinks.republish_latest(
                     _get_alarm_status(self._cached_update[0]),
                     epics_alarm_severity_to_f142[self._cached_update[0].alarm.severity],
                 )
 
+    def statistics(self) -> dict:
+        """
+        Counters for the PV's updates, for the status message
+        """
+        statistics = self._sinks.statistics_dict()
+        if self._update_filter is not None:
+            statistics["filtered"] = self._update_filter.filtered_count
+        return statistics
+
+    def add_sink(self, output_topic: str, schema: str):
+        """
+        Also forward updates to output_topic, serialised with schema
+        """
+        self._sinks.add(output_topic, schema)
+
+    def remove_sink(self, output_topic: str, schema: str):
+        """
+        Stop forwarding updates to output_topic with schema, the PV remains subscribed to
+        """
+        self._sinks.remove(output_topic, schema)
+
     def stop(self):
         """
         Stop periodic updates and unsubscribe from PV
         """
         if self._repeating_timer is not None:
             self._repeating_timer.cancel()
+        if self._held_update_task is not None:
+            self._held_update_task.cancel()
         self._sub.close()
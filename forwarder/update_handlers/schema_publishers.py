@@ -1,8 +1,235 @@
-from forwarder.kafka.kafka_helpers import publish_f142_message, publish_tdct_message
-from typing import Dict, Callable
+from forwarder.kafka.kafka_helpers import (
+    F142Serialiser,
+    TdctSerialiser,
+    publish_message,
+)
+from forwarder.kafka.kafka_producer import KafkaProducer
+from forwarder.update_handlers.publish_pipeline import PublishPipeline
+from forwarder.update_handlers.channel_statistics import ChannelStatistics
+from forwarder.metrics import (
+    publish_duration,
+    epics_to_callback_latency,
+    callback_to_produce_latency,
+)
+from threading import Lock
+import time
+from typing import Dict, Callable, Tuple, Any, Optional
 
 
-schema_publishers: Dict[str, Callable] = {
-    "f142": publish_f142_message,
-    "tdct": publish_tdct_message,
+# Each channel gets its own serialiser for each schema, created from the
+# source name, so that serialisers can keep state between updates
+schema_serialisers: Dict[str, Callable] = {
+    "f142": F142Serialiser,
+    "tdct": TdctSerialiser,
 }
+
+
+class _PendingUpdate:
+    """
+    An update waiting in the publish pipeline, which can be replaced by a newer
+    update until the pipeline takes it
+    """
+
+    __slots__ = ("update",)
+
+    def __init__(self, update: Optional[Tuple[Any, int, Tuple, int]]):
+        self.update = update
+
+
+class ChannelSinks:
+    """
+    The (output topic, schema) pairs which updates from a single PV are forwarded to.
+    Each update is serialised once per schema and the payload published to every
+    topic configured with that schema.
+    The payloads of the latest update which include alarm details are kept, so that
+    periodically republishing an unchanged PV value does not need to serialise it again.
+    Calls to publish and republish_latest must not be made concurrently.
+    If a pipeline is given then updates are serialised and published on its
+    worker thread instead of the calling thread. While the pipeline is saturated
+    a new update replaces this PV's update still waiting in the pipeline, unless
+    the alarm status or severity differ, so that alarm transitions are always published.
+    Updates are lost if the pipeline is full.
+    """
+
+    def __init__(
+        self,
+        producer: KafkaProducer,
+        source_name: str,
+        pipeline: Optional[PublishPipeline] = None,
+    ):
+        self._producer = producer
+        self._source_name = source_name
+        self._pipeline = pipeline
+        # Replaced rather than modified when sinks are added or removed,
+        # so that publishing does not need to take the lock
+        self._topics_by_schema: Dict[str, Tuple[str, ...]] = {}
+        self._serialisers: Dict[str, Any] = {}
+        self._lock = Lock()
+        self._latest_update: Optional[Tuple[Any, int]] = None
+        self._latest_alarm: Tuple = ()
+        self._latest_payloads: Dict[str, bytes] = {}
+        self._pending: Optional[_PendingUpdate] = None
+        self._pending_lock = Lock()
+        self.coalesced_count = 0
+        self.statistics = ChannelStatistics()
+
+    def add(self, output_topic: str, schema: str):
+        if schema not in schema_serialisers.keys():
+            raise ValueError(
+                f"{schema} is not a recognised supported schema, use one of {list(schema_serialisers.keys())}"
+            )
+        with self._lock:
+            if schema not in self._serialisers:
+                self._serialisers[schema] = schema_serialisers[schema](
+                    self._source_name
+                )
+            topics_by_schema = dict(self._topics_by_schema)
+            topics = topics_by_schema.get(schema, ())
+            if output_topic not in topics:
+                topics_by_schema[schema] = topics + (output_topic,)
+            self._topics_by_schema = topics_by_schema
+
+    def remove(self, output_topic: str, schema: str):
+        with self._lock:
+            topics_by_schema = dict(self._topics_by_schema)
+            topics = tuple(
+                topic
+                for topic in topics_by_schema.get(schema, ())
+                if topic != output_topic
+            )
+            if topics:
+                topics_by_schema[schema] = topics
+            else:
+                topics_by_schema.pop(schema, None)
+            self._topics_by_schema = topics_by_schema
+
+    def __len__(self) -> int:
+        return sum(len(topics) for topics in self._topics_by_schema.values())
+
+    def update_received(self, timestamp_ns: int) -> int:
+        """
+        Record a PV update arriving, before it is filtered or held back
+        :param timestamp_ns: Timestamp for value (nanoseconds after unix epoch)
+        :return: When the update arrived (nanoseconds after unix epoch), to pass to publish
+        """
+        self.statistics.update_received()
+        return self._observe_arrival(timestamp_ns)
+
+    def _observe_arrival(self, timestamp_ns: int) -> int:
+        received_ns = time.time_ns()
+        epics_to_callback = (received_ns - timestamp_ns) / 1_000_000_000
+        self.statistics.epics_to_callback_latency.observe(epics_to_callback)
+        epics_to_callback_latency.observe(epics_to_callback)
+        return received_ns
+
+    def publish(
+        self, data: Any, timestamp_ns: int, *alarm, received_ns: Optional[int] = None
+    ):
+        """
+        :param data: Value of the PV update
+        :param timestamp_ns: Timestamp for value (nanoseconds after unix epoch)
+        :param alarm: Optionally the alarm status and severity to include in the messages
+        :param received_ns: When the update arrived, as returned by update_received,
+         otherwise it is taken to have arrived now
+        """
+        if received_ns is None:
+            received_ns = self._observe_arrival(timestamp_ns)
+        if self._pipeline is None:
+            self._publish(data, timestamp_ns, alarm, received_ns)
+            return
+        update = (data, timestamp_ns, alarm, received_ns)
+        with self._pending_lock:
+            pending = self._pending
+            if (
+                pending is not None
+                and pending.update is not None
+                and pending.update[2] == alarm
+                and self._pipeline.saturated()
+            ):
+                pending.update = update
+                self.coalesced_count += 1
+                return
+            pending = self._pending = _PendingUpdate(update)
+        if not self._pipeline.enqueue(self._publish_pending, pending):
+            # Dropped by the full pipeline, so there is no update waiting to replace
+            with self._pending_lock:
+                if self._pending is pending:
+                    self._pending = None
+
+    def _publish_pending(self, pending: _PendingUpdate):
+        with self._pending_lock:
+            update = pending.update
+            pending.update = None
+            if self._pending is pending:
+                self._pending = None
+        if update is not None:
+            self._publish(*update)
+
+    def _publish(self, data: Any, timestamp_ns: int, alarm: Tuple, received_ns: int):
+        start_time = time.perf_counter()
+        self._latest_update = (data, timestamp_ns)
+        self._latest_alarm = alarm
+        self._latest_payloads = {}
+        first_produce = True
+        for schema, topics in self._topics_by_schema.items():
+            payload = self._serialisers[schema].serialise(data, timestamp_ns, *alarm)
+            if alarm:
+                self._latest_payloads[schema] = payload
+            if first_produce:
+                first_produce = False
+                callback_to_produce = (time.time_ns() - received_ns) / 1_000_000_000
+                self.statistics.callback_to_produce_latency.observe(callback_to_produce)
+                callback_to_produce_latency.observe(callback_to_produce)
+            self._publish_payload(payload, topics, timestamp_ns)
+        publish_duration.observe(time.perf_counter() - start_time)
+
+    def republish_latest(self, *alarm):
+        """
+        Publish the latest update again, with the given alarm status and severity.
+        Payloads are reused from the previous publish or republish of the
+        same update with the same alarm details.
+        :param alarm: The alarm status and severity to include in the messages
+        """
+        if self._pipeline is not None:
+            self._pipeline.enqueue(self._republish_latest, *alarm)
+        else:
+            self._republish_latest(*alarm)
+
+    def _republish_latest(self, *alarm):
+        if self._latest_update is None:
+            return
+        data, timestamp_ns = self._latest_update
+        if alarm != self._latest_alarm:
+            self._latest_alarm = alarm
+            self._latest_payloads = {}
+        for schema, topics in self._topics_by_schema.items():
+            try:
+                payload = self._latest_payloads[schema]
+            except KeyError:
+                payload = self._serialisers[schema].serialise(
+                    data, timestamp_ns, *alarm
+                )
+                self._latest_payloads[schema] = payload
+            self._publish_payload(payload, topics, timestamp_ns)
+
+    def _publish_payload(self, payload: bytes, topics: Tuple[str, ...], timestamp_ns):
+        for topic in topics:
+            publish_message(
+                self._producer, topic, payload, self._source_name, timestamp_ns
+            )
+            self.statistics.message_published(len(payload))
+
+    def statistics_dict(self) -> dict:
+        """
+        Statistics for the PV, for the status message
+        """
+        latency = self.statistics.latency_summary()
+        delivery_latency = self._producer.delivery_latency_for(self._source_name)
+        if delivery_latency is not None:
+            latency["produce_to_delivery"] = delivery_latency.summary()
+        return dict(
+            self.statistics.as_dict(),
+            coalesced=self.coalesced_count,
+            delivery_failures=self._producer.failed_deliveries(self._source_name),
+            latency=latency,
+        )
@@ -0,0 +1,124 @@
+import attr
+import fnmatch
+import json
+import time
+import numpy as np
+from typing import Any, Dict, Optional
+
+
+@attr.s(frozen=True)
+class FilterSettings:
+    # Changes no larger than this, in the PV's units, are not forwarded
+    absolute_deadband = attr.ib(type=float, default=0.0)
+    # Changes no larger than this fraction of the last forwarded value are not forwarded
+    relative_deadband = attr.ib(type=float, default=0.0)
+    # Updates sooner than 1/max_rate_hz after the last forwarded update are not forwarded
+    max_rate_hz = attr.ib(type=Optional[float], default=None)
+
+
+class UpdateFilter:
+    """
+    Decides whether a PV update is forwarded, based on how much the value changed
+    since the last forwarded update and how long ago that was.
+    Updates which change the alarm state are always forwarded.
+    """
+
+    def __init__(self, settings: FilterSettings):
+        self._absolute_deadband = settings.absolute_deadband
+        self._relative_deadband = settings.relative_deadband
+        self._has_deadband = self._absolute_deadband > 0 or self._relative_deadband > 0
+        self._min_interval_s = 1 / settings.max_rate_hz if settings.max_rate_hz else 0.0
+        self._last_value: Any = None
+        self._last_forwarded_time = 0.0
+        self.filtered_count = 0
+
+    def should_forward(self, value: Any, alarm_changed: bool) -> bool:
+        """
+        :param value: The PV value, before serialisation
+        :param alarm_changed: Whether the alarm status or severity changed in this update
+        """
+        now = time.monotonic()
+        if not alarm_changed and self._last_value is not None:
+            if (
+                self._min_interval_s
+                and now - self._last_forwarded_time < self._min_interval_s
+            ) or (self._has_deadband and self._within_deadband(value)):
+                self.filtered_count += 1
+                return False
+        self._last_value = value
+        self._last_forwarded_time = now
+        return True
+
+    def seconds_until_rate_allows(self) -> float:
+        """
+        How long until an update is no longer held back by max_rate_hz,
+        a filtered update is only worth forwarding later if this is more than zero
+        """
+        return max(
+            self._last_forwarded_time + self._min_interval_s - time.monotonic(), 0.0
+        )
+
+    def should_forward_held(self, value: Any) -> bool:
+        """
+        Whether to forward the last update held back by max_rate_hz, once the interval
+        has passed, so that the final value of a burst of updates is not lost
+        """
+        if self._has_deadband and self._within_deadband(value):
+            return False
+        # It was counted as filtered when it was held back
+        self.filtered_count -= 1
+        self._last_value = value
+        self._last_forwarded_time = time.monotonic()
+        return True
+
+    def _within_deadband(self, value: Any) -> bool:
+        last_value = self._last_value
+        if (
+            not isinstance(value, np.ndarray)
+            or value.dtype.kind not in "iuf"
+            or value.shape != last_value.shape
+        ):
+            return False
+        # Calculate in float so that differences of unsigned values do not wrap around
+        change = np.abs(value.astype(np.float64) - last_value)
+        threshold = np.maximum(
+            self._absolute_deadband, self._relative_deadband * np.abs(last_value)
+        )
+        return not np.any(change > threshold)
+
+
+class ChannelFilters:
+    """
+    Filter settings for PVs, by PV name pattern.
+    Patterns can use the "*" and "?" wildcards, the first matching pattern applies.
+    """
+
+    def __init__(self, settings_by_pattern: Dict[str, FilterSettings]):
+        self._settings_by_pattern = settings_by_pattern
+
+    def filter_for(self, pv_name: str) -> Optional[UpdateFilter]:
+        """
+        :return: A new filter for the PV, or None if its updates should not be filtered
+        """
+        for pattern, settings in self._settings_by_pattern.items():
+            if fnmatch.fnmatchcase(pv_name, pattern):
+                return UpdateFilter(settings)
+        return None
+
+
+def load_channel_filters(file_name: str) -> ChannelFilters:
+    """
+    Read filter settings from a JSON file, of the form
+    {"PV:NAME:PATTERN*": {"absolute_deadband": 0.1, "relative_deadband": 0.01, "max_rate_hz": 10}}
+    """
+    with open(file_name) as filters_file:
+        settings_json = json.load(filters_file)
+    try:
+        return ChannelFilters(
+            {
+                pattern: FilterSettings(**settings)
+                for pattern, settings in settings_json.items()
+            }
+        )
+    except (AttributeError, TypeError) as error:
+        raise ValueError(f"Invalid channel filters in {file_name}: {error}")
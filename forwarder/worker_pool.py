@@ -0,0 +1,342 @@
+import multiprocessing
+from argparse import Namespace
+from queue import Empty
+from threading import Lock, Thread
+from typing import (
+    Any,
+    Dict,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+from forwarder.application_logger import setup_logger, get_logger
+from forwarder.channel_index import IndexedUpdateHandlers
+from forwarder.configuration_store import ConfigurationStore
+from forwarder.metrics import process_statistics
+from forwarder.parse_config_update import Channel, CommandType, ConfigUpdate
+from forwarder.sharding import config_update_for_shard, WORKER_SHARD_SEED
+from forwarder.status_reporter import StatusReporter
+
+
+# How often each worker process reports its channels and statistics to the supervisor process
+_WORKER_REPORT_INTERVAL_S = 4.0
+
+
+class _WorkerStatusReporter:
+    """
+    Used in place of a StatusReporter in a worker process,
+    sends the worker's channels and statistics to the supervisor process instead of publishing a status message
+    """
+
+    def __init__(
+        self,
+        worker_index: int,
+        update_handlers: Mapping,
+        reports: multiprocessing.Queue,
+        producer: Any,
+        pipeline: Any,
+    ):
+        self._worker_index = worker_index
+        self._update_handlers = update_handlers
+        self._reports = reports
+        self._producer = producer
+        self._pipeline = pipeline
+
+    def report_status(self):
+        channels_by_handler: Dict[int, List[Channel]] = {}
+        handlers = {}
+        for channel, handler in list(self._update_handlers.items()):
+            channels_by_handler.setdefault(id(handler), []).append(channel)
+            handlers[id(handler)] = handler
+        streams = [
+            (
+                tuple(channels),
+                handlers[handler_id].statistics()
+                if hasattr(handlers[handler_id], "statistics")
+                else None,
+            )
+            for handler_id, channels in channels_by_handler.items()
+        ]
+        self._reports.put(
+            (
+                self._worker_index,
+                streams,
+                process_statistics(self._producer, self._pipeline),
+            )
+        )
+
+
+class ReportedHandler:
+    """
+    Stands in for an update handler in a worker process in the supervisor's update_handlers,
+    with the statistics the worker last reported for it
+    """
+
+    def __init__(self, worker_index: int, statistics: Optional[dict]):
+        self.worker_index = worker_index
+        self._statistics = statistics
+
+    def statistics(self) -> dict:
+        return self._statistics if self._statistics is not None else {}
+
+
+def _run_worker(
+    worker_index: int,
+    args: Namespace,
+    commands: multiprocessing.Queue,
+    reports: multiprocessing.Queue,
+):
+    # Imported here, these are only needed in the worker processes
+    from caproto.threading.client import Context as CaContext
+    from p4p.client.thread import Context as PvaContext
+    from forwarder.handle_config_change import handle_configuration_change
+    from forwarder.kafka.kafka_helpers import create_producer, create_spool
+    from forwarder.repeat_timer import get_scheduler, stop_scheduler
+    from forwarder.update_handlers.publish_pipeline import PublishPipeline
+    from forwarder.update_handlers.update_filter import load_channel_filters
+    from forwarder.metrics import MetricsServer, collect_metrics
+
+    logger = setup_logger(
+        level=args.verbosity,
+        log_file_name=args.log_file,
+        graylog_logger_address=args.graylog_logger_address,
+    )
+    ca_ctx = CaContext()
+    pva_ctx = PvaContext("pva", nt=False)
+    producer = create_producer(
+        args.output_broker,
+        args.producer_profile,
+        args.producer_config,
+        args.backpressure_policy,
+        create_spool(
+            args.spool_directory,
+            args.spool_max_mb,
+            args.spool_replay_rate,
+            f"worker-{worker_index}",
+        ),
+        args.producer_statistics_interval_ms,
+    )
+    pipeline = (
+        PublishPipeline(
+            coalesce_backlog=args.coalesce_backlog,
+            max_queued=args.publish_pipeline_capacity,
+        )
+        if args.publish_pipeline or args.coalesce_backlog
+        else None
+    )
+    channel_filters = (
+        load_channel_filters(args.channel_filters_file)
+        if args.channel_filters_file
+        else None
+    )
+    update_handlers: MutableMapping = IndexedUpdateHandlers()
+    status_reporter = _WorkerStatusReporter(
+        worker_index, update_handlers, reports, producer, pipeline
+    )
+    get_scheduler().schedule(_WORKER_REPORT_INTERVAL_S, status_reporter.report_status)
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(
+            args.metrics_port + 1 + worker_index,
+            lambda: collect_metrics(update_handlers, producer, pipeline),
+        )
+        metrics_server.start()
+
+    try:
+        while True:
+            config_change = commands.get()
+            if config_change is None:
+                break
+            handle_configuration_change(
+                config_change,
+                args.fake_pv_period,
+                args.pv_update_period,
+                update_handlers,
+                producer,
+                ca_ctx,
+                pva_ctx,
+                logger,
+                status_reporter,  # type: ignore
+                pipeline=pipeline,
+                channel_filters=channel_filters,
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+        for handler in {
+            id(handler): handler for handler in update_handlers.values()
+        }.values():
+            handler.stop()
+        stop_scheduler()
+        if pipeline is not None:
+            pipeline.stop()
+        producer.close()
+
+
+def merge_worker_channels(
+    update_handlers: MutableMapping[Channel, Any],
+    previous_channels: Set[Channel],
+    worker_index: int,
+    streams: Sequence[Tuple[Tuple[Channel, ...], Optional[dict]]],
+) -> Set[Channel]:
+    """
+    Update the supervisor's view of all channels with the latest channels and statistics reported by a worker
+    :param streams: The channels sharing each of the worker's update handlers, with the handler's statistics
+    :return: The worker's channels, to pass as previous_channels for its next report
+    """
+    current_channels = {channel for channels, _ in streams for channel in channels}
+    for channel in previous_channels - current_channels:
+        update_handlers.pop(channel, None)
+    for channels, statistics in streams:
+        handler = ReportedHandler(worker_index, statistics)
+        for channel in channels:
+            update_handlers[channel] = handler
+    return current_channels
+
+
+class WorkerPool:
+    """
+    Forwards PVs from several worker processes, to make use of more than one CPU core.
+    Each worker has its own EPICS contexts and Kafka producer. Channels are assigned
+    to workers by a stable hash of the PV name, so all channels for the same PV
+    are in the same worker and share its subscription.
+    The channels the workers report are collected into update_handlers,
+    which the status reporter and configuration store use as in a single process,
+    and the rest of the statistics each worker reports into worker_statistics.
+    """
+
+    def __init__(
+        self,
+        number_of_workers: int,
+        args: Namespace,
+        update_handlers: MutableMapping[Channel, Any],
+        status_reporter: StatusReporter,
+        configuration_store: ConfigurationStore,
+        worker_statistics: Optional[Dict[int, dict]] = None,
+    ):
+        """
+        :param worker_statistics: Filled in with the process_statistics each worker last reported
+        """
+        self._logger = get_logger()
+        self._args = args
+        self._update_handlers = update_handlers
+        self._worker_statistics = (
+            worker_statistics if worker_statistics is not None else {}
+        )
+        self._status_reporter = status_reporter
+        self._configuration_store = configuration_store
+        self._worker_channels: List[Set[Channel]] = [
+            set() for _ in range(number_of_workers)
+        ]
+
+        # Spawn rather than fork, as this process is already running threads
+        self._context = multiprocessing.get_context("spawn")
+        self._reports = self._context.Queue()
+        # Held while sending commands, so that a worker is not replaced part way through
+        self._commands_lock = Lock()
+        self._stopping = False
+        self._commands = [self._context.Queue() for _ in range(number_of_workers)]
+        self._workers = [
+            self._start_worker(worker_index)
+            for worker_index in range(number_of_workers)
+        ]
+
+        self._cancelled = False
+        self._report_thread = Thread(target=self._receive_reports, daemon=True)
+        self._report_thread.start()
+
+    def _start_worker(self, worker_index: int):
+        worker = self._context.Process(
+            target=_run_worker,
+            args=(
+                worker_index,
+                self._args,
+                self._commands[worker_index],
+                self._reports,
+            ),
+            name=f"forwarder-worker-{worker_index}",
+        )
+        worker.start()
+        return worker
+
+    def handle_configuration_change(self, configuration_change: ConfigUpdate):
+        """
+        Send each worker the part of the configuration change which applies to it
+        """
+        if configuration_change.command_type == CommandType.MALFORMED:
+            return
+        with self._commands_lock:
+            for worker_index, commands in enumerate(self._commands):
+                worker_change = config_update_for_shard(
+                    configuration_change,
+                    worker_index,
+                    len(self._commands),
+                    WORKER_SHARD_SEED,
+                )
+                if (
+                    worker_change.command_type == CommandType.ADD
+                    and not worker_change.channels
+                ):
+                    continue
+                commands.put(worker_change)
+
+    def _restart_exited_workers(self):
+        """
+        Replace any worker which has exited, for example after a crash in an EPICS or
+        Kafka library, with a new one forwarding the channels it last reported
+        """
+        with self._commands_lock:
+            if self._stopping:
+                return
+            for worker_index, worker in enumerate(self._workers):
+                if worker.is_alive():
+                    continue
+                channels = tuple(self._worker_channels[worker_index])
+                self._logger.error(
+                    f"{worker.name} exited with code {worker.exitcode}, restarting it to forward "
+                    f"its {len(channels)} channels, configuration changes it had not applied are lost"
+                )
+                # A new queue, as the exited worker may have held the lock for reading the old one
+                self._commands[worker_index] = self._context.Queue()
+                self._workers[worker_index] = self._start_worker(worker_index)
+                if channels:
+                    self._commands[worker_index].put(
+                        ConfigUpdate(CommandType.ADD, channels)
+                    )
+
+    def _receive_reports(self):
+        while not self._cancelled:
+            self._restart_exited_workers()
+            try:
+                worker_index, streams, statistics = self._reports.get(timeout=0.5)
+            except Empty:
+                continue
+            previous_channels = self._worker_channels[worker_index]
+            self._worker_channels[worker_index] = merge_worker_channels(
+                self._update_handlers, previous_channels, worker_index, streams
+            )
+            self._worker_statistics[worker_index] = statistics
+            # Workers also report periodically, the status and configuration only need to be
+            # updated straight away when their channels change
+            if self._worker_channels[worker_index] != previous_channels:
+                self._status_reporter.report_status()
+                self._configuration_store.save_configuration(self._update_handlers)
+
+    def stop(self):
+        with self._commands_lock:
+            self._stopping = True
+            for commands in self._commands:
+                commands.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                self._logger.error(f"{worker.name} did not stop, terminating it")
+                worker.terminate()
+        self._cancelled = True
+        self._report_thread.join()
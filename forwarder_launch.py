@@ -1,20 +1,32 @@
 from caproto.threading.client import Context as CaContext
 from p4p.client.thread import Context as PvaContext
-from typing import Dict
+from typing import Dict, MutableMapping, Optional
 
 from forwarder.kafka.kafka_helpers import (
     create_producer,
     create_consumer,
+    create_spool,
     get_broker_and_topic_from_uri,
 )
 from forwarder.application_logger import setup_logger
+from forwarder.channel_index import IndexedUpdateHandlers
 from forwarder.parse_config_update import parse_config_update
 from forwarder.status_reporter import StatusReporter
 from forwarder.parse_commandline_args import parse_args, get_version
 from forwarder.handle_config_change import handle_configuration_change
 from forwarder.update_handlers.create_update_handler import UpdateHandler
-from forwarder.parse_config_update import Channel
-from forwarder.configuration_store import ConfigurationStore, NullConfigurationStore
+from forwarder.parse_config_update import Channel, ConfigUpdate
+from forwarder.configuration_store import (
+    ConfigurationStore,
+    NullConfigurationStore,
+    restore_configuration,
+)
+from forwarder.repeat_timer import milliseconds_to_seconds, stop_scheduler
+from forwarder.update_handlers.publish_pipeline import PublishPipeline
+from forwarder.update_handlers.update_filter import load_channel_filters
+from forwarder.worker_pool import WorkerPool
+from forwarder.metrics import MetricsServer, collect_metrics
+from forwarder.sharding import config_update_for_shard
 
 
 if __name__ == "__main__":
@@ -29,14 +41,49 @@ if __name__ == "__main__":
     logger.info(f"Forwarder v{version} started, service Id: {args.service_id}")
 
     # EPICS
-    ca_ctx = CaContext()
-    pva_ctx = PvaContext("pva", nt=False)
+    channel_filters = (
+        load_channel_filters(args.channel_filters_file)
+        if args.channel_filters_file
+        else None
+    )
     # Using dictionary with Channel as key to ensure we avoid having multiple handlers active for
-    # identical configurations: serialising updates from same pv with same schema and publishing to same topic
-    update_handlers: Dict[Channel, UpdateHandler] = dict()
+    # identical configurations: serialising updates from same pv with same schema and publishing to same topic.
+    # Channels for the same PV and protocol share a handler, so the PV is only subscribed to once.
+    update_handlers: MutableMapping[Channel, UpdateHandler] = IndexedUpdateHandlers()
+
+    # With more than one worker the PVs are forwarded from worker processes, which have their own
+    # EPICS contexts, producer and pipeline, update_handlers then only records which worker each
+    # channel is forwarded by
+    forward_from_workers = args.workers > 1
+    # The statistics each worker process last reported, by worker index
+    worker_statistics: Optional[Dict[int, dict]] = {} if forward_from_workers else None
+    epics_contexts = (
+        None if forward_from_workers else (CaContext(), PvaContext("pva", nt=False))
+    )
 
     # Kafka
-    producer = create_producer(args.output_broker)
+    producer = (
+        None
+        if forward_from_workers
+        else create_producer(
+            args.output_broker,
+            args.producer_profile,
+            args.producer_config,
+            args.backpressure_policy,
+            create_spool(
+                args.spool_directory, args.spool_max_mb, args.spool_replay_rate
+            ),
+            args.producer_statistics_interval_ms,
+        )
+    )
+    pipeline = (
+        PublishPipeline(
+            coalesce_backlog=args.coalesce_backlog,
+            max_queued=args.publish_pipeline_capacity,
+        )
+        if not forward_from_workers and (args.publish_pipeline or args.coalesce_backlog)
+        else None
+    )
     config_broker, config_topic = get_broker_and_topic_from_uri(args.config_topic)
     consumer = create_consumer(config_broker)
     consumer.subscribe([config_topic])
@@ -44,46 +91,83 @@ if __name__ == "__main__":
     status_broker, status_topic = get_broker_and_topic_from_uri(args.status_topic)
     status_reporter = StatusReporter(
         update_handlers,
-        create_producer(status_broker),
+        create_producer(status_broker, args.producer_profile, args.producer_config),
         status_topic,
         args.service_id,
         version,
         logger,
+        output_producer=producer,
+        pipeline=pipeline,
+        worker_statistics=worker_statistics,
     )
     status_reporter.start()
 
     if args.storage_topic:
         store_broker, store_topic = get_broker_and_topic_from_uri(args.storage_topic)
         configuration_store = ConfigurationStore(
-            create_producer(store_broker), create_consumer(store_broker), store_topic
+            create_producer(store_broker, args.producer_profile, args.producer_config),
+            create_consumer(store_broker),
+            store_topic,
+            milliseconds_to_seconds(args.storage_save_interval_ms),
+            local_file=args.local_storage_file,
         )
-        if not args.skip_retrieval:
-            try:
-                restore_config_command = parse_config_update(
-                    configuration_store.retrieve_configuration()
-                )
-                handle_configuration_change(
-                    restore_config_command,
-                    args.fake_pv_period,
-                    args.pv_update_period,
-                    update_handlers,
-                    producer,
-                    ca_ctx,
-                    pva_ctx,
-                    logger,
-                    status_reporter,
-                    configuration_store,
-                )
-            except RuntimeError as error:
-                logger.error(
-                    "Could not retrieve stored configuration on start-up: " f"{error}"
-                )
     else:
         configuration_store = NullConfigurationStore
 
-    # Metrics
-    # use https://github.com/Jetsetter/graphyte ?
-    # https://julien.danjou.info/atomic-lock-free-counters-in-python/
+    worker_pool = (
+        WorkerPool(
+            args.workers,
+            args,
+            update_handlers,
+            status_reporter,
+            configuration_store,
+            worker_statistics,
+        )
+        if forward_from_workers
+        else None
+    )
+
+    def apply_configuration_change(config_change: ConfigUpdate):
+        # Other instances on the same config topic add the channels outside this shard
+        config_change = config_update_for_shard(
+            config_change, args.shard_index, args.shard_count
+        )
+        if worker_pool is not None:
+            worker_pool.handle_configuration_change(config_change)
+        elif producer is not None and epics_contexts is not None:
+            ca_ctx, pva_ctx = epics_contexts
+            handle_configuration_change(
+                config_change,
+                args.fake_pv_period,
+                args.pv_update_period,
+                update_handlers,
+                producer,
+                ca_ctx,
+                pva_ctx,
+                logger,
+                status_reporter,
+                configuration_store,
+                pipeline,
+                channel_filters,
+            )
+
+    if args.storage_topic and not args.skip_retrieval:
+        try:
+            restore_configuration(configuration_store, apply_configuration_change)
+        except RuntimeError as error:
+            logger.error(
+                "Could not retrieve stored configuration on start-up: " f"{error}"
+            )
+
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(
+            args.metrics_port,
+            lambda: collect_metrics(
+                update_handlers, producer, pipeline, worker_statistics
+            ),
+        )
+        metrics_server.start()
 
     try:
         while True:
@@ -95,25 +179,25 @@ if __name__ == "__main__":
             else:
                 logger.info("Received config message")
                 config_change = parse_config_update(msg.value())
-                handle_configuration_change(
-                    config_change,
-                    args.fake_pv_period,
-                    args.pv_update_period,
-                    update_handlers,
-                    producer,
-                    ca_ctx,
-                    pva_ctx,
-                    logger,
-                    status_reporter,
-                    configuration_store,
-                )
+                apply_configuration_change(config_change)
 
     except KeyboardInterrupt:
         logger.info("%% Aborted by user")
 
     finally:
+        if metrics_server is not None:
+            metrics_server.stop()
         status_reporter.stop()
-        for _, handler in update_handlers.items():
-            handler.stop()
+        if worker_pool is not None:
+            worker_pool.stop()
+        else:
+            for _, handler in update_handlers.items():
+                handler.stop()
+        stop_scheduler()
+        if pipeline is not None:
+            pipeline.stop()
         consumer.close()
-        producer.close()
+        if producer is not None:
+            producer.close()
+        # Saves any changes to the configuration waiting for the save interval
+        configuration_store.stop()
@@ -0,0 +1,34 @@
+from forwarder.epics_to_serialisable_types import ValueConverter
+import numpy as np
+import timeit
+
+"""
+Compares converting large waveform PV values with squeeze and astype,
+which always copies, to using a ValueConverter.
+"""
+
+NUMBER_OF_ELEMENTS = 1_000_000
+REPEATS = 200
+
+if __name__ == "__main__":
+    for description, value, output_type in (
+        ("float64 native", np.random.rand(NUMBER_OF_ELEMENTS), np.float64),
+        (
+            "float64 big-endian",
+            np.random.rand(NUMBER_OF_ELEMENTS).astype(">f8"),
+            np.float64,
+        ),
+        ("int16 to int32", np.arange(NUMBER_OF_ELEMENTS, dtype=np.int16), np.int32,),
+    ):
+        converter = ValueConverter(output_type)
+        astype_time = timeit.timeit(
+            lambda: np.squeeze(value).astype(output_type), number=REPEATS
+        )
+        # Copy the input, as the converter may byteswap it in place
+        converter_time = timeit.timeit(
+            lambda: converter(value.copy()), number=REPEATS
+        ) - timeit.timeit(lambda: value.copy(), number=REPEATS)
+        print(
+            f"{description}: astype {astype_time / REPEATS * 1e6:.0f} us, "
+            f"converter {converter_time / REPEATS * 1e6:.0f} us"
+        )
@@ -0,0 +1,51 @@
+from forwarder.kafka.kafka_producer import KafkaProducer
+import confluent_kafka
+import time
+
+"""
+Measures how many messages per second can be passed to the producer, comparing
+a new delivery callback and poll per message with the KafkaProducer class.
+Messages are only queued locally, a broker does not need to be running.
+"""
+
+NUMBER_OF_MESSAGES = 200000
+PAYLOAD = bytes(64)
+CONFIG = {
+    "bootstrap.servers": "localhost:9092",
+    "queue.buffering.max.messages": NUMBER_OF_MESSAGES * 2,
+    "message.timeout.ms": 1000,
+}
+
+
+def callback_and_poll_per_message() -> float:
+    producer = confluent_kafka.Producer(CONFIG)
+    start = time.perf_counter()
+    for _ in range(NUMBER_OF_MESSAGES):
+
+        def ack(err, _):
+            if err:
+                print(f"Message failed delivery: {err}")
+
+        producer.produce(
+            "benchmark", PAYLOAD, key="source", on_delivery=ack, timestamp=0
+        )
+        producer.poll(0)
+    elapsed = time.perf_counter() - start
+    producer.purge()
+    return NUMBER_OF_MESSAGES / elapsed
+
+
+def kafka_producer() -> float:
+    producer = KafkaProducer(CONFIG)
+    start = time.perf_counter()
+    for _ in range(NUMBER_OF_MESSAGES):
+        producer.produce("benchmark", PAYLOAD, 0, key="source")
+    elapsed = time.perf_counter() - start
+    producer._producer.purge()
+    producer.close()
+    return NUMBER_OF_MESSAGES / elapsed
+
+
+if __name__ == "__main__":
+    print(f"Callback and poll per message: {callback_and_poll_per_message():.0f} msg/s")
+    print(f"KafkaProducer: {kafka_producer():.0f} msg/s")
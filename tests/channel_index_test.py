@@ -0,0 +1,97 @@
+from forwarder.channel_index import ChannelIndex, IndexedUpdateHandlers
+from forwarder.parse_config_update import Channel, EpicsProtocol
+import fnmatch
+import pytest
+
+channels = [
+    Channel(name, EpicsProtocol.CA, topic, schema)
+    for name in ["MOTOR:X", "MOTOR:Y", "MOTOR:XY", "MOTION:Z", "TEMP:1", "TEMP:[1]"]
+    for topic in ["motion_topic", "temperature_topic"]
+    for schema in ["f142", "tdct"]
+]
+
+
+def _matches_by_scan(remove_channel: Channel):
+    # How channels to remove were found before there was an index
+    return [
+        channel
+        for channel in channels
+        if (
+            not remove_channel.name
+            or fnmatch.fnmatch(channel.name, remove_channel.name)  # type: ignore
+        )
+        and (not remove_channel.schema or channel.schema == remove_channel.schema)
+        and (
+            not remove_channel.output_topic
+            or fnmatch.fnmatch(channel.output_topic, remove_channel.output_topic)  # type: ignore
+        )
+    ]
+
+
+@pytest.mark.parametrize(
+    "name", [None, "MOTOR:X", "MOTOR:*", "MOT*", "MOTOR:?", "*:X*", "TEMP:[1]", "NONE*"]
+)
+@pytest.mark.parametrize("topic", [None, "motion_topic", "*_topic", "temp*", "none"])
+@pytest.mark.parametrize("schema", [None, "f142", "tdct"])
+def test_matches_are_the_same_as_matching_every_channel(name, topic, schema):
+    remove_channel = Channel(name, EpicsProtocol.NONE, topic, schema)
+
+    assert ChannelIndex(channels).matching(remove_channel) == _matches_by_scan(
+        remove_channel
+    )
+
+
+def test_removed_channels_are_not_matched():
+    channel_index = ChannelIndex(channels)
+    remove_channel = Channel("MOTOR:*", EpicsProtocol.NONE, None, None)
+
+    channel_index.remove(channel_index.matching(remove_channel))
+
+    assert channel_index.matching(remove_channel) == []
+    assert (
+        len(channel_index.matching(Channel(None, EpicsProtocol.NONE, None, None)))
+        == len(channels) - 12
+    )
+
+
+def test_channels_added_after_removing_a_name_are_matched_by_prefix():
+    channel_index = ChannelIndex(channels)
+    channel_index.remove(
+        channel_index.matching(Channel("MOTOR:X", EpicsProtocol.NONE, None, None))
+    )
+    new_channel = Channel("MOTOR:X", EpicsProtocol.PVA, "motion_topic", "f142")
+
+    channel_index.add(new_channel)
+
+    assert new_channel in channel_index.matching(
+        Channel("MOTOR:*", EpicsProtocol.NONE, None, None)
+    )
+    assert channel_index.with_name("MOTOR:X") == {new_channel}
+
+
+def test_indexed_update_handlers_keep_the_index_up_to_date():
+    update_handlers = IndexedUpdateHandlers()
+    for channel in channels:
+        update_handlers[channel] = None
+    everything = Channel(None, EpicsProtocol.NONE, None, None)
+
+    update_handlers.pop(channels[0])
+    del update_handlers[channels[1]]
+
+    assert update_handlers.channel_index.matching(everything) == channels[2:]
+    update_handlers.clear()
+    assert update_handlers.channel_index.matching(everything) == []
+
+
+def test_every_way_of_changing_indexed_update_handlers_updates_the_index():
+    update_handlers = IndexedUpdateHandlers()
+    everything = Channel(None, EpicsProtocol.NONE, None, None)
+
+    update_handlers.update({channels[0]: None, channels[1]: None})
+    update_handlers.setdefault(channels[2], None)
+    update_handlers |= {channels[3]: None}
+    assert update_handlers.channel_index.matching(everything) == channels[:4]
+
+    removed_channel, _ = update_handlers.popitem()
+    assert removed_channel not in update_handlers.channel_index.matching(everything)
+    assert update_handlers.channel_index.matching(everything) == list(update_handlers)
@@ -0,0 +1,53 @@
+from forwarder.epics_to_serialisable_types import ValueConverter
+import numpy as np
+
+
+def test_value_already_of_output_type_is_not_copied():
+    value = np.arange(1000, dtype=np.float64)
+    converted = ValueConverter(np.float64)(value)
+
+    assert np.shares_memory(value, converted)
+
+
+def test_big_endian_value_is_converted_to_native_byte_order():
+    expected = np.arange(1000, dtype=np.float64)
+    converted = ValueConverter(np.float64)(expected.astype(">f8"))
+
+    assert converted.dtype == np.dtype(np.float64)
+    assert np.array_equal(converted, expected)
+
+
+def test_read_only_value_is_not_modified():
+    value = np.frombuffer(np.arange(10, dtype=">i4").tobytes(), dtype=">i4")
+    converted = ValueConverter(np.int32)(value)
+
+    assert not value.flags.writeable
+    assert np.array_equal(value, np.arange(10))
+    assert np.array_equal(converted, np.arange(10))
+
+
+def test_smaller_input_type_is_cast_to_output_type():
+    converter = ValueConverter(np.int32)
+    assert converter(np.array([7], dtype=">i2")).dtype == np.dtype(np.int32)
+    assert converter(np.array([70000], dtype=np.int64)).dtype == np.dtype(np.int32)
+
+
+def test_single_element_and_python_values_are_squeezed_to_scalars():
+    converter = ValueConverter(np.float64)
+    assert converter(np.array([4.2])).shape == ()
+    assert converter(4.2).shape == ()
+
+
+def test_strings_are_converted_to_unicode():
+    assert ValueConverter(np.unicode_)("hello").dtype.kind == "U"
+
+
+def test_writeable_big_endian_value_is_not_modified():
+    value = np.arange(10, dtype=">i4")
+    original_bytes = value.tobytes()
+    converted = ValueConverter(np.int32)(value)
+
+    assert value.tobytes() == original_bytes
+    assert value.dtype == np.dtype(">i4")
+    assert not np.shares_memory(value, converted)
+    assert np.array_equal(converted, np.arange(10))
@@ -1,4 +1,5 @@
 from forwarder.configuration_store import ConfigurationStore
+from forwarder.channel_index import IndexedUpdateHandlers
 from forwarder.handle_config_change import handle_configuration_change
 from tests.kafka.fake_producer import FakeProducer
 import logging
@@ -34,12 +35,12 @@ def _get_channel_names(update_handlers: Dict[Channel, UpdateHandler]) -> List[st
     ]
 
 
-@pytest.fixture(scope="function")
-def update_handlers():
+@pytest.fixture(scope="function", params=[dict, IndexedUpdateHandlers])
+def update_handlers(request):
     """
     Fixture for creating update handlers to ensure they get cleaned up, whether the test passes or not
     """
-    update_handlers: Dict[Channel, UpdateHandler] = {}
+    update_handlers: Dict[Channel, UpdateHandler] = request.param()
     yield update_handlers
 
     # Clean up
@@ -430,3 +431,82 @@ def test_configuration_not_stored_when_command_is_malformed(update_handlers,):
     handle_configuration_change(config_update, 20000, None, update_handlers, producer, None, None, _logger, status_reporter, config_store)  # type: ignore
 
     config_store.save_configuration.assert_not_called()
+
+
+def test_channels_for_the_same_pv_and_protocol_share_an_update_handler(
+    update_handlers,
+):
+    status_reporter = StubStatusReporter()
+    producer = FakeProducer()
+    channel_name = "test_channel"
+    test_channel_1 = Channel(channel_name, EpicsProtocol.FAKE, "output_topic", "f142")
+    test_channel_2 = Channel(channel_name, EpicsProtocol.FAKE, "output_topic_2", "f142")
+    test_channel_3 = Channel(channel_name, EpicsProtocol.FAKE, "output_topic", "tdct")
+    config_update = ConfigUpdate(
+        CommandType.ADD, (test_channel_1, test_channel_2, test_channel_3,),
+    )
+
+    handle_configuration_change(config_update, 20000, None, update_handlers, producer, None, None, _logger, status_reporter)  # type: ignore
+    assert update_handlers[test_channel_1] is update_handlers[test_channel_2]
+    assert update_handlers[test_channel_1] is update_handlers[test_channel_3]
+
+
+def test_removing_channel_which_shares_update_handler_only_removes_its_sink(
+    update_handlers,
+):
+    status_reporter = StubStatusReporter()
+    producer = FakeProducer()
+    channel_name = "test_channel"
+    test_channel_1 = Channel(channel_name, EpicsProtocol.FAKE, "output_topic", "f142")
+    test_channel_2 = Channel(channel_name, EpicsProtocol.FAKE, "output_topic_2", "f142")
+    add_update = ConfigUpdate(CommandType.ADD, (test_channel_1, test_channel_2,),)
+    handle_configuration_change(add_update, 20000, None, update_handlers, producer, None, None, _logger, status_reporter)  # type: ignore
+
+    remove_update = ConfigUpdate(CommandType.REMOVE, (test_channel_1,))
+    handle_configuration_change(remove_update, 20000, None, update_handlers, producer, None, None, _logger, status_reporter)  # type: ignore
+    assert list(update_handlers.keys()) == [test_channel_2]
+
+    update_handlers[test_channel_2]._timer_callback()
+    assert producer.published_topics == [
+        "output_topic_2"
+    ], "Expected the remaining channel to still be forwarded, but only to its own topic"
+
+
+def test_exact_remove_only_removes_channel_with_the_same_protocol(update_handlers):
+    status_reporter = StubStatusReporter()
+    ca_channel = Channel("test[1]", EpicsProtocol.CA, "output_topic", "f142")
+    pva_channel = Channel("test[1]", EpicsProtocol.PVA, "output_topic", "f142")
+    ca_handler = mock.Mock()
+    update_handlers[ca_channel] = ca_handler
+    update_handlers[pva_channel] = StubUpdateHandler()
+
+    remove_update = ConfigUpdate(CommandType.REMOVE_EXACT, (ca_channel,))
+    handle_configuration_change(remove_update, 20000, None, update_handlers, FakeProducer(), None, None, _logger, status_reporter)  # type: ignore
+
+    assert list(update_handlers.keys()) == [pva_channel]
+    ca_handler.stop.assert_called_once()
+
+
+def test_adding_channel_for_pv_which_is_already_forwarded_shares_its_update_handler(
+    update_handlers,
+):
+    status_reporter = StubStatusReporter()
+    producer = FakeProducer()
+    test_channel_1 = Channel("test_channel", EpicsProtocol.FAKE, "output_topic", "f142")
+    test_channel_2 = Channel(
+        "test_channel", EpicsProtocol.FAKE, "output_topic_2", "f142"
+    )
+    test_channel_3 = Channel(
+        "test_channel_2", EpicsProtocol.FAKE, "output_topic", "f142"
+    )
+    handle_configuration_change(ConfigUpdate(CommandType.ADD, (test_channel_1,)), 20000, None, update_handlers, producer, None, None, _logger, status_reporter)  # type: ignore
+
+    handle_configuration_change(ConfigUpdate(CommandType.ADD, (test_channel_2, test_channel_3)), 20000, None, update_handlers, producer, None, None, _logger, status_reporter)  # type: ignore
+
+    assert list(update_handlers.keys()) == [
+        test_channel_1,
+        test_channel_2,
+        test_channel_3,
+    ]
+    assert update_handlers[test_channel_1] is update_handlers[test_channel_2]
+    assert update_handlers[test_channel_1] is not update_handlers[test_channel_3]
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, List, Tuple
 
 
 class FakeProducer:
@@ -9,12 +9,27 @@ class FakeProducer:
     def __init__(self):
         self.messages_published = 0
         self.published_payload: Optional[bytes] = None
+        self.published_topics: List[str] = []
+        self.published_headers: List[Optional[List[Tuple[str, bytes]]]] = []
 
     def produce(
-        self, topic: str, payload: bytes, timestamp_ms: int, key: Optional[str] = None,
+        self,
+        topic: str,
+        payload: bytes,
+        timestamp_ms: int,
+        key: Optional[str] = None,
+        headers: Optional[List[Tuple[str, bytes]]] = None,
     ):
         self.messages_published += 1
         self.published_payload = payload
+        self.published_topics.append(topic)
+        self.published_headers.append(headers)
+
+    def failed_deliveries(self, key: str) -> int:
+        return 0
+
+    def delivery_latency_for(self, key: str):
+        return None
 
     def close(self):
         pass
@@ -1,5 +1,16 @@
-from forwarder.kafka.kafka_helpers import get_broker_and_topic_from_uri
+from forwarder.kafka.kafka_helpers import (
+    create_producer,
+    get_broker_and_topic_from_uri,
+    F142Serialiser,
+    serialise_f142_message,
+)
+from forwarder.kafka.kafka_producer import BackpressurePolicy
+from streaming_data_types.logdata_f142 import deserialise_f142
+from streaming_data_types.fbschemas.logdata_f142.AlarmStatus import AlarmStatus
+from streaming_data_types.fbschemas.logdata_f142.AlarmSeverity import AlarmSeverity
+import numpy as np
 import pytest
+from unittest import mock
 
 
 def test_raises_exception_if_no_forward_slash_present():
@@ -8,6 +19,28 @@ def test_raises_exception_if_no_forward_slash_present():
         get_broker_and_topic_from_uri(test_uri)
 
 
+def test_producer_config_overrides_take_precedence_over_profile():
+    with mock.patch("forwarder.kafka.kafka_helpers.KafkaProducer") as producer:
+        create_producer("localhost:9092", "throughput", {"linger.ms": "5"})
+
+    producer_config = producer.call_args[0][0]
+    assert producer_config["bootstrap.servers"] == "localhost:9092"
+    assert producer_config["compression.type"] == "lz4"
+    assert producer_config["linger.ms"] == "5"
+
+
+def test_producer_waits_for_space_in_its_queue_unless_given_a_backpressure_policy():
+    with mock.patch("forwarder.kafka.kafka_helpers.KafkaProducer") as producer:
+        create_producer("localhost:9092")
+
+    assert producer.call_args[0][1] == BackpressurePolicy.BLOCK
+
+
+def test_create_producer_raises_for_unknown_profile():
+    with pytest.raises(ValueError):
+        create_producer("localhost:9092", "not_a_profile")
+
+
 def test_uri_with_broker_name_and_topic_successfully_split():
     test_broker = "localhost"
     test_topic = "some_topic"
@@ -33,3 +66,83 @@ def test_uri_with_port_after_broker_is_included_in_broker_output():
     broker, topic = get_broker_and_topic_from_uri(test_uri)
     assert broker == test_broker
     assert topic == test_topic
+
+
+@pytest.mark.parametrize(
+    "dtype",
+    [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32]
+    + [np.int64, np.uint64, np.float32, np.float64],
+)
+def test_f142_serialiser_output_is_identical_to_serialise_f142(dtype):
+    serialiser = F142Serialiser("source_name")
+    values = [3, 0, 1, 120, 0, 7]
+    timestamps = [1_000, 2_000, 0, 4_000, 5_000, 123_456_789_000]
+    alarms = [
+        (AlarmStatus.HIGH, AlarmSeverity.MINOR),
+        (),
+        (AlarmStatus.NO_ALARM, AlarmSeverity.NO_ALARM),
+        (AlarmStatus.NO_CHANGE, AlarmSeverity.NO_CHANGE),
+        (AlarmStatus.LOLO, None),
+        (),
+    ]
+    # Repeat so that later updates are encoded from templates
+    for value, timestamp, alarm in 2 * list(zip(values, timestamps, alarms)):
+        data = np.array(value).astype(dtype)
+        assert serialiser.serialise(data, timestamp, *alarm) == serialise_f142_message(
+            data, "source_name", timestamp, *alarm
+        )
+
+
+def test_f142_serialiser_output_is_identical_to_serialise_f142_for_special_floats():
+    serialiser = F142Serialiser("source_name")
+    for value in [1.5, -0.0, np.inf, -np.inf, np.nan, 2.5e-300]:
+        data = np.array(value)
+        assert serialiser.serialise(data, 1_000) == serialise_f142_message(
+            data, "source_name", 1_000
+        )
+
+
+@pytest.mark.parametrize(
+    "value", [np.array("a string"), np.array([1.1, 2.2, 3.3]), np.array([1, 2, 3])]
+)
+def test_f142_serialiser_serialises_non_scalar_numeric_values(value):
+    serialiser = F142Serialiser("source_name")
+    payload = serialiser.serialise(value, 1_000, AlarmStatus.HIGH, AlarmSeverity.MAJOR)
+
+    pv_update = deserialise_f142(payload)
+    assert np.array_equal(pv_update.value, value)
+    assert pv_update.timestamp_unix_ns == 1_000
+    assert pv_update.alarm_status == AlarmStatus.HIGH
+    assert pv_update.alarm_severity == AlarmSeverity.MAJOR
+
+
+@pytest.mark.parametrize(
+    "dtype",
+    [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32]
+    + [np.int64, np.uint64, np.float32, np.float64],
+)
+def test_f142_serialiser_array_output_is_identical_to_serialise_f142(dtype):
+    serialiser = F142Serialiser("source_name")
+    updates = [
+        (np.arange(100), 1_000, (AlarmStatus.HIGH, AlarmSeverity.MINOR)),
+        (np.arange(100, 200), 2_000, ()),
+        (np.zeros(100), 3_000, ()),
+        (np.arange(5), 4_000, (AlarmStatus.NO_ALARM, AlarmSeverity.NO_ALARM)),
+        (np.arange(200, 300), 5_000, ()),
+        (np.arange(5, 10), 6_000, (AlarmStatus.LOLO, AlarmSeverity.MAJOR)),
+    ]
+    for value, timestamp, alarm in updates:
+        data = value.astype(dtype)
+        assert serialiser.serialise(data, timestamp, *alarm) == serialise_f142_message(
+            data, "source_name", timestamp, *alarm
+        )
+
+
+def test_f142_serialiser_keeps_bounded_number_of_templates():
+    serialiser = F142Serialiser("source_name")
+    for length in range(1, 100):
+        data = np.arange(length, dtype=np.int32)
+        assert np.array_equal(
+            deserialise_f142(serialiser.serialise(data, 1_000)).value, data
+        )
+    assert len(serialiser._templates) <= 32
@@ -0,0 +1,146 @@
+from confluent_kafka import KafkaError
+from unittest import mock
+from forwarder.kafka.kafka_producer import KafkaProducer, BackpressurePolicy
+from forwarder.kafka.spool import MessageSpool
+import time
+
+
+def test_delivery_results_are_counted_and_failures_aggregated_by_error():
+    producer = KafkaProducer({"bootstrap.servers": "localhost:9092"})
+    try:
+        message = mock.Mock()
+        message.key.return_value = b"PV"
+        message.latency.return_value = 0.002
+        producer._on_delivery(None, message)
+        producer._on_delivery(None, message)
+        for _ in range(3):
+            producer._on_delivery(KafkaError(KafkaError._MSG_TIMED_OUT), message)
+        producer._on_delivery(KafkaError(KafkaError._QUEUE_FULL), message)
+
+        assert producer.delivery_statistics() == {
+            "delivered": 2,
+            "failed": {"_MSG_TIMED_OUT": 3, "_QUEUE_FULL": 1},
+        }
+        assert producer.failed_deliveries("PV") == 4
+        assert producer.failed_deliveries("OTHER:PV") == 0
+        delivery_latency = producer.delivery_latency_for("PV")
+        assert delivery_latency is not None
+        assert delivery_latency.count == 2
+        assert producer.delivery_latency_for("OTHER:PV") is None
+    finally:
+        producer.close()
+
+
+def test_librdkafka_statistics_are_only_collected_when_enabled():
+    producer = KafkaProducer({"bootstrap.servers": "localhost:9092"})
+    statistics_producer = KafkaProducer(
+        {"bootstrap.servers": "localhost:9092", "statistics.interval.ms": "100"}
+    )
+    try:
+        deadline = time.monotonic() + 5
+        while (
+            statistics_producer.librdkafka_statistics() is None
+            and time.monotonic() < deadline
+        ):
+            time.sleep(0.05)
+
+        statistics = statistics_producer.librdkafka_statistics()
+        assert statistics is not None
+        assert statistics["queue_messages"] == 0
+        assert producer.librdkafka_statistics() is None
+    finally:
+        producer.close()
+        statistics_producer.close()
+
+
+def _producer_with_full_queue(
+    policy: BackpressurePolicy, max_held: int = 100
+) -> KafkaProducer:
+    # No broker is running, so the first message fills the queue
+    producer = KafkaProducer(
+        {
+            "bootstrap.servers": "localhost:9092",
+            "queue.buffering.max.messages": 1,
+            "message.timeout.ms": 300,
+        },
+        policy,
+        block_timeout_s=0.05,
+        max_held_per_key=2,
+        max_held=max_held,
+    )
+    producer.produce("topic", b"first", 0, key="PV")
+    return producer
+
+
+def test_drop_oldest_holds_messages_and_drops_the_oldest_beyond_limit():
+    producer = _producer_with_full_queue(BackpressurePolicy.DROP_OLDEST)
+    try:
+        for message_number in range(3):
+            producer.produce("topic", bytes(message_number), 0, key="PV")
+        statistics = producer.backpressure_statistics()
+    finally:
+        producer.close()
+
+    assert statistics["held"] == 3
+    assert statistics["dropped"] == 1
+    assert statistics["pending"] == 2
+
+
+def test_oldest_held_message_is_dropped_beyond_limit_for_all_keys():
+    producer = _producer_with_full_queue(BackpressurePolicy.DROP_OLDEST, max_held=3)
+    try:
+        for pv_number in range(5):
+            producer.produce("topic", b"message", 0, key=f"PV{pv_number}")
+        statistics = producer.backpressure_statistics()
+        held_keys = [key for _, key in producer._overflow.keys()]
+    finally:
+        producer.close()
+
+    assert statistics["held"] == 5
+    assert statistics["dropped"] == 2
+    assert statistics["pending"] == 3
+    assert held_keys[-3:] == ["PV2", "PV3", "PV4"]
+
+
+def test_keep_latest_holds_only_the_latest_message_for_each_key():
+    producer = _producer_with_full_queue(BackpressurePolicy.KEEP_LATEST)
+    try:
+        for message_number in range(3):
+            producer.produce("topic", bytes(message_number), 0, key="PV")
+        producer.produce("topic", b"other", 0, key="OTHER:PV")
+        statistics = producer.backpressure_statistics()
+    finally:
+        producer.close()
+
+    assert statistics["coalesced"] == 2
+    assert statistics["pending"] == 2
+
+
+def test_block_drops_message_if_queue_does_not_empty_before_timeout():
+    producer = _producer_with_full_queue(BackpressurePolicy.BLOCK)
+    try:
+        producer.produce("topic", b"second", 0, key="PV")
+        statistics = producer.backpressure_statistics()
+    finally:
+        producer.close()
+
+    assert statistics["blocked"] == 1
+    assert statistics["dropped"] == 1
+    assert statistics["pending"] == 0
+
+
+def test_messages_are_spooled_instead_of_held_when_there_is_a_spool(tmp_path):
+    spool = MessageSpool(str(tmp_path))
+    producer = KafkaProducer(
+        {"bootstrap.servers": "localhost:9092", "queue.buffering.max.messages": 1},
+        spool=spool,
+    )
+    producer.produce("topic", b"first", 0, key="PV")
+    producer.produce("topic", b"second", 0, key="PV")
+    producer.produce("topic", b"third", 0, key="PV")
+    statistics = producer.backpressure_statistics()
+    producer.close()
+
+    assert statistics["held"] == 0
+    # The message in the producer's queue is spooled on close
+    assert spool.spooled_count == 3
@@ -0,0 +1,58 @@
+from forwarder.kafka.librdkafka_statistics import summarise_statistics
+
+
+def test_statistics_are_summarised_for_each_broker_and_topic():
+    statistics = {
+        "msg_cnt": 12,
+        "msg_size": 3400,
+        "txmsgs": 1000,
+        "txmsg_bytes": 250000,
+        "brokers": {
+            "localhost:9092/bootstrap": {
+                "name": "localhost:9092/bootstrap",
+                "nodeid": -1,
+                "state": "UP",
+            },
+            "localhost:9092/1": {
+                "name": "localhost:9092/1",
+                "nodeid": 1,
+                "state": "UP",
+                "outbuf_msg_cnt": 5,
+                "waitresp_cnt": 2,
+                "txerrs": 0,
+                "rtt": {"avg": 1500, "p99": 12000},
+            },
+        },
+        "topics": {
+            "motion": {
+                "topic": "motion",
+                "batchsize": {"avg": 4096, "p99": 16384},
+                "batchcnt": {"avg": 40, "p99": 160},
+            }
+        },
+    }
+
+    assert summarise_statistics(statistics) == {
+        "queue_messages": 12,
+        "queue_bytes": 3400,
+        "transmitted_messages": 1000,
+        "transmitted_bytes": 250000,
+        "brokers": {
+            "localhost:9092/1": {
+                "state": "UP",
+                "rtt_avg_ms": 1.5,
+                "rtt_p99_ms": 12.0,
+                "outbuf_messages": 5,
+                "waiting_requests": 2,
+                "transmit_errors": 0,
+            }
+        },
+        "topics": {
+            "motion": {
+                "batch_size_avg_bytes": 4096,
+                "batch_size_p99_bytes": 16384,
+                "batch_messages_avg": 40,
+                "batch_messages_p99": 160,
+            }
+        },
+    }
@@ -0,0 +1,129 @@
+from forwarder.kafka.spool import MessageSpool, SpooledMessage
+from typing import List
+import os
+
+
+def _replay_all(spool: MessageSpool):
+    replayed: List[SpooledMessage] = []
+    spool.replay(replayed.append)
+    return replayed
+
+
+def test_messages_are_replayed_in_the_order_they_were_spooled(tmp_path):
+    spool = MessageSpool(str(tmp_path), segment_bytes=100)
+    messages = [
+        ("topic", f"PV{number}", bytes([number]) * 20, number) for number in range(10)
+    ]
+    for message in messages:
+        spool.append(*message)
+
+    assert _replay_all(spool) == messages
+    assert not spool
+    assert spool.spooled_bytes() == 0
+
+
+def test_message_without_key_is_replayed_without_key(tmp_path):
+    spool = MessageSpool(str(tmp_path))
+    spool.append("topic", None, b"payload", 1)
+
+    assert _replay_all(spool) == [("topic", None, b"payload", 1)]
+
+
+def test_replay_stops_at_message_which_does_not_fit_in_producer_queue(tmp_path):
+    spool = MessageSpool(str(tmp_path))
+    spool.append("topic", "PV1", b"first", 1)
+    spool.append("topic", "PV2", b"second", 2)
+
+    def queue_full(_):
+        raise BufferError
+
+    spool.replay(queue_full)
+
+    assert [message[1] for message in _replay_all(spool)] == ["PV1", "PV2"]
+
+
+def test_replay_is_limited_by_max_messages_and_rate(tmp_path):
+    spool = MessageSpool(str(tmp_path), replay_rate=0.001)
+    for number in range(5):
+        spool.append("topic", "PV", b"payload", number)
+
+    replayed: List[SpooledMessage] = []
+    spool.replay(replayed.append, max_messages=3)
+    assert len(replayed) == 1
+
+    assert spool.replayed_count == 1
+    assert spool.spooled_bytes() > 0
+
+
+def test_oldest_segment_is_dropped_when_spool_is_full(tmp_path):
+    spool = MessageSpool(str(tmp_path), max_bytes=200, segment_bytes=100)
+    for number in range(12):
+        spool.append("topic", "PV", bytes(40), number)
+
+    replayed = _replay_all(spool)
+    assert spool.dropped_count > 0
+    assert len(replayed) + spool.dropped_count == 12
+    assert replayed[-1][3] == 11
+    assert len(os.listdir(tmp_path)) <= 2
+
+
+def test_spooled_messages_are_replayed_after_reopening(tmp_path):
+    spool = MessageSpool(str(tmp_path), segment_bytes=100)
+    for number in range(5):
+        spool.append("topic", "PV", bytes(20), number)
+    spool.close()
+
+    reopened_spool = MessageSpool(str(tmp_path), segment_bytes=100)
+    reopened_spool.append("topic", "PV", bytes(20), 5)
+
+    assert [message[3] for message in _replay_all(reopened_spool)] == list(range(6))
+
+
+def test_message_larger_than_segment_is_dropped(tmp_path):
+    spool = MessageSpool(str(tmp_path), segment_bytes=50)
+    spool.append("topic", "PV", bytes(100), 0)
+
+    assert spool.dropped_count == 1
+    assert _replay_all(spool) == []
+
+
+def test_replay_carries_on_from_where_it_stopped_after_reopening(tmp_path):
+    spool = MessageSpool(str(tmp_path), segment_bytes=200)
+    for number in range(5):
+        spool.append("topic", "PV", bytes(20), number)
+    spool.replay(lambda message: None, max_messages=3)
+    spool.close()
+
+    reopened_spool = MessageSpool(str(tmp_path), segment_bytes=200)
+
+    assert [message[3] for message in _replay_all(reopened_spool)] == [3, 4]
+
+
+def test_empty_and_invalid_segment_files_are_deleted(tmp_path):
+    (tmp_path / "0000000000.spool").touch()
+    (tmp_path / "0000000001.spool").write_bytes(bytes(100))
+
+    spool = MessageSpool(str(tmp_path))
+    spool.append("topic", "PV", b"payload", 1)
+
+    assert _replay_all(spool) == [("topic", "PV", b"payload", 1)]
+    assert "0000000000.spool" not in os.listdir(tmp_path)
+    assert "0000000001.spool" not in os.listdir(tmp_path)
+
+
+def test_replay_stops_at_record_which_was_only_partly_written(tmp_path):
+    spool = MessageSpool(str(tmp_path), segment_bytes=1000)
+    for number in range(3):
+        spool.append("topic", "PV", b"x" * 20, number)
+    spool.close()
+    # As if the process stopped while the end of the last record was being written
+    (segment_path,) = tmp_path.iterdir()
+    segment = bytearray(segment_path.read_bytes())
+    end_of_records = len(segment.rstrip(b"\0"))
+    segment[end_of_records - 5 : end_of_records] = bytes(5)
+    segment_path.write_bytes(segment)
+
+    reopened_spool = MessageSpool(str(tmp_path), segment_bytes=1000)
+    reopened_spool.append("topic", "PV", b"y" * 20, 3)
+
+    assert [message[3] for message in _replay_all(reopened_spool)] == [0, 1, 3]
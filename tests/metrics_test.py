@@ -0,0 +1,178 @@
+from forwarder.metrics import Histogram, MetricsServer, collect_metrics
+from forwarder.parse_config_update import Channel, EpicsProtocol
+from unittest import mock
+from typing import List
+from urllib.request import urlopen
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram()
+    for value in [0.2, 0.25, 0.75, 4.0]:
+        histogram.observe(value)
+
+    lines = histogram.prometheus_lines("latency", {"channel": "PV"})
+
+    assert 'latency_bucket{channel="PV",le="0.125"} 0' in lines
+    assert 'latency_bucket{channel="PV",le="0.25"} 2' in lines
+    assert 'latency_bucket{channel="PV",le="1.0"} 3' in lines
+    assert 'latency_bucket{channel="PV",le="4.0"} 4' in lines
+    assert lines[-3:] == [
+        'latency_bucket{channel="PV",le="+Inf"} 4',
+        'latency_sum{channel="PV"} 5.2',
+        'latency_count{channel="PV"} 4',
+    ]
+
+
+def test_histogram_percentiles_are_within_an_eighth_of_observed_values():
+    histogram = Histogram()
+    for value_ms in range(1, 1001):
+        histogram.observe(value_ms / 1000)
+
+    for percent in [50, 90, 99]:
+        assert percent / 100 <= histogram.percentile(percent) <= percent / 100 * 1.125
+    assert histogram.percentile(100) == 1.0
+
+
+def test_histogram_summary_is_in_milliseconds():
+    histogram = Histogram()
+    histogram.observe(0.003)
+
+    assert histogram.summary() == {
+        "count": 1,
+        "p50_ms": 3.0,
+        "p90_ms": 3.0,
+        "p99_ms": 3.0,
+        "max_ms": 3.0,
+    }
+
+
+def test_empty_histogram_summary_is_zero():
+    assert Histogram().summary() == {
+        "count": 0,
+        "p50_ms": 0.0,
+        "p90_ms": 0.0,
+        "p99_ms": 0.0,
+        "max_ms": 0.0,
+    }
+
+
+def _fake_handler(updates_received: int) -> mock.Mock:
+    handler = mock.Mock()
+    handler.statistics.return_value = {
+        "updates_received": updates_received,
+        "messages_published": 0,
+        "bytes_published": 0,
+        "delivery_failures": 0,
+        "update_rate_hz": 0.0,
+    }
+    return handler
+
+
+def test_metrics_are_reported_once_for_each_pv():
+    shared_handler = _fake_handler(5)
+    update_handlers = {
+        Channel("PV1", EpicsProtocol.CA, "topic_1", "f142"): shared_handler,
+        Channel("PV1", EpicsProtocol.CA, "topic_2", "tdct"): shared_handler,
+        Channel('PV"2', EpicsProtocol.CA, "topic_1", "f142"): _fake_handler(7),
+    }
+
+    metrics = collect_metrics(update_handlers, None)
+
+    assert "forwarder_channels 3" in metrics
+    assert "forwarder_update_handlers 2" in metrics
+    assert (
+        'forwarder_channel_updates_received_total{channel="PV1",protocol="ca"} 5'
+        in metrics
+    )
+    assert (
+        'forwarder_channel_updates_received_total{channel="PV\\"2",protocol="ca"} 7'
+        in metrics
+    )
+    assert metrics.count("# TYPE forwarder_channel_updates_received_total") == 1
+
+
+def test_pv_forwarded_over_both_protocols_is_reported_for_each_protocol():
+    update_handlers = {
+        Channel("PV1", EpicsProtocol.CA, "topic_1", "f142"): _fake_handler(5),
+        Channel("PV1", EpicsProtocol.PVA, "topic_1", "f142"): _fake_handler(7),
+    }
+
+    metrics = collect_metrics(update_handlers, None)
+
+    assert (
+        'forwarder_channel_updates_received_total{channel="PV1",protocol="ca"} 5'
+        in metrics
+    )
+    assert (
+        'forwarder_channel_updates_received_total{channel="PV1",protocol="pva"} 7'
+        in metrics
+    )
+
+
+def test_samples_of_each_metric_are_contiguous():
+    update_handlers = {
+        Channel(f"PV{number}", EpicsProtocol.CA, "topic", "f142"): _fake_handler(number)
+        for number in range(3)
+    }
+    producer = mock.Mock()
+    producer.delivery_statistics.return_value = {
+        "delivered": 10,
+        "failed": {"MSG_TIMED_OUT": 1, "UNKNOWN_TOPIC": 2},
+    }
+    producer.queue_length.return_value = 0
+    producer.backpressure_statistics.return_value = {
+        "held": 1,
+        "dropped": 2,
+        "coalesced": 0,
+        "blocked": 0,
+        "pending": 1,
+    }
+    producer.delivery_latency = Histogram()
+    producer.librdkafka_statistics.return_value = {
+        "queue_messages": 0,
+        "queue_bytes": 0,
+        "brokers": {
+            broker: {
+                "rtt_avg_ms": 1,
+                "rtt_p99_ms": 2,
+                "outbuf_messages": 0,
+                "waiting_requests": 0,
+                "transmit_errors": 0,
+            }
+            for broker in ("broker_1", "broker_2")
+        },
+        "topics": {
+            topic: {"batch_size_avg_bytes": 100, "batch_messages_avg": 2}
+            for topic in ("topic_1", "topic_2")
+        },
+    }
+
+    metrics = collect_metrics(update_handlers, producer)
+
+    families: List[str] = []
+    for line in metrics.splitlines():
+        if line.startswith("# TYPE "):
+            name = line.split()[2]
+        elif line.startswith("#"):
+            continue
+        else:
+            name = line.split("{")[0].split()[0]
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[: -len(suffix)] == families[-1]:
+                    name = families[-1]
+        if not families or families[-1] != name:
+            families.append(name)
+    assert len(families) == len(set(families)), "Samples of a metric are split up"
+    assert "forwarder_producer_backpressure_pending 1" in metrics
+    assert 'forwarder_producer_backpressure_total{outcome="dropped"} 2' in metrics
+    assert "# TYPE forwarder_producer_backpressure_total counter" in metrics
+
+
+def test_metrics_server_serves_collected_metrics():
+    metrics_server = MetricsServer(0, lambda: "forwarder_threads 1\n")
+    metrics_server.start()
+    try:
+        with urlopen(f"http://localhost:{metrics_server.port}/metrics") as response:
+            assert response.read() == b"forwarder_threads 1\n"
+    finally:
+        metrics_server.stop()
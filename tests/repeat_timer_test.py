@@ -0,0 +1,191 @@
+from forwarder.repeat_timer import (
+    PeriodicScheduler,
+    get_scheduler,
+    scheduler_statistics,
+    stop_scheduler,
+)
+from threading import active_count, Event
+from time import sleep, monotonic
+from functools import partial
+from typing import Callable, List, Set
+import pytest
+
+
+def _wait_until(condition: Callable[[], bool], timeout_s: float = 5.0):
+    # Generous timeout, so that a heavily loaded machine does not fail the test
+    deadline = monotonic() + timeout_s
+    while not condition():
+        assert monotonic() < deadline, "Timed out waiting for condition"
+        sleep(0.005)
+
+
+class FakeClock:
+    """
+    Advances by step each time it is read, so that the scheduler thread reaches deadlines
+    """
+
+    def __init__(self, now: float = 100.0, step: float = 0.0):
+        self.now = now
+        self.step = step
+
+    def __call__(self) -> float:
+        now = self.now
+        self.now += self.step
+        return now
+
+
+def test_scheduled_function_is_called_repeatedly():
+    scheduler = PeriodicScheduler()
+    calls: List[int] = []
+    scheduler.schedule(0.01, lambda: calls.append(1))
+
+    _wait_until(lambda: len(calls) > 1)
+    scheduler.stop()
+
+
+def test_function_is_not_called_after_task_is_cancelled():
+    scheduler = PeriodicScheduler()
+    calls: List[int] = []
+    cancelled = Event()
+
+    def cancel_on_third_call():
+        calls.append(1)
+        if len(calls) == 3:
+            task.cancel()
+            cancelled.set()
+
+    task = scheduler.schedule(0.01, cancel_on_third_call)
+    assert cancelled.wait(5)
+    sleep(0.05)
+    scheduler.stop()
+    assert len(calls) == 3
+
+
+def test_scheduling_many_tasks_does_not_start_more_threads():
+    scheduler = PeriodicScheduler()
+    threads_before_scheduling = active_count()
+    called: Set[int] = set()
+    tasks = [
+        scheduler.schedule(0.01, partial(called.add, task_number))
+        for task_number in range(100)
+    ]
+
+    _wait_until(lambda: len(called) == 100)
+    assert active_count() == threads_before_scheduling
+
+    for task in tasks:
+        task.cancel()
+    scheduler.stop()
+
+
+def test_exception_in_one_task_does_not_stop_others_being_called():
+    scheduler = PeriodicScheduler()
+
+    def raise_exception():
+        raise RuntimeError("test exception")
+
+    calls: List[int] = []
+    scheduler.schedule(0.01, raise_exception)
+    scheduler.schedule(0.01, lambda: calls.append(1))
+
+    _wait_until(lambda: len(calls) > 1)
+    scheduler.stop()
+
+
+def test_period_does_not_drift_by_time_taken_in_function():
+    clock = FakeClock(step=0.002)
+    scheduler = PeriodicScheduler(clock)
+    deadlines: List[float] = []
+    finished = Event()
+
+    def slow_function():
+        deadlines.append(task.deadline)
+        clock.now += 0.005
+        if len(deadlines) == 6:
+            task.cancel()
+            finished.set()
+
+    task = scheduler.schedule(0.02, slow_function)
+    assert finished.wait(5)
+    scheduler.stop()
+
+    periods = [later - earlier for earlier, later in zip(deadlines, deadlines[1:])]
+    assert periods == pytest.approx([0.02] * 5)
+
+
+def test_missed_periods_are_skipped_rather_than_called_in_a_burst():
+    clock = FakeClock(step=0.002)
+    scheduler = PeriodicScheduler(clock)
+    deadlines: List[float] = []
+    finished = Event()
+
+    def very_slow_function():
+        deadlines.append(task.deadline)
+        clock.now += 0.05
+        if len(deadlines) == 4:
+            task.cancel()
+            finished.set()
+
+    task = scheduler.schedule(0.02, very_slow_function)
+    assert finished.wait(5)
+    scheduler.stop()
+
+    periods = [later - earlier for earlier, later in zip(deadlines, deadlines[1:])]
+    assert periods == pytest.approx([0.06] * 3)
+
+
+def test_first_calls_of_tasks_scheduled_together_are_spread_across_the_period():
+    clock = FakeClock()
+    scheduler = PeriodicScheduler(clock)
+
+    tasks = [scheduler.schedule(0.2, lambda: None) for _ in range(10)]
+    first_deadlines = sorted(task.deadline for task in tasks)
+    scheduler.stop()
+
+    assert all(100.0 <= deadline < 100.2 for deadline in first_deadlines)
+    assert (
+        first_deadlines[-1] - first_deadlines[0] > 0.1
+    ), "Expected first calls to be spread across the 0.2 second period"
+    assert (
+        min(
+            later - earlier
+            for earlier, later in zip(first_deadlines, first_deadlines[1:])
+        )
+        > 0.2 / 10 / 2
+    ), "Expected no two first calls to be closer than half of an even spacing"
+
+
+def test_statistics_report_difference_between_actual_and_target_period():
+    scheduler = PeriodicScheduler()
+    scheduler.schedule(0.01, lambda: None)
+    _wait_until(lambda: scheduler.statistics()["periodic_calls"] > 1)
+    scheduler.stop()
+
+    statistics = scheduler.statistics()
+    assert statistics["max_period_error_ms"] >= statistics["mean_period_error_ms"]
+
+
+def test_function_called_later_is_only_called_once():
+    scheduler = PeriodicScheduler()
+    calls: List[float] = []
+    scheduler.call_later(0.01, lambda: calls.append(monotonic()))
+    _wait_until(lambda: len(calls) == 1)
+    sleep(0.05)
+    scheduler.stop()
+    assert len(calls) == 1
+
+
+def test_shared_scheduler_is_created_again_after_it_is_stopped():
+    stop_scheduler()
+    assert scheduler_statistics() == {}
+    stopped_scheduler = get_scheduler()
+
+    stop_scheduler()
+    assert scheduler_statistics() == {}
+    calls: List[int] = []
+    task = get_scheduler().call_later(0.01, lambda: calls.append(1))
+    _wait_until(lambda: len(calls) == 1)
+
+    assert get_scheduler() is not stopped_scheduler
+    task.cancel()
+    stop_scheduler()
@@ -0,0 +1,90 @@
+from forwarder.parse_config_update import (
+    Channel,
+    CommandType,
+    ConfigUpdate,
+    EpicsProtocol,
+)
+from forwarder.sharding import (
+    shard_for_pv,
+    config_update_for_shard,
+    WORKER_SHARD_SEED,
+)
+from forwarder.worker_pool import merge_worker_channels
+
+
+def _channel(name: str, topic: str = "output_topic") -> Channel:
+    return Channel(name, EpicsProtocol.CA, topic, "f142")
+
+
+def test_shard_for_pv_is_stable_and_in_range():
+    shard_count = 4
+    for pv_number in range(100):
+        pv_name = f"SIMPLE:PV{pv_number}"
+        shard = shard_for_pv(pv_name, shard_count)
+        assert 0 <= shard < shard_count
+        assert shard == shard_for_pv(pv_name, shard_count)
+
+
+def test_each_added_channel_is_in_exactly_one_shard():
+    shard_count = 3
+    channels = tuple(_channel(f"SIMPLE:PV{pv_number}") for pv_number in range(30))
+    config_update = ConfigUpdate(CommandType.ADD, channels)
+
+    sharded_channels = [
+        config_update_for_shard(config_update, shard_index, shard_count).channels
+        for shard_index in range(shard_count)
+    ]
+
+    assert sorted(
+        channel.name for shard in sharded_channels for channel in shard  # type: ignore
+    ) == sorted((channel.name for channel in channels), key=str)
+
+
+def test_channels_for_the_same_pv_are_in_the_same_shard():
+    shard_count = 3
+    channels = (_channel("SIMPLE:PV", "topic_1"), _channel("SIMPLE:PV", "topic_2"))
+    config_update = ConfigUpdate(CommandType.ADD, channels)
+
+    shard = shard_for_pv("SIMPLE:PV", shard_count)
+    assert (
+        config_update_for_shard(config_update, shard, shard_count).channels == channels
+    )
+
+
+def test_remove_commands_are_sent_to_every_shard():
+    config_update = ConfigUpdate(CommandType.REMOVE, (_channel("SIMPLE:*"),))
+    for shard_index in range(3):
+        assert config_update_for_shard(config_update, shard_index, 3) is config_update
+
+
+def test_workers_of_an_instance_shard_each_get_some_of_its_pvs():
+    shard_count = 2
+    channels = tuple(_channel(f"SIMPLE:PV{pv_number}") for pv_number in range(40))
+    instance_update = config_update_for_shard(
+        ConfigUpdate(CommandType.ADD, channels), 0, shard_count
+    )
+
+    for worker_index in range(shard_count):
+        assert config_update_for_shard(
+            instance_update, worker_index, shard_count, WORKER_SHARD_SEED
+        ).channels
+
+
+def test_merging_worker_channels_adds_and_removes_only_that_workers_channels():
+    update_handlers = {_channel("OTHER:PV"): 1}
+    worker_channels = merge_worker_channels(
+        update_handlers,
+        set(),
+        0,
+        [((_channel("PV1"),), None), ((_channel("PV2"),), None)],
+    )
+    assert set(update_handlers.keys()) == {
+        _channel("OTHER:PV"),
+        _channel("PV1"),
+        _channel("PV2"),
+    }
+
+    merge_worker_channels(
+        update_handlers, worker_channels, 0, [((_channel("PV2"),), None)]
+    )
+    assert set(update_handlers.keys()) == {_channel("OTHER:PV"), _channel("PV2")}
@@ -4,7 +4,9 @@ from tests.kafka.fake_producer import FakeProducer
 import json
 from streaming_data_types.status_x5f2 import deserialise_x5f2
 import logging
+from unittest import mock
 from forwarder.parse_config_update import Channel, EpicsProtocol
+from forwarder.metrics import Histogram
 
 
 logger = logging.getLogger("stub_for_use_in_tests")
@@ -64,3 +66,68 @@ def test_status_message_contains_service_id():
     if fake_producer.published_payload is not None:
         deserialised_payload = deserialise_x5f2(fake_producer.published_payload)
     assert deserialised_payload.service_id == service_id
+
+
+def test_statistics_of_update_handlers_are_reported_for_each_stream():
+    handler = mock.Mock()
+    handler.statistics.return_value = {"updates_received": 3}
+    update_handlers = {
+        Channel("test_channel", EpicsProtocol.CA, "topic_1", "f142"): handler,
+        Channel("test_channel", EpicsProtocol.CA, "topic_2", "f142"): handler,
+    }
+
+    fake_producer = FakeProducer()
+    status_reporter = StatusReporter(update_handlers, fake_producer, "status_topic", "", "version", logger)  # type: ignore
+    status_reporter.report_status()
+
+    deserialised_payload = deserialise_x5f2(fake_producer.published_payload)
+    produced_status_message = json.loads(deserialised_payload.status_json)
+    assert [stream["statistics"] for stream in produced_status_message["streams"]] == [
+        {"updates_received": 3},
+        {"updates_received": 3},
+    ]
+
+
+def test_latency_of_output_producer_is_reported():
+    output_producer = mock.Mock()
+    output_producer.delivery_latency = Histogram()
+    output_producer.delivery_latency.observe(0.002)
+    output_producer.librdkafka_statistics.return_value = None
+
+    fake_producer = FakeProducer()
+    status_reporter = StatusReporter({}, fake_producer, "status_topic", "", "version", logger, output_producer=output_producer)  # type: ignore
+    status_reporter.report_status()
+
+    deserialised_payload = deserialise_x5f2(fake_producer.published_payload)
+    produced_status_message = json.loads(deserialised_payload.status_json)
+    latency = produced_status_message["latency"]
+    assert latency["produce_to_delivery"]["count"] == 1
+    assert "epics_to_callback" in latency
+    assert "callback_to_produce" in latency
+
+
+def test_librdkafka_statistics_of_output_producer_are_reported():
+    output_producer = mock.Mock()
+    output_producer.delivery_latency = Histogram()
+    output_producer.librdkafka_statistics.return_value = {"queue_messages": 12}
+
+    fake_producer = FakeProducer()
+    status_reporter = StatusReporter({}, fake_producer, "status_topic", "", "version", logger, output_producer=output_producer)  # type: ignore
+    status_reporter.report_status()
+
+    deserialised_payload = deserialise_x5f2(fake_producer.published_payload)
+    produced_status_message = json.loads(deserialised_payload.status_json)
+    assert produced_status_message["producer"] == {"queue_messages": 12}
+
+
+def test_publish_pipeline_statistics_are_reported():
+    pipeline = mock.Mock()
+    pipeline.statistics.return_value = {"queued": 3, "dropped": 7}
+
+    fake_producer = FakeProducer()
+    status_reporter = StatusReporter({}, fake_producer, "status_topic", "", "version", logger, pipeline=pipeline)  # type: ignore
+    status_reporter.report_status()
+
+    deserialised_payload = deserialise_x5f2(fake_producer.published_payload)
+    produced_status_message = json.loads(deserialised_payload.status_json)
+    assert produced_status_message["publish_pipeline"] == {"queued": 3, "dropped": 7}
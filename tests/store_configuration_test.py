@@ -1,4 +1,6 @@
+from typing import Dict, List
 from unittest import mock
+import time
 from confluent_kafka import Consumer
 from streaming_data_types.forwarder_config_update_rf5k import (
     serialise_rf5k,
@@ -13,9 +15,20 @@ from forwarder.parse_config_update import (
     config_change_to_command_type,
 )
 
-from forwarder.configuration_store import ConfigurationStore
-from forwarder.parse_config_update import Channel, EpicsProtocol
+from forwarder.configuration_store import (
+    ConfigurationStore,
+    reconcile_configuration,
+    restore_configuration,
+)
+from forwarder.parse_config_update import (
+    Channel,
+    CommandType,
+    ConfigUpdate,
+    EpicsProtocol,
+)
+from forwarder.handle_config_change import handle_configuration_change
 from tests.kafka.fake_producer import FakeProducer
+import logging
 
 
 DUMMY_UPDATE_HANDLER = None
@@ -39,12 +52,16 @@ STREAMS_TO_RETRIEVE = [
 
 
 class FakeKafkaMessage:
-    def __init__(self, message):
+    def __init__(self, message, headers=None):
         self._message = message
+        self._headers = headers
 
     def value(self):
         return self._message
 
+    def headers(self):
+        return self._headers
+
 
 def assert_stored_channel_correct(outputted_channel):
     # Will only be found if key exists and as the key is the channel
@@ -89,7 +106,7 @@ def test_retrieving_stored_info_with_no_pvs_gets_message_without_streams():
         producer=None, consumer=mock_consumer, topic="store_topic"
     )
 
-    config = parse_config_update(store.retrieve_configuration())
+    config = store.retrieve_configuration()
 
     assert config.channels is None
 
@@ -103,8 +120,250 @@ def test_retrieving_stored_info_with_multiple_pvs_gets_streams():
         producer=None, consumer=mock_consumer, topic="store_topic"
     )
 
-    config = parse_config_update(store.retrieve_configuration())
+    config = store.retrieve_configuration()
     channels = config.channels
 
     assert_stored_channel_correct(channels[0])  # type: ignore
     assert_stored_channel_correct(channels[1])  # type: ignore
+
+
+def test_configuration_is_not_stored_again_if_channels_are_unchanged():
+    producer = FakeProducer()
+    store = ConfigurationStore(producer, consumer=None, topic="store_topic")
+
+    store.save_configuration(CHANNELS_TO_STORE)
+    store.save_configuration(dict(reversed(list(CHANNELS_TO_STORE.items()))))
+
+    assert producer.messages_published == 1
+
+
+def test_changes_within_save_interval_are_stored_together_when_flushed():
+    producer = FakeProducer()
+    store = ConfigurationStore(
+        producer, consumer=None, topic="store_topic", save_interval_s=60
+    )
+    store.save_configuration({})
+
+    channels: Dict[Channel, None] = {}
+    for channel in CHANNELS_TO_STORE.keys():
+        channels[channel] = DUMMY_UPDATE_HANDLER
+        store.save_configuration(channels)
+    assert producer.messages_published == 1
+
+    store.flush()
+
+    assert producer.messages_published == 2
+    stored_message = parse_config_update(producer.published_payload)  # type: ignore
+    assert set(stored_message.channels) == set(CHANNELS_TO_STORE.keys())  # type: ignore
+
+
+def test_changes_within_save_interval_are_stored_at_the_end_of_it():
+    producer = FakeProducer()
+    store = ConfigurationStore(
+        producer, consumer=None, topic="store_topic", save_interval_s=0.05
+    )
+    store.save_configuration({})
+    store.save_configuration(CHANNELS_TO_STORE)
+    assert producer.messages_published == 1
+
+    time.sleep(0.2)
+
+    assert producer.messages_published == 2
+
+
+def test_save_at_end_of_interval_is_scheduled_and_cancelled_when_stopped():
+    producer = FakeProducer()
+    store = ConfigurationStore(
+        producer, consumer=mock.Mock(), topic="store_topic", save_interval_s=60
+    )
+    with mock.patch("forwarder.configuration_store.get_scheduler") as get_scheduler:
+        store.save_configuration({})
+        store.save_configuration(CHANNELS_TO_STORE)
+        store.save_configuration({})
+        scheduled_save = get_scheduler.return_value.call_later.return_value
+
+        store.stop()
+
+    get_scheduler.return_value.call_later.assert_called_once()
+    scheduled_save.cancel.assert_called_once()
+    assert producer.messages_published == 1
+
+
+class FakeStorageTopic:
+    """
+    Keeps produced messages so that they can be consumed, like a single partition topic
+    """
+
+    def __init__(self):
+        self.messages: List[FakeKafkaMessage] = []
+        self._offset = 0
+
+    def produce(self, topic, payload, timestamp_ms, key=None, headers=None):
+        self.messages.append(FakeKafkaMessage(payload, headers))
+
+    def get_watermark_offsets(self, topic_partition):
+        return 0, len(self.messages)
+
+    def assign(self, topic_partitions):
+        self._offset = topic_partitions[0].offset
+
+    def consume(self, num_messages=1, timeout=None):
+        consumed = self.messages[self._offset : self._offset + num_messages]
+        self._offset += len(consumed)
+        return consumed
+
+
+_MANY_CHANNELS = {
+    Channel(f"channel{number}", EpicsProtocol.CA, "topic", "f142"): None
+    for number in range(10)
+}
+
+
+def test_large_configuration_is_stored_in_parts_and_retrieved_whole():
+    storage_topic = FakeStorageTopic()
+    store = ConfigurationStore(
+        storage_topic, storage_topic, topic="store_topic", streams_per_part=4
+    )
+
+    store.save_configuration(_MANY_CHANNELS)
+    config = store.retrieve_configuration()
+
+    assert len(storage_topic.messages) == 3
+    assert config.command_type == CommandType.ADD
+    assert set(config.channels) == set(_MANY_CHANNELS.keys())  # type: ignore
+
+
+def test_latest_complete_configuration_is_retrieved_if_saving_was_interrupted():
+    storage_topic = FakeStorageTopic()
+    store = ConfigurationStore(
+        storage_topic, storage_topic, topic="store_topic", streams_per_part=4
+    )
+    store.save_configuration(CHANNELS_TO_STORE)
+    store.save_configuration(_MANY_CHANNELS)
+    # Lose the last part of the latest configuration
+    storage_topic.messages.pop()
+
+    config = store.retrieve_configuration()
+
+    assert set(config.channels) == set(CHANNELS_TO_STORE.keys())  # type: ignore
+
+
+def test_configuration_stored_as_a_single_message_without_headers_is_retrieved():
+    storage_topic = FakeStorageTopic()
+    storage_topic.messages.append(
+        FakeKafkaMessage(serialise_rf5k(UpdateType.ADD, STREAMS_TO_RETRIEVE))
+    )
+    store = ConfigurationStore(None, storage_topic, topic="store_topic")
+
+    config = store.retrieve_configuration()
+
+    assert set(config.channels) == set(CHANNELS_TO_STORE.keys())  # type: ignore
+
+
+def test_configuration_stored_in_local_file_is_retrieved(tmp_path):
+    local_file = tmp_path / "configuration"
+    store = ConfigurationStore(
+        FakeProducer(), None, topic="store_topic", local_file=str(local_file)
+    )
+
+    store.save_configuration(CHANNELS_TO_STORE)
+    config = store.retrieve_local_configuration()
+
+    assert set(config.channels) == set(CHANNELS_TO_STORE.keys())  # type: ignore
+    assert [path.name for path in tmp_path.iterdir()] == ["configuration"]
+
+
+def test_no_local_configuration_is_retrieved_if_there_is_no_local_file(tmp_path):
+    store = ConfigurationStore(
+        FakeProducer(), None, topic="store_topic", local_file=str(tmp_path / "none")
+    )
+
+    assert store.retrieve_local_configuration() is None
+
+
+def test_reconciling_removes_channels_not_in_stored_configuration_and_adds_missing():
+    kept_channel = Channel("kept", EpicsProtocol.CA, "topic", "f142")
+    extra_channel = Channel("extra[1]", EpicsProtocol.CA, "topic", "f142")
+    missing_channel = Channel("missing", EpicsProtocol.PVA, "topic", "f142")
+    update_handlers = {kept_channel: None, extra_channel: None}
+    applied_changes: List[ConfigUpdate] = []
+
+    reconcile_configuration(
+        ConfigUpdate(CommandType.ADD, (kept_channel, missing_channel)),
+        update_handlers,
+        applied_changes.append,
+    )
+
+    assert applied_changes == [
+        ConfigUpdate(CommandType.REMOVE_EXACT, (extra_channel,)),
+        ConfigUpdate(CommandType.ADD, (missing_channel,)),
+    ]
+
+
+def test_reconciling_only_removes_extra_channel_for_its_own_protocol():
+    ca_channel = Channel("PV", EpicsProtocol.CA, "topic", "f142")
+    pva_channel = Channel("PV", EpicsProtocol.PVA, "topic", "f142")
+    update_handlers = {ca_channel: mock.Mock(), pva_channel: mock.Mock()}
+
+    def apply_configuration_change(config_change: ConfigUpdate):
+        handle_configuration_change(config_change, 20000, None, update_handlers, FakeProducer(), None, None, logging.getLogger(), mock.Mock())  # type: ignore
+
+    reconcile_configuration(
+        ConfigUpdate(CommandType.ADD, (pva_channel,)),
+        set(update_handlers.keys()),
+        apply_configuration_change,
+    )
+
+    assert list(update_handlers.keys()) == [pva_channel]
+
+
+def test_channels_saved_while_saving_is_paused_are_stored_when_it_resumes():
+    producer = FakeProducer()
+    store = ConfigurationStore(producer, consumer=None, topic="store_topic")
+
+    store.pause_saving()
+    store.save_configuration({})
+    store.save_configuration(CHANNELS_TO_STORE)
+    assert producer.messages_published == 0
+    store.resume_saving()
+
+    assert producer.messages_published == 1
+    stored_message = parse_config_update(producer.published_payload)  # type: ignore
+    assert set(stored_message.channels) == set(CHANNELS_TO_STORE.keys())  # type: ignore
+
+
+def test_restoring_forwards_channels_stored_in_kafka_rather_than_in_local_file(
+    tmp_path,
+):
+    kept_channel = Channel("kept", EpicsProtocol.CA, "topic", "f142")
+    local_only_channel = Channel("local_only", EpicsProtocol.CA, "topic", "f142")
+    kafka_only_channel = Channel("kafka_only", EpicsProtocol.PVA, "topic", "f142")
+    local_file = str(tmp_path / "configuration")
+    storage_topic = FakeStorageTopic()
+    ConfigurationStore(
+        storage_topic, storage_topic, topic="store_topic"
+    ).save_configuration({kept_channel: None, kafka_only_channel: None})
+    ConfigurationStore(
+        FakeProducer(), None, topic="store_topic", local_file=local_file
+    ).save_configuration({kept_channel: None, local_only_channel: None})
+
+    store = ConfigurationStore(
+        storage_topic, storage_topic, topic="store_topic", local_file=local_file
+    )
+    update_handlers: Dict[Channel, None] = {}
+
+    def apply_configuration_change(config_change: ConfigUpdate):
+        # Like handle_configuration_change, which saves after each change
+        for channel in config_change.channels:  # type: ignore
+            if config_change.command_type == CommandType.ADD:
+                update_handlers[channel] = None
+            else:
+                update_handlers.pop(channel, None)
+        store.save_configuration(update_handlers)
+
+    restore_configuration(store, apply_configuration_change)
+
+    expected_channels = {kept_channel, kafka_only_channel}
+    assert set(update_handlers.keys()) == expected_channels
+    assert set(store.retrieve_configuration().channels) == expected_channels  # type: ignore
+    assert set(store.retrieve_local_configuration().channels) == expected_channels  # type: ignore
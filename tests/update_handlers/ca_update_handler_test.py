@@ -1,6 +1,7 @@
 from tests.kafka.fake_producer import FakeProducer
 from forwarder.update_handlers.ca_update_handler import CAUpdateHandler
 from tests.test_helpers.ca_fakes import FakeContext
+from forwarder.update_handlers.update_filter import UpdateFilter, FilterSettings
 from cmath import isclose
 from streaming_data_types.logdata_f142 import deserialise_f142
 import pytest
@@ -8,7 +9,7 @@ from caproto import ReadNotifyResponse, ChannelType, TimeStamp
 import numpy as np
 from streaming_data_types.fbschemas.logdata_f142.AlarmStatus import AlarmStatus
 from streaming_data_types.fbschemas.logdata_f142.AlarmSeverity import AlarmSeverity
-from time import sleep
+from time import monotonic, sleep
 
 
 def test_update_handler_throws_if_schema_not_recognised():
@@ -280,3 +281,64 @@ def test_update_handler_publishes_enum_update():
     assert pv_update_output.source_name == pv_source_name
 
     update_handler.stop()
+
+
+def test_update_handler_does_not_publish_filtered_update_unless_alarm_changes():
+    producer = FakeProducer()
+    context = FakeContext()
+    update_handler = CAUpdateHandler(producer, context, "source_name", "output_topic", "f142", update_filter=UpdateFilter(FilterSettings(absolute_deadband=1)))  # type: ignore
+
+    def update(value: float, status: int):
+        context.call_monitor_callback_with_fake_pv_update(
+            ReadNotifyResponse(
+                np.array([value]).astype(np.float64),
+                ChannelType.TIME_DOUBLE,
+                1,
+                1,
+                1,
+                metadata=(status, 0, TimeStamp(4, 0)),
+            )
+        )
+
+    update(1.0, 0)
+    update(1.5, 0)
+    assert producer.messages_published == 1
+    # Latency is recorded when updates arrive, including for updates which are filtered
+    assert update_handler.statistics()["latency"]["epics_to_callback"]["count"] == 2
+
+    update(1.6, 3)
+    assert producer.messages_published == 2
+    assert deserialise_f142(producer.published_payload).alarm_status == AlarmStatus.HIHI  # type: ignore
+
+    update_handler.stop()
+
+
+def test_update_handler_publishes_last_update_of_burst_held_back_by_max_rate():
+    producer = FakeProducer()
+    context = FakeContext()
+    update_handler = CAUpdateHandler(producer, context, "source_name", "output_topic", "f142", update_filter=UpdateFilter(FilterSettings(max_rate_hz=20)))  # type: ignore
+
+    for value in (1.0, 2.0, 3.0):
+        context.call_monitor_callback_with_fake_pv_update(
+            ReadNotifyResponse(
+                np.array([value]).astype(np.float64),
+                ChannelType.TIME_DOUBLE,
+                1,
+                1,
+                1,
+                metadata=(0, 0, TimeStamp(4, 0)),
+            )
+        )
+    assert producer.messages_published == 1
+
+    deadline = monotonic() + 2
+    while producer.messages_published < 2 and monotonic() < deadline:
+        sleep(0.01)
+    assert producer.messages_published == 2
+    assert deserialise_f142(producer.published_payload).value == 3.0  # type: ignore
+    latency = update_handler.statistics()["latency"]
+    assert latency["epics_to_callback"]["count"] == 3
+    # The held update's latency is from when it arrived, not from when it was published
+    assert latency["callback_to_produce"]["max_ms"] >= 40
+
+    update_handler.stop()
@@ -0,0 +1,28 @@
+from forwarder.update_handlers.channel_statistics import ChannelStatistics
+from unittest import mock
+
+
+def test_update_rate_is_measured_over_at_least_a_second():
+    with mock.patch(
+        "forwarder.update_handlers.channel_statistics.time.monotonic"
+    ) as monotonic:
+        monotonic.return_value = 100.0
+        statistics = ChannelStatistics()
+        for _ in range(20):
+            statistics.update_received()
+
+        monotonic.return_value = 100.5
+        assert statistics.update_rate_hz() == 0.0
+        monotonic.return_value = 102.0
+        assert statistics.update_rate_hz() == 10.0
+        # Unchanged until another second has passed
+        statistics.update_received()
+        monotonic.return_value = 102.5
+        assert statistics.update_rate_hz() == 10.0
+
+
+def test_last_update_time_is_set_when_update_is_received():
+    statistics = ChannelStatistics()
+    assert statistics.as_dict()["last_update_time"] is None
+    statistics.update_received()
+    assert statistics.as_dict()["last_update_time"] is not None
@@ -1,10 +1,14 @@
-from forwarder.update_handlers.create_update_handler import create_update_handler
+from forwarder.update_handlers.create_update_handler import (
+    create_update_handler,
+    create_update_handlers,
+)
 from forwarder.parse_config_update import Channel, EpicsProtocol
 from tests.kafka.fake_producer import FakeProducer
 from tests.test_helpers.p4p_fakes import FakeContext as FakePVAContext
 from tests.test_helpers.ca_fakes import FakeContext as FakeCAContext
 from forwarder.update_handlers.pva_update_handler import PVAUpdateHandler
 from forwarder.update_handlers.ca_update_handler import CAUpdateHandler
+from unittest import mock
 import logging
 import pytest
 
@@ -71,3 +75,61 @@ def test_ca_handler_created_when_ca_protocol_specified():
     channel_with_ca_protocol = Channel("name", EpicsProtocol.CA, "output_topic", "f142")
     handler = create_update_handler(producer, context, None, channel_with_ca_protocol, 20000)  # type: ignore
     assert isinstance(handler, CAUpdateHandler)
+
+
+def test_ca_pvs_of_many_channels_are_searched_for_together():
+    producer = FakeProducer()
+    ca_context = FakeCAContext()
+    ca_context.get_pvs = mock.Mock(wraps=ca_context.get_pvs)  # type: ignore
+    pva_context = FakePVAContext()
+    channels = [
+        Channel("ca_1", EpicsProtocol.CA, "output_topic", "f142"),
+        Channel("pva_1", EpicsProtocol.PVA, "output_topic", "f142"),
+        Channel("ca_2", EpicsProtocol.CA, "output_topic", "f142"),
+        Channel("pva_2", EpicsProtocol.PVA, "output_topic", "f142"),
+    ]
+
+    handlers, errors = create_update_handlers(producer, ca_context, pva_context, channels, 20000)  # type: ignore
+
+    ca_context.get_pvs.assert_called_once_with("ca_1", "ca_2")
+    assert errors == []
+    assert isinstance(handlers[channels[0]], CAUpdateHandler)
+    assert isinstance(handlers[channels[1]], PVAUpdateHandler)
+    assert isinstance(handlers[channels[2]], CAUpdateHandler)
+    assert isinstance(handlers[channels[3]], PVAUpdateHandler)
+
+
+def test_errors_are_returned_for_invalid_channels_and_other_handlers_are_created():
+    producer = FakeProducer()
+    valid_channel = Channel("name", EpicsProtocol.CA, "output_topic", "f142")
+    channel_with_no_topic = Channel("name_2", EpicsProtocol.CA, None, "f142")
+
+    handlers, errors = create_update_handlers(producer, FakeCAContext(), None, [valid_channel, channel_with_no_topic], 20000)  # type: ignore
+
+    assert list(handlers.keys()) == [valid_channel]
+    assert len(errors) == 1
+    assert isinstance(errors[0], RuntimeError)
+
+
+def test_handler_which_fails_to_be_created_is_skipped_and_others_are_returned():
+    producer = FakeProducer()
+    channels = [
+        Channel(name, EpicsProtocol.CA, "output_topic", "f142")
+        for name in ("ca_1", "ca_2", "ca_3")
+    ]
+    ca_update_handler_class = CAUpdateHandler
+
+    def fail_for_second_pv(*args, **kwargs):
+        if args[2] == "ca_2":
+            raise ValueError("test failure")
+        return ca_update_handler_class(*args, **kwargs)
+
+    with mock.patch(
+        "forwarder.update_handlers.create_update_handler.CAUpdateHandler",
+        side_effect=fail_for_second_pv,
+    ):
+        handlers, errors = create_update_handlers(producer, FakeCAContext(), None, channels, 20000)  # type: ignore
+
+    assert list(handlers.keys()) == [channels[0], channels[2]]
+    assert len(errors) == 1
+    assert "ca_2" in str(errors[0])
@@ -0,0 +1,172 @@
+from forwarder.update_handlers.publish_pipeline import PublishPipeline
+from forwarder.update_handlers.ca_update_handler import CAUpdateHandler
+from forwarder.update_handlers.schema_publishers import ChannelSinks
+from tests.kafka.fake_producer import FakeProducer
+from tests.test_helpers.ca_fakes import FakeContext
+from streaming_data_types.logdata_f142 import deserialise_f142
+from caproto import ReadNotifyResponse, ChannelType, TimeStamp
+from streaming_data_types.fbschemas.logdata_f142.AlarmStatus import AlarmStatus
+from streaming_data_types.fbschemas.logdata_f142.AlarmSeverity import AlarmSeverity
+from threading import current_thread, Event
+from unittest import mock
+import numpy as np
+from typing import List
+
+
+def test_enqueued_calls_are_made_on_worker_thread():
+    pipeline = PublishPipeline()
+    calling_threads = []
+    pipeline.enqueue(lambda: calling_threads.append(current_thread()))
+    pipeline.stop()
+
+    assert len(calling_threads) == 1
+    assert calling_threads[0] is not current_thread()
+
+
+def test_enqueued_calls_are_made_in_order():
+    pipeline = PublishPipeline(max_batch_size=7)
+    calls: List[int] = []
+    for call_number in range(100):
+        pipeline.enqueue(calls.append, call_number)
+    pipeline.stop()
+
+    assert calls == list(range(100))
+
+
+def test_exception_in_enqueued_call_does_not_stop_later_calls():
+    pipeline = PublishPipeline()
+
+    def raise_exception():
+        raise RuntimeError("test exception")
+
+    calls: List[int] = []
+    pipeline.enqueue(raise_exception)
+    pipeline.enqueue(calls.append, 1)
+    pipeline.stop()
+
+    assert calls == [1]
+
+
+def test_update_handler_publishes_via_pipeline():
+    producer = FakeProducer()
+    context = FakeContext()
+    pipeline = PublishPipeline()
+    pv_value = 42
+    pv_source_name = "source_name"
+    update_handler = CAUpdateHandler(producer, context, pv_source_name, "output_topic", "f142", pipeline=pipeline)  # type: ignore
+
+    metadata = (0, 0, TimeStamp(4, 0))
+    context.call_monitor_callback_with_fake_pv_update(
+        ReadNotifyResponse(
+            np.array([pv_value]).astype(np.int32),
+            ChannelType.TIME_INT,
+            1,
+            1,
+            1,
+            metadata=metadata,
+        )
+    )
+    pipeline.stop()
+
+    assert producer.published_payload is not None
+    pv_update_output = deserialise_f142(producer.published_payload)
+    assert pv_update_output.value == pv_value
+    assert pv_update_output.source_name == pv_source_name
+
+    update_handler.stop()
+
+
+def test_saturated_pipeline_coalesces_updates_but_not_alarm_transitions():
+    producer = FakeProducer()
+    pipeline = PublishPipeline(coalesce_backlog=1)
+    sinks = ChannelSinks(producer, "source_name", pipeline)  # type: ignore
+    sinks.add("output_topic", "f142")
+    serialise = mock.Mock(side_effect=lambda data, *_: bytes([int(data)]))
+    sinks._serialisers["f142"].serialise = serialise
+
+    # Hold up the worker so that updates wait in the pipeline
+    worker_blocked = Event()
+    release_worker = Event()
+
+    def block_worker():
+        worker_blocked.set()
+        release_worker.wait()
+
+    pipeline.enqueue(block_worker)
+    worker_blocked.wait()
+    no_alarm = (AlarmStatus.NO_ALARM, AlarmSeverity.NO_ALARM)
+    high_alarm = (AlarmStatus.HIHI, AlarmSeverity.MAJOR)
+    sinks.publish(np.array(1), 0, *no_alarm)
+    sinks.publish(np.array(2), 0, *no_alarm)
+    sinks.publish(np.array(3), 0, *high_alarm)
+    sinks.publish(np.array(4), 0, *high_alarm)
+    release_worker.set()
+    pipeline.stop()
+
+    assert [call[0][0] for call in serialise.call_args_list] == [2, 4]
+    assert sinks.coalesced_count == 2
+
+
+def test_pipeline_without_coalesce_backlog_is_never_saturated():
+    pipeline = PublishPipeline()
+    release_worker = Event()
+    pipeline.enqueue(release_worker.wait)
+    for _ in range(10):
+        pipeline.enqueue(lambda: None)
+    assert not pipeline.saturated()
+    release_worker.set()
+    pipeline.stop()
+
+
+def test_calls_beyond_capacity_are_dropped_and_counted():
+    pipeline = PublishPipeline(max_queued=5)
+    release_worker = Event()
+    worker_blocked = Event()
+
+    def block_worker():
+        worker_blocked.set()
+        release_worker.wait()
+
+    pipeline.enqueue(block_worker)
+    worker_blocked.wait()
+    calls: List[int] = []
+    enqueued = [pipeline.enqueue(calls.append, call_number) for call_number in range(8)]
+    release_worker.set()
+    pipeline.stop()
+
+    assert enqueued == [True] * 5 + [False] * 3
+    assert calls == list(range(5))
+    assert pipeline.statistics() == {"queued": 0, "dropped": 3}
+
+
+def test_update_dropped_by_full_pipeline_is_not_replaced_by_later_updates():
+    producer = FakeProducer()
+    pipeline = PublishPipeline(coalesce_backlog=1, max_queued=2)
+    sinks = ChannelSinks(producer, "source_name", pipeline)  # type: ignore
+    sinks.add("output_topic", "f142")
+    serialise = mock.Mock(side_effect=lambda data, *_: bytes([int(data)]))
+    sinks._serialisers["f142"].serialise = serialise
+
+    first_blocked, release_first = Event(), Event()
+    second_blocked, release_second = Event(), Event()
+
+    def block_worker(blocked: Event, release: Event):
+        blocked.set()
+        release.wait()
+
+    pipeline.enqueue(block_worker, first_blocked, release_first)
+    first_blocked.wait()
+    # Fill the pipeline, so that the next update is dropped
+    pipeline.enqueue(block_worker, second_blocked, release_second)
+    pipeline.enqueue(lambda: None)
+    no_alarm = (AlarmStatus.NO_ALARM, AlarmSeverity.NO_ALARM)
+    sinks.publish(np.array(1), 0, *no_alarm)
+    release_first.set()
+    second_blocked.wait()
+    # The pipeline is saturated but not full
+    pipeline.enqueue(lambda: None)
+    sinks.publish(np.array(2), 0, *no_alarm)
+    release_second.set()
+    pipeline.stop()
+
+    assert [call[0][0] for call in serialise.call_args_list] == [2]
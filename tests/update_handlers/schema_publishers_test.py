@@ -0,0 +1,173 @@
+from tests.kafka.fake_producer import FakeProducer
+from forwarder.update_handlers.schema_publishers import ChannelSinks
+from streaming_data_types.logdata_f142 import deserialise_f142
+from streaming_data_types.timestamps_tdct import deserialise_tdct
+from streaming_data_types.fbschemas.logdata_f142.AlarmStatus import AlarmStatus
+from streaming_data_types.fbschemas.logdata_f142.AlarmSeverity import AlarmSeverity
+from forwarder.kafka.kafka_helpers import F142Serialiser
+from unittest import mock
+import numpy as np
+import time
+import pytest
+
+
+def test_adding_sink_with_unrecognised_schema_throws():
+    sinks = ChannelSinks(FakeProducer(), "source_name")  # type: ignore
+    with pytest.raises(ValueError):
+        sinks.add("output_topic", "DOESNTEXIST")
+
+
+def test_update_is_published_to_every_topic_of_every_sink():
+    producer = FakeProducer()
+    sinks = ChannelSinks(producer, "source_name")  # type: ignore
+    sinks.add("topic_1", "f142")
+    sinks.add("topic_2", "f142")
+    sinks.add("topic_3", "tdct")
+
+    sinks.publish(np.array(42).astype(np.int32), 1_000_000)
+
+    assert sorted(producer.published_topics) == ["topic_1", "topic_2", "topic_3"]
+
+
+def _mock_serialiser(payload: bytes) -> mock.Mock:
+    serialiser = mock.Mock()
+    serialiser.serialise.return_value = payload
+    return serialiser
+
+
+def test_update_is_serialised_once_per_schema():
+    producer = FakeProducer()
+    f142_serialiser = _mock_serialiser(b"f142 payload")
+    tdct_serialiser = _mock_serialiser(b"tdct payload")
+    with mock.patch.dict(
+        "forwarder.update_handlers.schema_publishers.schema_serialisers",
+        {
+            "f142": mock.Mock(return_value=f142_serialiser),
+            "tdct": mock.Mock(return_value=tdct_serialiser),
+        },
+    ):
+        sinks = ChannelSinks(producer, "source_name")  # type: ignore
+        sinks.add("topic_1", "f142")
+        sinks.add("topic_2", "f142")
+        sinks.add("topic_3", "tdct")
+
+    sinks.publish(np.array(42).astype(np.int32), 1_000_000)
+
+    f142_serialiser.serialise.assert_called_once()
+    tdct_serialiser.serialise.assert_called_once()
+    assert producer.messages_published == 3
+
+
+def test_removed_sink_is_not_published_to():
+    producer = FakeProducer()
+    sinks = ChannelSinks(producer, "source_name")  # type: ignore
+    sinks.add("topic_1", "f142")
+    sinks.add("topic_2", "tdct")
+    sinks.remove("topic_1", "f142")
+
+    sinks.publish(np.array(42).astype(np.int32), 1_000_000)
+
+    assert len(sinks) == 1
+    assert producer.published_topics == ["topic_2"]
+    assert deserialise_tdct(producer.published_payload).name == "source_name"
+
+
+def test_adding_identical_sink_twice_publishes_once():
+    producer = FakeProducer()
+    sinks = ChannelSinks(producer, "source_name")  # type: ignore
+    sinks.add("topic_1", "f142")
+    sinks.add("topic_1", "f142")
+
+    sinks.publish(np.array(42).astype(np.int32), 1_000_000)
+
+    assert producer.messages_published == 1
+    assert deserialise_f142(producer.published_payload).value == 42
+
+
+def test_republishing_update_with_same_alarm_reuses_serialised_payload():
+    producer = FakeProducer()
+    f142_serialiser = _mock_serialiser(b"f142 payload")
+    with mock.patch.dict(
+        "forwarder.update_handlers.schema_publishers.schema_serialisers",
+        {"f142": mock.Mock(return_value=f142_serialiser)},
+    ):
+        sinks = ChannelSinks(producer, "source_name")  # type: ignore
+        sinks.add("topic_1", "f142")
+        sinks.add("topic_2", "f142")
+
+    sinks.publish(
+        np.array(42).astype(np.int32), 1_000_000, AlarmStatus.LOW, AlarmSeverity.MINOR,
+    )
+    sinks.republish_latest(AlarmStatus.LOW, AlarmSeverity.MINOR)
+    sinks.republish_latest(AlarmStatus.LOW, AlarmSeverity.MINOR)
+
+    f142_serialiser.serialise.assert_called_once()
+    assert producer.messages_published == 6
+
+
+def test_republishing_update_without_alarm_serialises_alarm_variant_once():
+    producer = FakeProducer()
+    f142_serialiser = mock.Mock(wraps=F142Serialiser("source_name"))
+    with mock.patch.dict(
+        "forwarder.update_handlers.schema_publishers.schema_serialisers",
+        {"f142": mock.Mock(return_value=f142_serialiser)},
+    ):
+        sinks = ChannelSinks(producer, "source_name")  # type: ignore
+        sinks.add("topic_1", "f142")
+
+    sinks.publish(np.array(42).astype(np.int32), 1_000_000)
+    sinks.republish_latest(AlarmStatus.LOW, AlarmSeverity.MINOR)
+    sinks.republish_latest(AlarmStatus.LOW, AlarmSeverity.MINOR)
+
+    assert (
+        f142_serialiser.serialise.call_count == 2
+    ), "Expected one serialisation for the update and one for the periodic updates with alarm"
+    pv_update_output = deserialise_f142(producer.published_payload)
+    assert pv_update_output.value == 42
+    assert pv_update_output.timestamp_unix_ns == 1_000_000
+    assert pv_update_output.alarm_status == AlarmStatus.LOW
+    assert pv_update_output.alarm_severity == AlarmSeverity.MINOR
+
+
+def test_republishing_before_any_update_publishes_nothing():
+    producer = FakeProducer()
+    sinks = ChannelSinks(producer, "source_name")  # type: ignore
+    sinks.add("topic_1", "f142")
+
+    sinks.republish_latest(AlarmStatus.LOW, AlarmSeverity.MINOR)
+
+    assert producer.messages_published == 0
+
+
+def test_published_messages_and_bytes_are_counted_for_every_topic():
+    producer = FakeProducer()
+    sinks = ChannelSinks(producer, "source_name")  # type: ignore
+    sinks.add("topic_1", "f142")
+    sinks.add("topic_2", "f142")
+
+    sinks.publish(np.array(42).astype(np.int32), 1_000_000)
+    sinks.republish_latest(AlarmStatus.NO_ALARM, AlarmSeverity.NO_ALARM)
+
+    statistics = sinks.statistics_dict()
+    assert statistics["messages_published"] == 4
+    assert statistics["bytes_published"] > 0
+    assert statistics["delivery_failures"] == 0
+
+
+def test_latency_is_recorded_once_per_update_and_not_when_republishing():
+    producer = FakeProducer()
+    sinks = ChannelSinks(producer, "source_name")  # type: ignore
+    sinks.add("topic_1", "f142")
+    sinks.add("topic_2", "tdct")
+
+    one_second_ago_ns = time.time_ns() - 1_000_000_000
+    sinks.publish(np.array(42).astype(np.int32), one_second_ago_ns)
+    sinks.republish_latest(AlarmStatus.NO_ALARM, AlarmSeverity.NO_ALARM)
+
+    latency = sinks.statistics_dict()["latency"]
+    assert latency["epics_to_callback"]["count"] == 1
+    assert latency["epics_to_callback"]["p50_ms"] >= 1000
+    assert latency["callback_to_produce"]["count"] == 1
+    assert latency["callback_to_produce"]["max_ms"] < 1000
+    # FakeProducer does not deliver messages
+    assert "produce_to_delivery" not in latency
@@ -0,0 +1,110 @@
+from forwarder.update_handlers.update_filter import (
+    FilterSettings,
+    UpdateFilter,
+    load_channel_filters,
+)
+from unittest import mock
+import numpy as np
+import json
+import pytest
+
+
+def test_changes_within_absolute_deadband_are_not_forwarded():
+    update_filter = UpdateFilter(FilterSettings(absolute_deadband=0.5))
+    assert update_filter.should_forward(np.array(10.0), False)
+    assert not update_filter.should_forward(np.array(10.4), False)
+    assert not update_filter.should_forward(np.array(9.6), False)
+    assert update_filter.should_forward(np.array(10.6), False)
+    assert update_filter.filtered_count == 2
+
+
+def test_deadband_is_relative_to_last_forwarded_value():
+    update_filter = UpdateFilter(FilterSettings(relative_deadband=0.1))
+    assert update_filter.should_forward(np.array(100), False)
+    assert not update_filter.should_forward(np.array(105), False)
+    assert not update_filter.should_forward(np.array(109), False)
+    assert update_filter.should_forward(np.array(111), False)
+
+
+def test_array_is_forwarded_if_any_element_is_outside_deadband():
+    update_filter = UpdateFilter(FilterSettings(absolute_deadband=1))
+    assert update_filter.should_forward(np.array([1, 2, 3], dtype=np.uint8), False)
+    assert not update_filter.should_forward(np.array([2, 1, 3], dtype=np.uint8), False)
+    assert update_filter.should_forward(np.array([1, 2, 5], dtype=np.uint8), False)
+    assert update_filter.should_forward(np.array([1, 2], dtype=np.uint8), False)
+
+
+def test_string_values_are_not_deadband_filtered():
+    update_filter = UpdateFilter(FilterSettings(absolute_deadband=1))
+    assert update_filter.should_forward(np.array("on"), False)
+    assert update_filter.should_forward(np.array("on"), False)
+
+
+def test_updates_faster_than_max_rate_are_not_forwarded():
+    update_filter = UpdateFilter(FilterSettings(max_rate_hz=10))
+    with mock.patch(
+        "forwarder.update_handlers.update_filter.time.monotonic"
+    ) as monotonic:
+        monotonic.return_value = 100.0
+        assert update_filter.should_forward(np.array(1), False)
+        monotonic.return_value = 100.05
+        assert not update_filter.should_forward(np.array(2), False)
+        monotonic.return_value = 100.11
+        assert update_filter.should_forward(np.array(3), False)
+
+
+def test_alarm_changes_are_always_forwarded():
+    update_filter = UpdateFilter(
+        FilterSettings(absolute_deadband=100, max_rate_hz=0.001)
+    )
+    assert update_filter.should_forward(np.array(1), False)
+    assert not update_filter.should_forward(np.array(2), False)
+    assert update_filter.should_forward(np.array(2), True)
+
+
+def test_first_matching_pattern_in_filters_file_applies(tmp_path):
+    filters_file = tmp_path / "filters.json"
+    filters_file.write_text(
+        json.dumps(
+            {"NOISY:PV": {"absolute_deadband": 1}, "NOISY:*": {"max_rate_hz": 1}}
+        )
+    )
+    channel_filters = load_channel_filters(str(filters_file))
+
+    update_filter = channel_filters.filter_for("NOISY:PV")
+    assert update_filter is not None
+    assert update_filter.should_forward(np.array(1), False)
+    assert not update_filter.should_forward(np.array(1.5), False)
+    assert channel_filters.filter_for("NOISY:OTHER") is not None
+    assert channel_filters.filter_for("QUIET:PV") is None
+
+
+def test_unknown_setting_in_filters_file_raises(tmp_path):
+    filters_file = tmp_path / "filters.json"
+    filters_file.write_text(json.dumps({"PV": {"not_a_setting": 1}}))
+    with pytest.raises(ValueError):
+        load_channel_filters(str(filters_file))
+
+
+def test_update_held_back_by_max_rate_is_forwarded_once_the_interval_has_passed():
+    update_filter = UpdateFilter(FilterSettings(max_rate_hz=10))
+    with mock.patch(
+        "forwarder.update_handlers.update_filter.time.monotonic"
+    ) as monotonic:
+        monotonic.return_value = 100.0
+        assert update_filter.should_forward(np.array(1), False)
+        monotonic.return_value = 100.04
+        assert not update_filter.should_forward(np.array(2), False)
+        assert update_filter.seconds_until_rate_allows() == pytest.approx(0.06)
+        monotonic.return_value = 100.1
+        assert update_filter.should_forward_held(np.array(2))
+        assert update_filter.filtered_count == 0
+        assert update_filter.seconds_until_rate_allows() == pytest.approx(0.1)
+
+
+def test_held_update_within_deadband_is_not_forwarded():
+    update_filter = UpdateFilter(FilterSettings(absolute_deadband=1, max_rate_hz=10))
+    assert update_filter.should_forward(np.array(1.0), False)
+    assert not update_filter.should_forward(np.array(1.5), False)
+    assert not update_filter.should_forward_held(np.array(1.5))
+    assert update_filter.filtered_count == 1
@@ -0,0 +1,135 @@
+from forwarder.parse_config_update import (
+    Channel,
+    CommandType,
+    ConfigUpdate,
+    EpicsProtocol,
+)
+from forwarder.metrics import Histogram, collect_metrics
+from forwarder.status_reporter import StatusReporter
+from forwarder.worker_pool import WorkerPool, _WorkerStatusReporter
+from queue import Queue
+from streaming_data_types.status_x5f2 import deserialise_x5f2
+from tests.kafka.fake_producer import FakeProducer
+from time import monotonic, sleep
+from unittest import mock
+import json
+import logging
+import pickle
+
+
+def _fake_process(*args, **kwargs):
+    process = mock.Mock()
+    process.is_alive.return_value = True
+    process.name = kwargs["name"]
+    return process
+
+
+def _fake_context() -> mock.Mock:
+    context = mock.Mock()
+    context.Queue.side_effect = Queue
+    context.Process.side_effect = _fake_process
+    return context
+
+
+def _wait_until(condition, timeout_s: float = 2.0):
+    deadline = monotonic() + timeout_s
+    while not condition() and monotonic() < deadline:
+        sleep(0.01)
+
+
+def test_exited_worker_is_restarted_with_its_channels():
+    context = _fake_context()
+    with mock.patch(
+        "forwarder.worker_pool.multiprocessing.get_context", return_value=context
+    ):
+        pool = WorkerPool(2, mock.Mock(), {}, mock.Mock(), mock.Mock())  # type: ignore
+    channel = Channel("SIMPLE:PV", EpicsProtocol.CA, "output_topic", "f142")
+    pool._reports.put((0, [((channel,), None)], {}))
+    deadline = monotonic() + 2
+    while not pool._worker_channels[0] and monotonic() < deadline:
+        sleep(0.01)
+    exited_worker = pool._workers[0]
+
+    exited_worker.is_alive.return_value = False
+    while pool._workers[0] is exited_worker and monotonic() < deadline:
+        sleep(0.01)
+    pool.stop()
+
+    assert pool._workers[0] is not exited_worker
+    assert pool._commands[0].get_nowait() == ConfigUpdate(CommandType.ADD, (channel,))
+    assert context.Process.call_count == 3
+
+
+def _fake_worker_producer(delivered: int) -> mock.Mock:
+    producer = mock.Mock()
+    producer.delivery_statistics.return_value = {"delivered": delivered, "failed": {}}
+    producer.queue_length.return_value = 0
+    producer.backpressure_statistics.return_value = {"dropped": 0, "pending": 0}
+    producer.delivery_latency = Histogram()
+    producer.delivery_latency.observe(0.002)
+    producer.librdkafka_statistics.return_value = None
+    return producer
+
+
+def _fake_worker_handler(updates_received: int) -> mock.Mock:
+    handler = mock.Mock()
+    handler.statistics.return_value = {
+        "updates_received": updates_received,
+        "messages_published": 0,
+        "bytes_published": 0,
+        "delivery_failures": 0,
+        "update_rate_hz": 0.0,
+    }
+    return handler
+
+
+def test_statistics_reported_by_workers_are_merged_in_status_and_metrics():
+    shared_handler = _fake_worker_handler(5)
+    worker_update_handlers = [
+        {
+            Channel("PV1", EpicsProtocol.CA, "topic_1", "f142"): shared_handler,
+            Channel("PV1", EpicsProtocol.CA, "topic_2", "tdct"): shared_handler,
+        },
+        {Channel("PV2", EpicsProtocol.PVA, "topic_1", "f142"): _fake_worker_handler(7)},
+    ]
+    worker_statistics: dict = {}
+    update_handlers: dict = {}
+    status_producer = FakeProducer()
+    status_reporter = StatusReporter(update_handlers, status_producer, "status_topic", "", "version", logging.getLogger(), worker_statistics=worker_statistics)  # type: ignore
+    with mock.patch(
+        "forwarder.worker_pool.multiprocessing.get_context",
+        return_value=_fake_context(),
+    ):
+        pool = WorkerPool(2, mock.Mock(), update_handlers, mock.Mock(), mock.Mock(), worker_statistics)  # type: ignore
+    for worker_index, handlers in enumerate(worker_update_handlers):
+        reports: Queue = Queue()
+        _WorkerStatusReporter(
+            worker_index, handlers, reports, _fake_worker_producer(10), None  # type: ignore
+        ).report_status()
+        # Reports are pickled to be sent from the worker processes
+        pool._reports.put(pickle.loads(pickle.dumps(reports.get_nowait())))
+    _wait_until(lambda: len(worker_statistics) == 2)
+    pool.stop()
+
+    metrics = collect_metrics(update_handlers, None, None, worker_statistics)
+    assert "forwarder_update_handlers 2" in metrics
+    assert (
+        'forwarder_channel_updates_received_total{channel="PV1",protocol="ca"} 5'
+        in metrics
+    )
+    assert (
+        'forwarder_channel_updates_received_total{channel="PV2",protocol="pva"} 7'
+        in metrics
+    )
+    assert 'forwarder_producer_messages_delivered_total{worker="0"} 10' in metrics
+    assert 'forwarder_producer_messages_delivered_total{worker="1"} 10' in metrics
+
+    status_reporter.report_status()
+    status = json.loads(deserialise_x5f2(status_producer.published_payload).status_json)
+    assert sorted(
+        (stream["channel_name"], stream["statistics"]["updates_received"])
+        for stream in status["streams"]
+    ) == [("PV1", 5), ("PV1", 5), ("PV2", 7)]
+    assert status["latency"]["produce_to_delivery"]["count"] == 2
+    assert [worker["worker"] for worker in status["workers"]] == [0, 1]
+    assert status["workers"][0]["delivery"] == {"delivered": 10, "failed": {}}